@@ -1,16 +1,17 @@
 import json
 import logging
 import os
+import random
 import threading
+import time
 import uuid
 from pathlib import Path
 from typing import Any, Dict, List, Optional, TypedDict
 
 import chromadb
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from langchain_community.document_loaders import (
@@ -21,7 +22,15 @@ from langchain_community.document_loaders import (
 import ssl
 
 # Import task manager for queue handling
-from app.common.task_manager import queue_chat_request, get_task_status, TaskStatus
+from app.common.task_manager import (
+    queue_chat_request, get_task_status, TaskStatus, result_store_stats,
+    queue_batch_request, get_batch_status, get_batch_results, BATCH_MAX_QUESTIONS,
+    queue_prefetch_request,
+)
+from app.common import snapshots, tracing
+from app.common.circuit_breaker import circuit_status
+from app.api.static_assets import StaticAssets
+from app.common.profiling import PROFILE_ALLOW_REQUESTS, PROFILE_SAMPLE_RATE, get_profile, get_profile_collapsed
 
 # Load environment variables
 load_dotenv()
@@ -31,8 +40,13 @@ logger = logging.getLogger("app.server")
 
 DB_DIR = os.getenv("DB_DIR", "./chroma_db")
 COLLECTION = os.getenv("COLLECTION", "faq")
+SHARDS = [name.strip() for name in os.getenv("SHARDS", COLLECTION).split(",") if name.strip()]
 TOP_K_DEFAULT = int(os.getenv("TOP_K", "5"))
 ENABLE_WEB_SEARCH = os.getenv("ENABLE_WEB_SEARCH", "true").lower() == "true"
+LATENCY_BUDGET_MS = int(os.getenv("LATENCY_BUDGET_MS", "0"))  # 0 = no default budget
+# Only threaded workers (WORKER_MODE=threaded) serve prefetch_tasks
+ENABLE_PREFETCH = os.getenv("ENABLE_PREFETCH", "false").lower() == "true"
+PREFETCH_MIN_CHARS = int(os.getenv("PREFETCH_MIN_CHARS", "12"))
 
 app = FastAPI(title="Chroma FAQ Chatbot", version="1.1.0")
 
@@ -46,8 +60,10 @@ app.add_middleware(
 )
 
 STATIC_DIR = Path(__file__).parent.parent / "static"
-if STATIC_DIR.exists():
-    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# Minified, hashed and precompressed build output (app/build_static.py) wins over sources;
+# the image builds it outside app/ so a bind mount of ./app doesn't hide it
+STATIC_DIST_DIR = Path(os.getenv("STATIC_DIST_DIR", str(STATIC_DIR / "dist")))
+static_assets = StaticAssets(STATIC_DIST_DIR, STATIC_DIR)
 
 
 class AskBody(BaseModel):
@@ -55,6 +71,9 @@ class AskBody(BaseModel):
     top_k: int | None = None
     session_id: str | None = None
     use_web_search: bool | None = None
+    profile: bool | None = None
+    latency_budget_ms: int | None = None
+    shards: List[str] | None = None
 
 
 class TaskResponse(BaseModel):
@@ -62,36 +81,84 @@ class TaskResponse(BaseModel):
     status: str = "queued"
 
 
+class PrefetchBody(BaseModel):
+    question: str
+    session_id: str
+    top_k: int | None = None
+    shards: List[str] | None = None
+
+
+class BatchAskBody(BaseModel):
+    questions: List[str]
+    top_k: int | None = None
+    use_web_search: bool | None = None
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    total: int
+    status: str = "queued"
+
+
 @app.get("/", include_in_schema=False)
-def serve_index() -> FileResponse:
-    index_path = STATIC_DIR / "index.html"
-    if not index_path.exists():
+def serve_index(request: Request) -> Response:
+    response = static_assets.response(request, "index.html")
+    if response is None:
         raise HTTPException(status_code=404, detail="Chat UI not found")
-    return FileResponse(index_path)
+    return response
 
 
 @app.get("/embed", include_in_schema=False)
-def serve_embed() -> FileResponse:
-    embed_path = STATIC_DIR / "embed.html"
-    if not embed_path.exists():
+def serve_embed(request: Request) -> Response:
+    response = static_assets.response(request, "embed.html")
+    if response is None:
         raise HTTPException(status_code=404, detail="Embed UI not found")
-    return FileResponse(embed_path)
+    return response
+
+
+@app.get("/static/{asset_path:path}", include_in_schema=False)
+def serve_static(asset_path: str, request: Request) -> Response:
+    response = static_assets.response(request, asset_path)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "db_dir": DB_DIR, "collection": COLLECTION}
+    return {
+        "status": "ok",
+        "db_dir": DB_DIR,
+        "collection": COLLECTION,
+        "shards": SHARDS,
+        "circuits": circuit_status(),
+        "result_store": result_store_stats(),
+        "index": {
+            "snapshot_dir": snapshots.SNAPSHOT_DIR or None,
+            "published_version": snapshots.current_version() if snapshots.SNAPSHOT_DIR else None,
+            # Worker processes per active version; two entries while a switch is rolling out
+            "worker_versions": snapshots.fleet_versions(),
+        },
+    }
 
 
 # -------- Task Management Endpoints --------
 @app.post("/ask", response_model=TaskResponse)
-def queue_ask_request(body: AskBody):
+def queue_ask_request(body: AskBody, request: Request, response: Response):
     """
     Queue a chat request for asynchronous processing.
 
     Returns:
         TaskResponse: Contains the task ID for polling the result.
     """
+    root = tracing.new_root(request.headers.get("traceparent"))
+    with tracing.span("POST /ask", parent=root, kind="server", **{"http.route": "/ask"}) as ask_span:
+        if ask_span is not None:
+            response.headers["X-Trace-Id"] = ask_span.context.trace_id
+        return _queue_ask(body)
+
+
+def _queue_ask(body: AskBody) -> TaskResponse:
     question = body.question.strip()
     top_k = body.top_k or TOP_K_DEFAULT
     session_id = body.session_id or str(uuid.uuid4())
@@ -102,11 +169,49 @@ def queue_ask_request(body: AskBody):
         task_id = queue_chat_request("", session_id, top_k, use_web_search)
         return TaskResponse(task_id=task_id, status=TaskStatus.QUEUED)
 
+    # Profiling costs the worker a sampler thread, so clients may only ask for it when allowed
+    profile = body.profile if PROFILE_ALLOW_REQUESTS else None
+    if profile is None:
+        profile = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
     # Queue the chat request
-    task_id = queue_chat_request(question, session_id, top_k, use_web_search)
+    task_id = queue_chat_request(
+        question,
+        session_id,
+        top_k,
+        use_web_search,
+        profile=profile,
+        latency_budget_ms=body.latency_budget_ms or LATENCY_BUDGET_MS or None,
+        shards=body.shards,
+    )
     return TaskResponse(task_id=task_id, status=TaskStatus.QUEUED)
 
 
+@app.post("/prefetch", status_code=202)
+def prefetch_candidates(body: PrefetchBody):
+    """
+    Start retrieval for a question the user is still typing.
+
+    Workers embed, retrieve and rerank in the background and cache the candidates
+    for the session; an ``/ask`` with a close enough question then skips straight to
+    the LLM. A newer prefetch from the same session replaces a queued one and stops a
+    running one between stages.
+
+    Returns:
+        The prefetch ID, ``skipped`` when the question is too short, or ``disabled``
+        when prefetch is off so the widget stops sending them.
+    """
+    if not ENABLE_PREFETCH:
+        return {"status": "disabled"}
+    question = body.question.strip()
+    if len(question) < PREFETCH_MIN_CHARS:
+        return {"status": "skipped"}
+    prefetch_id = queue_prefetch_request(question, body.session_id, body.top_k or TOP_K_DEFAULT, shards=body.shards)
+    if prefetch_id is None:
+        raise HTTPException(status_code=429, detail="Too many prefetch requests for this session")
+    return {"prefetch_id": prefetch_id, "status": TaskStatus.QUEUED}
+
+
 @app.get("/tasks/{task_id}")
 def get_task_result(task_id: str):
     """
@@ -126,5 +231,139 @@ def get_task_result(task_id: str):
     return task_status
 
 
+@app.post("/ask/batch", response_model=BatchResponse)
+async def queue_batch_ask_request(request: Request):
+    """
+    Queue many questions as one batch job.
+
+    Accepts either a JSON body (``{"questions": [...], "top_k": ..., "use_web_search": ...}``)
+    or an uploaded JSONL/NDJSON body (``Content-Type: application/x-ndjson``) with one
+    ``{"question": ...}`` object or JSON string per line; options then come from the query string.
+
+    Returns:
+        BatchResponse: Contains the batch ID for progress and result streaming.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        questions: List[str] = []
+        raw = (await request.body()).decode("utf-8")
+        for line_no, line in enumerate(raw.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=400, detail=f"Line {line_no} is not valid JSON")
+            question = item.get("question") if isinstance(item, dict) else item
+            if not isinstance(question, str):
+                raise HTTPException(status_code=422, detail=f"Line {line_no}: question must be a string")
+            questions.append(question)
+        params = request.query_params
+        # Options go through the same model as JSON bodies, so bad values are a 422, not a 500
+        fields = {"questions": questions, "top_k": params.get("top_k"), "use_web_search": params.get("use_web_search")}
+    else:
+        try:
+            fields = await request.json()
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Body is not valid JSON")
+        if not isinstance(fields, dict):
+            raise HTTPException(status_code=422, detail="Invalid batch body: expected a JSON object")
+    try:
+        body = BatchAskBody(**{key: value for key, value in fields.items() if value is not None})
+    except Exception as exc:
+        raise HTTPException(status_code=422, detail=f"Invalid batch body: {exc}")
+    questions, top_k, use_web_search = body.questions, body.top_k, body.use_web_search
+
+    if not questions:
+        raise HTTPException(status_code=400, detail="No questions supplied")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {BATCH_MAX_QUESTIONS} questions")
+
+    # Web search is opt-in for batches: thousands of DuckDuckGo calls are rarely wanted
+    batch_id = queue_batch_request(
+        [q.strip() for q in questions],
+        top_k or TOP_K_DEFAULT,
+        bool(use_web_search),
+    )
+    return BatchResponse(batch_id=batch_id, total=len(questions))
+
+
+@app.get("/batches/{batch_id}")
+def get_batch_progress(batch_id: str):
+    """
+    Get the progress of a batch.
+
+    Args:
+        batch_id: The batch identifier
+
+    Returns:
+        Status plus total, completed and failed question counts.
+    """
+    status = get_batch_status(batch_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+
+@app.get("/batches/{batch_id}/results")
+def stream_batch_results(batch_id: str, follow: bool = True, start: int = 0):
+    """
+    Stream batch results as NDJSON.
+
+    Each finished question is one ``{"type": "result", ...}`` line, in question order.
+    With ``follow`` (the default) the stream stays open until the batch ends, emitting
+    a ``{"type": "progress", ...}`` line after each new group of results.
+
+    Args:
+        batch_id: The batch identifier
+        follow: Keep streaming until the batch completes
+        start: Index of the first result to send (to resume a dropped stream)
+    """
+    if not get_batch_status(batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    def generate():
+        position = start
+        while True:
+            results = get_batch_results(batch_id, position)
+            for result in results:
+                yield json.dumps({"type": "result", **result}) + "\n"
+            position += len(results)
+
+            status = get_batch_status(batch_id) or {"status": TaskStatus.FAILED}
+            if results or not follow:
+                yield json.dumps({"type": "progress", **status}) + "\n"
+            done = status["status"] in (TaskStatus.COMPLETED, TaskStatus.FAILED)
+            if not follow or (done and position >= status.get("completed", 0)):
+                return
+            time.sleep(0.5)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.get("/tasks/{task_id}/profile")
+def get_task_profile(task_id: str, format: str = "json"):
+    """
+    Get the profile captured for a profiled task.
+
+    Args:
+        task_id: The task identifier
+        format: ``json`` for the summary, ``collapsed`` for flamegraph-compatible stacks
+
+    Returns:
+        The profile summary, or collapsed stacks as plain text.
+    """
+    if format == "collapsed":
+        collapsed = get_profile_collapsed(task_id)
+        if collapsed is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return PlainTextResponse(collapsed)
+
+    profile = get_profile(task_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
 # -------- Document watch / auto re-ingest --------
 # (Keeping the existing document watching functionality as it's not part of the request processing)
@@ -0,0 +1,140 @@
+"""
+In-memory static asset serving with content negotiation and validators.
+
+Assets come from the build output (``STATIC_DIST_DIR``, by default ``app/static/dist``;
+see ``app/build_static.py``)
+when present, falling back to the source directory. Each file is loaded once with
+its precompressed ``.gz``/``.br`` siblings (compressed at load time if the build
+did not provide them), and served with:
+
+- ``Content-Encoding`` negotiated from ``Accept-Encoding`` (brotli, then gzip);
+- a strong ``ETag`` per representation, answering ``If-None-Match`` with 304;
+- ``Cache-Control: immutable`` for content-hashed names, revalidation otherwise.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "300"))
+IMMUTABLE_MAX_AGE = 31536000
+COMPRESS_MIN_BYTES = 512
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8}\.[A-Za-z0-9]+$")
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class Asset:
+    def __init__(self, path: Path, data: bytes, variants: Dict[str, bytes], mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.variants = {"identity": data, **variants}
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.variants
+        }
+        media_type, _ = mimetypes.guess_type(path.name)
+        self.media_type = media_type or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type == "application/javascript":
+            self.media_type += "; charset=utf-8"
+        if HASHED_NAME.search(path.name):
+            self.cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        elif path.suffix in (".html", ".htm"):
+            self.cache_control = "no-cache"
+        else:
+            self.cache_control = f"public, max-age={STATIC_MAX_AGE}"
+
+
+def _accepted_encodings(header: str) -> List[str]:
+    accepted = []
+    for part in header.split(","):
+        token, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if token and quality > 0:
+            accepted.append(token.lower())
+    return accepted
+
+
+class StaticAssets:
+    """Serves files from the first root that has them, cached in memory."""
+
+    def __init__(self, *roots: Path):
+        self.roots = [root.resolve() for root in roots if root.exists()]
+        self._cache: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+
+    def _locate(self, name: str) -> Optional[Path]:
+        for root in self.roots:
+            path = (root / name).resolve()
+            if root in path.parents and path.is_file():
+                return path
+        return None
+
+    def _load(self, path: Path) -> Asset:
+        data = path.read_bytes()
+        media_type, _ = mimetypes.guess_type(path.name)
+        variants: Dict[str, bytes] = {}
+        if len(data) >= COMPRESS_MIN_BYTES and (media_type or "").startswith(COMPRESSIBLE_TYPES):
+            for encoding, suffix, compress in (
+                ("br", ".br", (lambda d: brotli.compress(d, quality=11)) if brotli else None),
+                ("gzip", ".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0)),
+            ):
+                sibling = path.with_name(path.name + suffix)
+                if sibling.is_file() and sibling.stat().st_mtime >= path.stat().st_mtime:
+                    variants[encoding] = sibling.read_bytes()
+                elif compress is not None:
+                    variants[encoding] = compress(data)
+        return Asset(path, data, variants, path.stat().st_mtime)
+
+    def get(self, name: str) -> Optional[Asset]:
+        path = self._locate(name)
+        if path is None:
+            return None
+        asset = self._cache.get(name)
+        # One stat per request keeps edited source files fresh during development
+        if asset is None or asset.path != path or asset.mtime != path.stat().st_mtime:
+            with self._lock:
+                asset = self._load(path)
+                self._cache[name] = asset
+        return asset
+
+    def response(self, request: Request, name: str) -> Optional[Response]:
+        asset = self.get(name)
+        if asset is None:
+            return None
+
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in accepted and e in asset.variants), "identity")
+        headers = {
+            "ETag": asset.etags[encoding],
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or asset.etags[encoding] in [
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        ]:
+            return Response(status_code=304, headers=headers)
+
+        return Response(content=asset.variants[encoding], media_type=asset.media_type, headers=headers)
@@ -0,0 +1,156 @@
+"""
+Build-time pipeline for the chat widget's static assets.
+
+Minifies JS/CSS/HTML, writes content-hashed copies of JS and CSS (``chat.3f9a1c2b.js``),
+rewrites ``/static/...`` references in the HTML pages to the hashed names, and
+stores gzip (and brotli, when the ``brotli`` package is installed) variants next to
+every file so the API can serve them without compressing per request.
+
+Unhashed copies are kept too: ``embed.js`` is referenced by third-party pages under a
+fixed URL, and the HTML pages are served at ``/`` and ``/embed``.
+
+Example:
+    python -m app.build_static --src app/static --out app/static/dist
+
+``--out`` defaults to ``STATIC_DIST_DIR`` when set, which is where the API looks too.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Dict
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+HASHED_SUFFIXES = {".js", ".css"}
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".json", ".svg", ".txt", ".map"}
+
+
+def _strip_lines(source: str) -> str:
+    """Drop indentation and blank lines, leaving multi-line template literals untouched."""
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped:
+                lines.append(stripped)
+        if (line.count("`") - line.count("\\`")) % 2:
+            in_template = not in_template
+    return "\n".join(lines) + "\n"
+
+
+def minify_js(source: str) -> str:
+    try:
+        import rjsmin
+    except ImportError:
+        # Line-preserving fallback keeps automatic semicolon insertion intact
+        return _strip_lines(source)
+    return rjsmin.jsmin(source)
+
+
+def minify_css(source: str) -> str:
+    try:
+        import rcssmin
+    except ImportError:
+        source = re.sub(r"/\*.*?\*/", "", source, flags=re.S)
+        source = re.sub(r"\s+", " ", source)
+        return re.sub(r"\s*([{};,>])\s*", r"\1", source).strip() + "\n"
+    return rcssmin.cssmin(source)
+
+
+def minify_html(source: str) -> str:
+    return _strip_lines(re.sub(r"<!--(?!\[).*?-->", "", source, flags=re.S))
+
+
+MINIFIERS = {".js": minify_js, ".css": minify_css, ".html": minify_html, ".htm": minify_html}
+
+
+def content_hash(data: bytes, length: int = 8) -> str:
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def write_variants(path: Path, data: bytes) -> None:
+    """Write ``path`` plus precompressed ``.gz``/``.br`` siblings for text assets."""
+    path.write_bytes(data)
+    if path.suffix not in COMPRESSIBLE_SUFFIXES:
+        return
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
+
+
+def build(src: Path, out: Path) -> Dict[str, str]:
+    """Build ``src`` into ``out`` and return the logical -> hashed name manifest."""
+    if out.exists():
+        shutil.rmtree(out)
+    out.mkdir(parents=True)
+
+    manifest: Dict[str, str] = {}
+    pages: Dict[Path, str] = {}
+    for path in sorted(src.rglob("*")):
+        if not path.is_file() or out in path.parents:
+            continue
+        relative = path.relative_to(src)
+        target = out / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        minify = MINIFIERS.get(path.suffix.lower())
+        if minify is None:
+            shutil.copy2(path, target)
+            continue
+
+        text = minify(path.read_text(encoding="utf-8"))
+        if path.suffix.lower() in (".html", ".htm"):
+            # Written once every hashed name is known
+            pages[target] = text
+            continue
+
+        data = text.encode("utf-8")
+        write_variants(target, data)
+        if path.suffix.lower() in HASHED_SUFFIXES:
+            hashed = relative.with_name(f"{relative.stem}.{content_hash(data)}{relative.suffix}")
+            write_variants(out / hashed, data)
+            manifest[relative.as_posix()] = hashed.as_posix()
+
+    for target, text in pages.items():
+        for logical, hashed in manifest.items():
+            text = text.replace(f"/static/{logical}", f"/static/{hashed}")
+        write_variants(target, text.encode("utf-8"))
+
+    (out / "manifest.json").write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minify, hash and precompress the widget's static assets.")
+    default_src = Path(__file__).resolve().parent / "static"
+    parser.add_argument("--src", type=str, default=str(default_src), help="Source static directory")
+    parser.add_argument(
+        "--out",
+        type=str,
+        default=os.getenv("STATIC_DIST_DIR", str(default_src / "dist")),
+        help="Output directory (default: STATIC_DIST_DIR, else app/static/dist)",
+    )
+    args = parser.parse_args()
+
+    src, out = Path(args.src), Path(args.out)
+    manifest = build(src, out)
+    source_bytes = sum(p.stat().st_size for p in src.rglob("*") if p.is_file() and out not in p.parents)
+    built_bytes = sum(
+        p.stat().st_size for p in out.rglob("*") if p.is_file() and p.suffix not in (".gz", ".br")
+        and p.name != "manifest.json" and p.relative_to(out).as_posix() not in manifest.values()
+    )
+    print(f"Built {len(manifest)} hashed assets into {out} ({source_bytes} -> {built_bytes} bytes before compression)")
+
+
+if __name__ == "__main__":
+    main()
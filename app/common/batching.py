@@ -0,0 +1,202 @@
+"""
+Length-bucketed batching for embedder and cross-encoder inference.
+
+Transformer batches are padded to their longest member, so feeding inputs in
+arrival order (short FAQ answers next to full chunks) spends most of the compute on
+padding. Inputs are sorted by token length and grouped into buckets bounded by
+padded token count (``len(bucket) * longest``) rather than item count, and split
+where lengths jump; each bucket is one forward pass and outputs are restored to the
+original order.
+
+Every call reports real tokens, padded tokens, tokens per second and padding
+waste; totals per model are kept for logging and the ingest summary.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.common import profiling, tracing
+
+MAX_BATCH_TOKENS = int(os.getenv("MAX_BATCH_TOKENS", "8192"))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "128"))
+# Start a new bucket once an input is this much longer than the bucket's shortest,
+# provided the bucket already holds MIN_BATCH_ITEMS (tiny batches waste per-call overhead)
+BATCH_LENGTH_RATIO = float(os.getenv("BATCH_LENGTH_RATIO", "1.5"))
+MIN_BATCH_ITEMS = int(os.getenv("MIN_BATCH_ITEMS", "4"))
+# Model forward passes allowed at once per process; jobs running on threads queue for a slot
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
+# Log cumulative inference stats every N calls per model (0 = never)
+BATCH_STATS_LOG_EVERY = int(os.getenv("BATCH_STATS_LOG_EVERY", "200"))
+
+
+@dataclass
+class BatchStats:
+    calls: int = 0
+    items: int = 0
+    batches: int = 0
+    tokens: int = 0
+    padded_tokens: int = 0
+    seconds: float = 0.0
+
+    def add(self, other: "BatchStats") -> None:
+        self.calls += other.calls
+        self.items += other.items
+        self.batches += other.batches
+        self.tokens += other.tokens
+        self.padded_tokens += other.padded_tokens
+        self.seconds += other.seconds
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    @property
+    def padding_waste(self) -> float:
+        """Fraction of the computed tokens that were padding."""
+        return 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "items": self.items,
+            "batches": self.batches,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "seconds": round(self.seconds, 4),
+            "tokens_per_second": round(self.tokens_per_second, 1),
+            "padding_waste": round(self.padding_waste, 4),
+        }
+
+
+_totals: Dict[str, BatchStats] = {}
+_totals_lock = threading.Lock()
+_inference_slots = threading.BoundedSemaphore(max(1, INFERENCE_CONCURRENCY))
+
+
+def _record(name: str, stats: BatchStats) -> None:
+    with _totals_lock:
+        total = _totals.setdefault(name, BatchStats())
+        total.add(stats)
+        if BATCH_STATS_LOG_EVERY and total.calls % BATCH_STATS_LOG_EVERY == 0:
+            logging.info("Inference stats for %s: %s", name, total.as_dict())
+
+
+def inference_stats() -> Dict[str, Dict[str, Any]]:
+    """Cumulative stats per model name since process start."""
+    with _totals_lock:
+        return {name: stats.as_dict() for name, stats in _totals.items()}
+
+
+def _max_length(model: Any) -> int:
+    for attr in ("max_seq_length", "max_length"):
+        value = getattr(model, attr, None)
+        if isinstance(value, int) and value > 0:
+            return value
+    return 512
+
+
+def token_lengths(model: Any, first: Sequence[str], second: Sequence[str] = None) -> List[int]:
+    """Token count per input (or per text pair) after truncation, including special tokens."""
+    max_length = _max_length(model)
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            args = (list(first), list(second)) if second is not None else (list(first),)
+            encoded = tokenizer(*args, truncation=True, max_length=max_length)
+            return [len(ids) for ids in encoded["input_ids"]]
+        except Exception as exc:  # pragma: no cover - tokenizer quirks
+            logging.debug("Falling back to estimated token lengths: %s", exc)
+    # Rough estimate: ~4 characters per token
+    texts = first if second is None else [a + b for a, b in zip(first, second)]
+    return [min(max_length, len(text) // 4 + 2) for text in texts]
+
+
+def plan_buckets(
+    lengths: Sequence[int], max_tokens: int = MAX_BATCH_TOKENS, max_items: int = MAX_BATCH_ITEMS
+) -> List[List[int]]:
+    """Group input indices, shortest first, so no bucket pads beyond ``max_tokens``."""
+    buckets: List[List[int]] = []
+    current: List[int] = []
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Sorted ascending, so the newcomer sets the padded length of the bucket
+        if current and (
+            (len(current) + 1) * lengths[idx] > max_tokens
+            or len(current) >= max_items
+            or (len(current) >= MIN_BATCH_ITEMS and lengths[idx] > BATCH_LENGTH_RATIO * lengths[current[0]])
+        ):
+            buckets.append(current)
+            current = []
+        current.append(idx)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def run_bucketed(
+    name: str,
+    inputs: Sequence[Any],
+    lengths: Sequence[int],
+    infer: Callable[[List[Any]], Sequence[Any]],
+    max_tokens: int = MAX_BATCH_TOKENS,
+    max_items: int = MAX_BATCH_ITEMS,
+) -> Tuple[List[Any], BatchStats]:
+    """Run ``infer`` once per bucket and return its outputs in input order."""
+    outputs: List[Any] = [None] * len(inputs)
+    stats = BatchStats(calls=1, items=len(inputs))
+    slot_wait = 0.0
+    with tracing.span(f"inference:{name}") as inference_span:
+        for bucket in plan_buckets(lengths, max_tokens, max_items):
+            queued = time.perf_counter()
+            with _inference_slots:
+                start = time.perf_counter()
+                # Time spent behind other jobs' forward passes (threaded workers share the slots)
+                slot_wait += start - queued
+                results = infer([inputs[i] for i in bucket])
+                stats.seconds += time.perf_counter() - start
+            stats.batches += 1
+            stats.tokens += sum(lengths[i] for i in bucket)
+            stats.padded_tokens += len(bucket) * max(lengths[i] for i in bucket)
+            for i, result in zip(bucket, results):
+                outputs[i] = result
+        if inference_span is not None:
+            for key, value in stats.as_dict().items():
+                inference_span.set_attribute(f"inference.{key}", value)
+            inference_span.set_attribute("inference.slot_wait_ms", round(slot_wait * 1000, 3))
+    profiler = profiling.current()
+    if profiler is not None:
+        profiler.record(f"wait:inference_slot:{name}", slot_wait)
+    _record(name, stats)
+    logging.debug("%s: %s", name, stats.as_dict())
+    return outputs, stats
+
+
+def encode(model: Any, texts: Sequence[str], name: str = "embed") -> np.ndarray:
+    """Normalized sentence embeddings for ``texts`` via length-bucketed batches."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    def infer(batch: List[str]):
+        return model.encode(
+            batch, batch_size=len(batch), show_progress_bar=False, normalize_embeddings=True
+        )
+
+    outputs, _ = run_bucketed(name, list(texts), token_lengths(model, texts), infer)
+    return np.vstack(outputs)
+
+
+def predict(model: Any, pairs: Sequence[Tuple[str, str]], name: str = "rerank") -> List[float]:
+    """Cross-encoder scores for ``(query, document)`` pairs via length-bucketed batches."""
+    if not pairs:
+        return []
+
+    def infer(batch: List[Tuple[str, str]]):
+        return model.predict(batch, batch_size=len(batch), show_progress_bar=False)
+
+    lengths = token_lengths(model, [q for q, _ in pairs], [d for _, d in pairs])
+    outputs, _ = run_bucketed(name, list(pairs), lengths, infer)
+    return [float(score) for score in outputs]
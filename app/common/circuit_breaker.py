@@ -0,0 +1,145 @@
+"""
+Circuit breakers for upstream services, shared by every worker through Redis.
+
+Each breaker counts calls, failures and slow calls in fixed time buckets. When
+the failure rate over the last two buckets reaches CB_FAILURE_RATE (with at least
+CB_MIN_CALLS calls), the breaker opens and callers skip the upstream and use their
+existing fallbacks. After CB_OPEN_SECONDS one caller is allowed through as a
+half-open probe: success closes the breaker, failure re-opens it.
+
+If Redis itself is unavailable the breakers stay out of the way and allow calls.
+"""
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.common.task_manager import redis_conn
+
+CB_FAILURE_RATE = float(os.getenv("CB_FAILURE_RATE", "0.5"))
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "10"))
+CB_WINDOW_SECONDS = int(os.getenv("CB_WINDOW_SECONDS", "30"))
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "30"))
+CB_PROBE_TIMEOUT = int(os.getenv("CB_PROBE_TIMEOUT", "60"))
+LLM_SLOW_CALL_MS = float(os.getenv("LLM_SLOW_CALL_MS", "30000"))
+WEB_SEARCH_SLOW_CALL_MS = float(os.getenv("WEB_SEARCH_SLOW_CALL_MS", "5000"))
+
+
+class CircuitState:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Redis-backed breaker for one upstream, tracking error rate and slow calls."""
+
+    def __init__(self, name: str, slow_call_ms: float):
+        self.name = name
+        self.slow_call_ms = slow_call_ms
+        self.key = f"circuit:{name}"
+        self.probe_key = f"circuit:{name}:probe"
+
+    def _bucket_key(self, bucket: int) -> str:
+        return f"circuit:{self.name}:window:{bucket}"
+
+    def allow(self) -> Optional[str]:
+        """Return a ticket (``closed`` or ``probe``) if the call may go ahead, else None."""
+        try:
+            fields = redis_conn.hgetall(self.key)
+            state = fields.get(b"state", b"closed").decode()
+            if state == CircuitState.CLOSED:
+                return CircuitState.CLOSED
+            opened_at = float(fields.get(b"opened_at", 0))
+            if state == CircuitState.OPEN and time.time() - opened_at < CB_OPEN_SECONDS:
+                return None
+            # Open long enough: let exactly one caller probe the upstream
+            if redis_conn.set(self.probe_key, "1", nx=True, ex=CB_PROBE_TIMEOUT):
+                redis_conn.hset(self.key, "state", CircuitState.HALF_OPEN)
+                return "probe"
+            return None
+        except Exception as exc:  # pragma: no cover - redis outages
+            logging.debug("Circuit %s unavailable, allowing call: %s", self.name, exc)
+            return CircuitState.CLOSED
+
+    def record(self, ticket: Optional[str], success: bool, elapsed_ms: float) -> None:
+        """Record the outcome of a call made with a ticket from :meth:`allow`."""
+        if ticket is None:
+            return
+        failed = not success or elapsed_ms > self.slow_call_ms
+        try:
+            if ticket == "probe":
+                if failed:
+                    self._open(reason="probe failed")
+                else:
+                    self._close()
+                return
+
+            bucket = int(time.time() // CB_WINDOW_SECONDS)
+            pipe = redis_conn.pipeline()
+            pipe.hincrby(self._bucket_key(bucket), "calls", 1)
+            pipe.hincrby(self._bucket_key(bucket), "failures", int(failed))
+            pipe.expire(self._bucket_key(bucket), CB_WINDOW_SECONDS * 3)
+            pipe.hgetall(self._bucket_key(bucket - 1))
+            current_calls, current_failures, _, previous = pipe.execute()
+            if not failed:
+                return
+            calls = current_calls + int(previous.get(b"calls", 0))
+            failures = current_failures + int(previous.get(b"failures", 0))
+            if calls >= CB_MIN_CALLS and failures / calls >= CB_FAILURE_RATE:
+                self._open(reason=f"{failures}/{calls} calls failed or were slow")
+        except Exception as exc:  # pragma: no cover - redis outages
+            logging.debug("Circuit %s unavailable, outcome dropped: %s", self.name, exc)
+
+    def release(self, ticket: Optional[str]) -> None:
+        """Give a ticket back without an outcome (e.g. the caller's own deadline cut it short)."""
+        if ticket != "probe":
+            return
+        try:
+            redis_conn.delete(self.probe_key)
+        except Exception as exc:  # pragma: no cover - redis outages
+            logging.debug("Circuit %s unavailable, probe not released: %s", self.name, exc)
+
+    def _open(self, reason: str) -> None:
+        if redis_conn.hget(self.key, "state") != CircuitState.OPEN.encode():
+            logging.warning("Circuit %s opened: %s", self.name, reason)
+        pipe = redis_conn.pipeline()
+        pipe.hset(self.key, mapping={"state": CircuitState.OPEN, "opened_at": time.time(), "reason": reason})
+        pipe.delete(self.probe_key)
+        pipe.execute()
+
+    def _close(self) -> None:
+        logging.info("Circuit %s closed: probe succeeded", self.name)
+        bucket = int(time.time() // CB_WINDOW_SECONDS)
+        pipe = redis_conn.pipeline()
+        pipe.hset(self.key, mapping={"state": CircuitState.CLOSED, "opened_at": 0, "reason": ""})
+        pipe.delete(self.probe_key, self._bucket_key(bucket), self._bucket_key(bucket - 1))
+        pipe.execute()
+
+    def status(self) -> Dict[str, Any]:
+        fields = redis_conn.hgetall(self.key)
+        bucket = int(time.time() // CB_WINDOW_SECONDS)
+        windows = [redis_conn.hgetall(self._bucket_key(b)) for b in (bucket, bucket - 1)]
+        calls = sum(int(w.get(b"calls", 0)) for w in windows)
+        failures = sum(int(w.get(b"failures", 0)) for w in windows)
+        opened_at = float(fields.get(b"opened_at", 0) or 0)
+        return {
+            "state": fields.get(b"state", b"closed").decode(),
+            "opened_at": opened_at or None,
+            "reason": fields.get(b"reason", b"").decode() or None,
+            "recent_calls": calls,
+            "recent_failure_rate": round(failures / calls, 3) if calls else 0.0,
+        }
+
+
+llm_breaker = CircuitBreaker("llm", slow_call_ms=LLM_SLOW_CALL_MS)
+web_search_breaker = CircuitBreaker("web_search", slow_call_ms=WEB_SEARCH_SLOW_CALL_MS)
+BREAKERS = {breaker.name: breaker for breaker in (llm_breaker, web_search_breaker)}
+
+
+def circuit_status() -> Dict[str, Any]:
+    """State of every breaker, for /health."""
+    try:
+        return {name: breaker.status() for name, breaker in BREAKERS.items()}
+    except Exception as exc:  # pragma: no cover - redis outages
+        return {"error": str(exc)}
@@ -1,15 +1,22 @@
 """
 Core shared functionality for both API and Worker services.
 """
+import hashlib
 import json
 import logging
+import operator
 import os
 import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Any, Dict, List, Optional, TypedDict
+from typing import Annotated, Any, Callable, Dict, List, Optional, Tuple, TypedDict, Union
 from dotenv import load_dotenv
 
+import numpy as np
+
 import chromadb
 from sentence_transformers import CrossEncoder, SentenceTransformer
 from langchain_community.tools import DuckDuckGoSearchResults
@@ -18,6 +25,10 @@ from langchain_community.document_loaders import (
     PyPDFLoader, DirectoryLoader, TextLoader, BSHTMLLoader
 )
 
+from app.common import batching, profiling, snapshots, tracing
+from app.common.embedding_codec import codec_path, load_codec
+from app.common.circuit_breaker import llm_breaker, web_search_breaker
+
 # Load environment variables
 load_dotenv()
 
@@ -27,21 +38,52 @@ COLLECTION = os.getenv("COLLECTION", "faq")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-12-v2")
 TOP_K_DEFAULT = int(os.getenv("TOP_K", "5"))
+# Candidates fetched from Chroma for the reranker (never fewer than top_k)
+CANDIDATE_K = int(os.getenv("CANDIDATE_K", "20"))
 ENABLE_WEB_SEARCH = os.getenv("ENABLE_WEB_SEARCH", "true").lower() == "true"
 WEB_SEARCH_K = int(os.getenv("WEB_SEARCH_K", "3"))
 DATA_DIR = Path(os.getenv("DATA_DIR", "./data"))
 WATCH_DOCS = os.getenv("WATCH_DOCS", "true").lower() == "true"
 REINGEST_DEBOUNCE = float(os.getenv("REINGEST_DEBOUNCE", "3.0"))
+# FAQ direct answers: questions this close to an indexed FAQ question skip rerank + LLM
+ENABLE_FAQ_DIRECT = os.getenv("ENABLE_FAQ_DIRECT", "true").lower() == "true"
+FAQ_COLLECTION = os.getenv("FAQ_COLLECTION", f"{COLLECTION}_qa")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.9"))
+# Sharding: collections queried in parallel and merged by distance (default: just COLLECTION)
+SHARDS = [name.strip() for name in os.getenv("SHARDS", COLLECTION).split(",") if name.strip()]
+# {"shard": ["keyword", ...]}: questions mentioning a keyword only go to the matching shards
+SHARD_ROUTES: Dict[str, List[str]] = json.loads(os.getenv("SHARD_ROUTES", "{}"))
+# Route by shard centroid similarity: shards within this margin of the best one are queried (0 = off)
+SHARD_CENTROID_MARGIN = float(os.getenv("SHARD_CENTROID_MARGIN", "0"))
+SHARD_CENTROID_SAMPLE = int(os.getenv("SHARD_CENTROID_SAMPLE", "2000"))
+SHARD_CENTROID_TTL = float(os.getenv("SHARD_CENTROID_TTL", "300"))
+# Latency budgets: per-stage cost estimates used to degrade instead of overrunning a deadline
+RERANK_MS_PER_PAIR = float(os.getenv("RERANK_MS_PER_PAIR", "5"))
+WEB_SEARCH_MIN_MS = float(os.getenv("WEB_SEARCH_MIN_MS", "1500"))
+# Budgeted web searches in flight per process, counting abandoned ones still running
+WEB_SEARCH_CONCURRENCY = int(os.getenv("WEB_SEARCH_CONCURRENCY", "8"))
+LLM_MIN_MS = float(os.getenv("LLM_MIN_MS", "2000"))
+LLM_TOKENS_PER_SECOND = float(os.getenv("LLM_TOKENS_PER_SECOND", "30"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "0"))  # 0 = provider default
+# Dimension/precision transform written by ingest; applied to every query embedding
+EMBED_CODEC_PATH = codec_path(DB_DIR)
+# Shared location ingest publishes index snapshots to; empty = serve DB_DIR in place
+SNAPSHOT_DIR = snapshots.SNAPSHOT_DIR
+# Intra-op threads for local model inference (set per worker by the supervisor; 0 = torch default)
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
 
 # Optional LLM (OpenAI-compatible)
 USE_LLM = bool(os.getenv("OPENAI_API_KEY"))
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# Request field some gateways use to pin a prompt-cache key, e.g. "prompt_cache_key" (empty = don't send)
+LLM_CACHE_KEY_PARAM = os.getenv("LLM_CACHE_KEY_PARAM", "")
+# Log cumulative prompt/cached token counts every N LLM calls (0 = never)
+LLM_USAGE_LOG_EVERY = int(os.getenv("LLM_USAGE_LOG_EVERY", "200"))
 
 if USE_LLM:
     try:
         from openai import OpenAI
-        from google import genai
         import httpx
 
         # Initialize OpenAI client with SSL verification disabled for testing
@@ -58,13 +100,50 @@ if USE_LLM:
 else:
     openai_client = None
 
+
+
+def _open_index(db_dir: str) -> Tuple[Any, Dict[str, Any], Dict[str, Any], Any]:
+    """Client, shard collections, per-shard FAQ collections and embedding codec of the index in ``db_dir``."""
+    index_client = chromadb.PersistentClient(path=db_dir)
+    shards = {
+        name: index_client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"}) for name in SHARDS
+    }
+    # One direct-answer index per shard (FAQ_COLLECTION keeps working for a single shard)
+    faqs = {
+        shard: index_client.get_or_create_collection(
+            name=FAQ_COLLECTION if len(SHARDS) == 1 else f"{shard}_qa", metadata={"hnsw:space": "cosine"}
+        )
+        for shard in SHARDS
+    }
+    # Snapshots carry the codec their vectors were stored with
+    codec_file = EMBED_CODEC_PATH if db_dir == DB_DIR else Path(db_dir) / snapshots.CODEC_FILE
+    return index_client, shards, faqs, load_codec(codec_file)
+
+
 # Init shared resources
-client = chromadb.PersistentClient(path=DB_DIR)
-collection = client.get_or_create_collection(
-    name=COLLECTION, metadata={"hnsw:space": "cosine"}
-)
+INDEX_VERSION: Optional[str] = None
+index_dir = DB_DIR
+if SNAPSHOT_DIR:
+    INDEX_VERSION = snapshots.current_version()
+    if INDEX_VERSION is None:
+        logging.warning("No index snapshot published in %s yet; serving %s", SNAPSHOT_DIR, DB_DIR)
+    else:
+        try:
+            index_dir = str(snapshots.fetch_snapshot(INDEX_VERSION))
+        except Exception as exc:  # pragma: no cover - shared storage failures
+            logging.warning("Unable to fetch index snapshot %s, serving %s: %s", INDEX_VERSION, DB_DIR, exc)
+            INDEX_VERSION = None
+client, shard_collections, faq_collections, codec = _open_index(index_dir)
+collection = next(iter(shard_collections.values()))
+faq_collection = next(iter(faq_collections.values()))
+if TORCH_NUM_THREADS > 0:
+    import torch
+
+    torch.set_num_threads(TORCH_NUM_THREADS)
 embedder = SentenceTransformer(EMBED_MODEL)
 reranker = CrossEncoder(RERANK_MODEL)
+if codec is not None:
+    logging.info("Query embeddings use the stored codec: %s", codec.describe())
 
 try:
     duckduckgo_tool: Optional[DuckDuckGoSearchResults] = DuckDuckGoSearchResults(
@@ -77,59 +156,55 @@ except Exception as exc:  # pragma: no cover - optional dependency failure
 
 class RetrievalState(TypedDict, total=False):
     question: str
+    query_embedding: List[float]
     top_k: int
+    candidate_k: int
     use_web_search: bool
     retriever_results: List[Dict[str, Any]]
     reranked_results: List[Dict[str, Any]]
     web_results: List[Dict[str, Any]]
     combined_contexts: List[Dict[str, Any]]
+    profiler: Any
+    trace: Any
+    deadline: float
+    shards: List[str]
+    shard_latency_ms: Dict[str, float]
+    degradations: Annotated[List[str], operator.add]
+
+
+def remaining_ms(deadline: Optional[float]) -> Optional[float]:
+    """Milliseconds left before ``deadline`` (epoch seconds), or None without a budget."""
+    if not deadline:
+        return None
+    return (deadline - time.time()) * 1000
+
+
+@contextmanager
+def _stage(state: RetrievalState, name: str):
+    """Time a model/upstream call when the request is being profiled, and trace it when sampled."""
+    profiler = state.get("profiler")
+    with profiler.timer(name) if profiler is not None else nullcontext():
+        kind = "client" if name.startswith("upstream:") else "internal"
+        with tracing.span(name, kind=kind) as stage_span:
+            yield stage_span
 
 
 def embed(texts: List[str]) -> List[List[float]]:
-    return embedder.encode(
-        texts, show_progress_bar=False, normalize_embeddings=True
-    ).tolist()
+    vectors = batching.encode(embedder, texts)
+    if codec is not None:
+        vectors = codec.transform(vectors)
+    return vectors.tolist()
 
 
-def build_prompt(question: str, contexts: List[Dict[str, Any]]) -> str:
-    numbered: List[str] = []
-    for ctx in contexts:
-        metadata = ctx.get("metadata", {}) or {}
-        label = ctx.get("citation_label", "")
-        title = (
-            metadata.get("title")
-            or metadata.get("filename")
-            or metadata.get("source")
-            or "Source"
-        )
-        section = metadata.get("section_label")
-        url = metadata.get("url")
-        descriptor_parts = [title]
-        if section:
-            descriptor_parts.append(section)
-        if url and url not in descriptor_parts:
-            descriptor_parts.append(url)
-        descriptor = " – ".join([part for part in descriptor_parts if part])
-
-        snippet = (ctx.get("document") or "").strip().replace("\n", " ")
-        if len(snippet) > 500:
-            snippet = snippet[:500] + " ..."
-        numbered.append(f"{label} {descriptor}\n{snippet}")
-    context_block = "\n\n".join(numbered)
-
-    prompt = f"""You are Fortinet's FortiIdentity Cloud virtual support engineer.
+# Identical for every request, so it forms a prefix the LLM server can cache
+SYSTEM_PROMPT = """You are Fortinet's FortiIdentity Cloud virtual support engineer.
 Your audience is a network or IT administrator who manages multi-factor authentication,
 directory integrations, and user lifecycle tasks for their company.
 
-Using only the numbered CONTEXT provided, craft a professional, technically precise response.
+Using only the numbered CONTEXT provided, craft a professional, technically precise response
+to the USER QUESTION that follows it.
 If the necessary information is absent, state that additional FortiIdentity Cloud guidance is required.
 
-USER QUESTION:
-{question}
-
-CONTEXT (numbered passages):
-{context_block}
-
 Response format requirements:
 - Answer the question directly and concisely
 - Structure your response using bullet points or numbered lists
@@ -146,42 +221,216 @@ Structure your response using numbered steps (1, 2, 3) or bullet points as appro
 
 Keep responses brief and actionable.
 """
-    return prompt
+PROMPT_CACHE_KEY = "faq-" + hashlib.sha1(f"{OPENAI_MODEL}\n{SYSTEM_PROMPT}".encode("utf-8")).hexdigest()[:16]
+
+
+def _passage_order(ctx: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Canonical passage order: documents before web results, then by source and chunk."""
+    metadata = ctx.get("metadata", {}) or {}
+    chunk = metadata.get("chunk")
+    return (
+        metadata.get("source_type") == "web",
+        str(metadata.get("source") or metadata.get("url") or ""),
+        chunk if isinstance(chunk, int) else -1,
+        ctx.get("document") or "",
+    )
 
 
-def call_llm(prompt: str) -> str:
+def _format_passage(ctx: Dict[str, Any]) -> str:
+    metadata = ctx.get("metadata", {}) or {}
+    label = ctx.get("citation_label", "")
+    title = (
+        metadata.get("title")
+        or metadata.get("filename")
+        or metadata.get("source")
+        or "Source"
+    )
+    section = metadata.get("section_label")
+    url = metadata.get("url")
+    descriptor_parts = [title]
+    if section:
+        descriptor_parts.append(section)
+    if url and url not in descriptor_parts:
+        descriptor_parts.append(url)
+    descriptor = " – ".join([part for part in descriptor_parts if part])
+
+    snippet = (ctx.get("document") or "").strip().replace("\n", " ")
+    if len(snippet) > 500:
+        snippet = snippet[:500] + " ..."
+    return f"{label} {descriptor}\n{snippet}"
+
+
+def build_prompt(question: str, contexts: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Chat messages: the fixed system instructions, then the passages in canonical order, then the question."""
+    # Passages keep their citation labels, so reordering them doesn't change what [n] refers to
+    context_block = "\n\n".join(_format_passage(ctx) for ctx in sorted(contexts, key=_passage_order))
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"CONTEXT (numbered passages):\n{context_block}\n\nUSER QUESTION:\n{question}"},
+    ]
+
+
+NO_LLM_NOTE = (
+    "Heads-up: I don't have a language model connected right now, so I'm "
+    "sharing the most relevant passages I could find. If you set OPENAI_API_KEY "
+    "(and optionally OPENAI_BASE_URL, OPENAI_MODEL), I can draft full "
+    "responses for you."
+)
+BUDGET_NOTE = (
+    "Heads-up: there wasn't enough time left in this request's latency budget "
+    "to draft a full answer, so I'm sharing the most relevant passages I found."
+)
+LLM_UNAVAILABLE_NOTE = (
+    "Heads-up: the language model isn't responding right now, so I'm sharing "
+    "the most relevant passages I could find. Please try again shortly for a full answer."
+)
+
+
+def fallback_note(degradations: List[str]) -> str:
+    """Why a response carries passages instead of an LLM answer."""
+    if not USE_LLM:
+        return NO_LLM_NOTE
+    # Checked first: with a budget, an open circuit also ends in passages_only
+    if "llm_circuit_open" in degradations or "llm_error" in degradations:
+        return LLM_UNAVAILABLE_NOTE
+    if "skip_llm" in degradations or "passages_only" in degradations:
+        return BUDGET_NOTE
+    return NO_LLM_NOTE
+
+
+def budget_llm_call(deadline: Optional[float]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """``call_llm`` options that fit the remaining budget, or None to skip the LLM."""
+    remaining = remaining_ms(deadline)
+    if remaining is None:
+        return {}, []
+    if remaining < LLM_MIN_MS:
+        return None, ["skip_llm"]
+    max_tokens = int(remaining / 1000 * LLM_TOKENS_PER_SECOND)
+    options: Dict[str, Any] = {"timeout": remaining / 1000}
+    degradations: List[str] = []
+    if max_tokens < (LLM_MAX_TOKENS or 1024):
+        options["max_tokens"] = max_tokens
+        degradations.append(f"llm_max_tokens:{max_tokens}")
+    return options, degradations
+
+
+_llm_usage: Dict[str, int] = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+_llm_usage_lock = threading.Lock()
+
+
+def _usage_counts(resp: Any) -> Dict[str, int]:
+    """Prompt, cached-prompt and completion token counts from a chat completion, when reported."""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        # OpenAI-compatible servers (including vLLM with prefix caching) report prefix hits here
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details is not None else 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+    }
+
+
+def llm_usage_stats() -> Dict[str, Any]:
+    """Cumulative LLM token usage since process start, with the share of prompt tokens served from cache."""
+    with _llm_usage_lock:
+        stats: Dict[str, Any] = dict(_llm_usage)
+    stats["cached_share"] = round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+    return stats
+
+
+def _record_llm_usage(counts: Dict[str, int]) -> None:
+    with _llm_usage_lock:
+        _llm_usage["calls"] += 1
+        for key, value in counts.items():
+            _llm_usage[key] += value
+        calls = _llm_usage["calls"]
+    if LLM_USAGE_LOG_EVERY and calls % LLM_USAGE_LOG_EVERY == 0:
+        logging.info("LLM usage: %s", llm_usage_stats())
+
+
+def call_llm_with_usage(
+    prompt: Union[str, List[Dict[str, str]]],
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+    degradations: Optional[List[str]] = None,
+) -> Tuple[str, Dict[str, int]]:
+    """The LLM's answer to ``prompt`` (messages, or a single user message) and its token usage.
+
+    When no answer comes back, the reason is appended to ``degradations``.
+    """
+    degradations = degradations if degradations is not None else []
     if not USE_LLM or openai_client is None:
-        return ""
+        return "", {}
+    messages = [{"role": "user", "content": prompt}] if isinstance(prompt, str) else prompt
+    options: Dict[str, Any] = {}
+    if max_tokens or LLM_MAX_TOKENS:
+        options["max_tokens"] = max_tokens or LLM_MAX_TOKENS
+    if timeout:
+        options["timeout"] = timeout
+    if LLM_CACHE_KEY_PARAM:
+        # Routes requests sharing the system prompt to the same cache on gateways that support it
+        options["extra_body"] = {LLM_CACHE_KEY_PARAM: PROMPT_CACHE_KEY}
+
+    ticket = llm_breaker.allow()
+    if ticket is None:
+        # Circuit open: go straight to the passages-only fallback
+        degradations.append("llm_circuit_open")
+        return "", {}
+    start = time.perf_counter()
+    llm_span = tracing.start_span("upstream:llm", kind="client", **{
+        "gen_ai.request.model": OPENAI_MODEL,
+        "server.address": OPENAI_BASE_URL or "api.openai.com",
+    })
     try:
         resp = openai_client.chat.completions.create(
             model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
             temperature=0.2,
+            **options,
         )
-        return resp.choices[0].message.content.strip()
+        llm_breaker.record(ticket, True, (time.perf_counter() - start) * 1000)
+        counts = _usage_counts(resp)
+        if counts:
+            _record_llm_usage(counts)
+            if llm_span is not None:
+                llm_span.set_attribute("gen_ai.usage.input_tokens", counts["prompt_tokens"])
+                llm_span.set_attribute("gen_ai.usage.cached_input_tokens", counts["cached_tokens"])
+                llm_span.set_attribute("gen_ai.usage.output_tokens", counts["completion_tokens"])
+        return resp.choices[0].message.content.strip(), counts
     except Exception as exc:  # pragma: no cover - network/runtime failures
+        if llm_span is not None:
+            llm_span.record_exception(exc)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if timeout and elapsed_ms >= timeout * 950:
+            # Our own latency budget ran out; that says nothing about the upstream
+            llm_breaker.release(ticket)
+        else:
+            llm_breaker.record(ticket, False, elapsed_ms)
         logging.warning("LLM call failed: %s", exc)
-        return ""
+        degradations.append("llm_error")
+        return "", {}
+    finally:
+        if llm_span is not None:
+            llm_span.end()
 
 
-def chroma_retrieve_node(state: RetrievalState) -> RetrievalState:
-    question = state.get("question", "").strip()
-    if not question:
-        return {"retriever_results": []}
+def call_llm(
+    prompt: Union[str, List[Dict[str, str]]],
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+    degradations: Optional[List[str]] = None,
+) -> str:
+    return call_llm_with_usage(prompt, max_tokens, timeout, degradations)[0]
 
-    top_k = state.get("top_k") or TOP_K_DEFAULT
-    candidate_k = max(20, top_k)
-    q_emb = embed([question])[0]
-    res = collection.query(
-        query_embeddings=[q_emb],
-        n_results=candidate_k,
-        include=["documents", "metadatas", "distances"],
-    )
 
+def _query_results(res: Any, idx: int = 0) -> List[Dict[str, Any]]:
+    """Unpack the ``idx``-th query of a ``collection.query`` response into result dicts."""
     results: List[Dict[str, Any]] = []
-    documents = res.get("documents", [[]])[0] if res else []
-    metadatas = res.get("metadatas", [[]])[0] if res else []
-    distances = res.get("distances", [[]])[0] if res else []
+    documents = res.get("documents", [[]])[idx] if res else []
+    metadatas = res.get("metadatas", [[]])[idx] if res else []
+    distances = res.get("distances", [[]])[idx] if res else []
     for doc, meta, dist in zip(documents, metadatas, distances):
         metadata = meta or {}
         metadata.setdefault("source_type", "document")
@@ -192,28 +441,284 @@ def chroma_retrieve_node(state: RetrievalState) -> RetrievalState:
                 "distance": dist,
             }
         )
-    return {"retriever_results": results}
+    return results
+
+
+_shard_executor = ThreadPoolExecutor(max_workers=max(1, len(SHARDS)), thread_name_prefix="shard-query")
+_centroids: Dict[str, Any] = {}
+_centroids_at = 0.0
+_centroids_lock = threading.Lock()
+
+
+def _shard_centroids() -> Dict[str, Any]:
+    """Mean (normalized) stored embedding per shard, from a sample, refreshed every SHARD_CENTROID_TTL."""
+    global _centroids, _centroids_at
+    with _centroids_lock:
+        if _centroids and time.time() - _centroids_at < SHARD_CENTROID_TTL:
+            return _centroids
+        centroids: Dict[str, Any] = {}
+        for name, shard in shard_collections.items():
+            try:
+                sample = shard.get(include=["embeddings"], limit=SHARD_CENTROID_SAMPLE)["embeddings"]
+            except Exception as exc:  # pragma: no cover - index/runtime failures
+                logging.warning("Unable to sample shard %s for routing: %s", name, exc)
+                continue
+            if sample is not None and len(sample):
+                mean = np.asarray(sample, dtype=np.float32).mean(axis=0)
+                centroids[name] = mean / (np.linalg.norm(mean) or 1.0)
+        _centroids, _centroids_at = centroids, time.time()
+        return centroids
+
+
+def route_shards(
+    question: str, query_embedding: Optional[List[float]] = None, requested: Optional[List[str]] = None
+) -> List[str]:
+    """Shards worth querying: the requested ones, keyword routes, centroid routing, else all."""
+    shards = list(shard_collections)
+    if len(shards) == 1:
+        return shards
+    chosen = [name for name in requested or [] if name in shard_collections]
+    if chosen:
+        return chosen
+    lowered = question.lower()
+    chosen = [
+        name for name in shards if any(keyword.lower() in lowered for keyword in SHARD_ROUTES.get(name, []))
+    ]
+    if chosen:
+        return chosen
+    if SHARD_CENTROID_MARGIN > 0 and query_embedding is not None:
+        centroids = _shard_centroids()
+        if centroids:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            similarity = {name: float(query @ centroid) for name, centroid in centroids.items()}
+            best = max(similarity.values())
+            # Shards without a centroid (e.g. not sampled yet) are still queried
+            return [name for name in shards if similarity.get(name, best) >= best - SHARD_CENTROID_MARGIN]
+    return shards
+
+
+def scatter_query(
+    query_embeddings: List[List[float]], n_results: int, shard_lists: List[List[str]]
+) -> Tuple[List[List[Dict[str, Any]]], Dict[str, float], List[str]]:
+    """Query each shard (in parallel) for the embeddings routed to it and merge by distance.
+
+    Returns the merged candidate lists, per-shard latency in ms and the shards that failed.
+    """
+    by_shard: Dict[str, List[int]] = {}
+    for idx, shards in enumerate(shard_lists):
+        for name in shards:
+            by_shard.setdefault(name, []).append(idx)
+
+    def query(name: str, indices: List[int]):
+        start = time.perf_counter()
+        res = shard_collections[name].query(
+            query_embeddings=[query_embeddings[i] for i in indices],
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+        )
+        return res, (time.perf_counter() - start) * 1000
+
+    # A single shard has nothing to overlap with, so it is queried inline
+    futures = (
+        {name: _shard_executor.submit(profiling.in_request(query), name, indices) for name, indices in by_shard.items()}
+        if len(by_shard) > 1
+        else {}
+    )
+    merged: List[List[Dict[str, Any]]] = [[] for _ in query_embeddings]
+    latency: Dict[str, float] = {}
+    failed: List[str] = []
+    for name, indices in by_shard.items():
+        try:
+            res, elapsed_ms = futures[name].result() if futures else query(name, indices)
+        except Exception as exc:  # pragma: no cover - index/runtime failures
+            # Degrade to the other shards; with none left, fail like an unsharded query
+            if len(failed) + 1 == len(by_shard):
+                raise
+            logging.warning("Shard %s query failed: %s", name, exc)
+            failed.append(name)
+            continue
+        latency[name] = round(elapsed_ms, 2)
+        for pos, idx in enumerate(indices):
+            for result in _query_results(res, pos):
+                result["metadata"].setdefault("shard", name)
+                merged[idx].append(result)
+    if len(by_shard) > 1:
+        for results in merged:
+            results.sort(key=lambda item: item.get("distance", 0.0))
+            del results[n_results:]
+    return merged, latency, failed
+
+
+def chroma_retrieve_node(state: RetrievalState) -> RetrievalState:
+    question = state.get("question", "").strip()
+    if not question:
+        return {"retriever_results": []}
+    if state.get("reranked_results"):
+        # Candidates were prefetched while the question was being typed
+        return {}
+
+    top_k = state.get("top_k") or TOP_K_DEFAULT
+    candidate_k = max(state.get("candidate_k") or CANDIDATE_K, top_k)
+    q_emb = state.get("query_embedding")
+    if q_emb is None:
+        with _stage(state, "model:embed"):
+            q_emb = embed([question])[0]
+    shards = route_shards(question, q_emb, state.get("shards"))
+    with _stage(state, "chroma:query") as query_span:
+        merged, latency, failed = scatter_query([q_emb], candidate_k, [shards])
+        if query_span is not None:
+            query_span.set_attribute("chroma.shards", ",".join(shards))
+            for name, elapsed_ms in latency.items():
+                query_span.set_attribute(f"chroma.shard.{name}.ms", elapsed_ms)
+    profiler = state.get("profiler")
+    if profiler is not None and len(latency) > 1:
+        for name, elapsed_ms in latency.items():
+            profiler.record(f"chroma:query:{name}", elapsed_ms / 1000)
+    updates: RetrievalState = {"retriever_results": merged[0], "shard_latency_ms": latency}
+    if failed:
+        updates["degradations"] = [f"shard_failed:{name}" for name in failed]
+    return updates
+
+
+def retrieve_batch(
+    query_embeddings: List[List[float]],
+    top_k: int = TOP_K_DEFAULT,
+    candidate_k: Optional[int] = None,
+    questions: Optional[List[str]] = None,
+    shard_lists: Optional[List[List[str]]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """Candidate lists for many questions, one multi-query ``collection.query`` per shard.
+
+    ``shard_lists`` reuses routing already done for the FAQ lookup; otherwise each
+    question is routed here.
+    """
+    if not query_embeddings:
+        return []
+    if shard_lists is None:
+        shard_lists = [
+            route_shards(questions[idx] if questions else "", embedding)
+            for idx, embedding in enumerate(query_embeddings)
+        ]
+    merged, _, _ = scatter_query(query_embeddings, max(candidate_k or CANDIDATE_K, top_k), shard_lists)
+    return merged
+
+
+def match_faq_answers(
+    query_embeddings: List[List[float]], shard_lists: Optional[List[List[str]]] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """For each embedding, the stored FAQ answer at least FAQ_MATCH_THRESHOLD similar (or None).
+
+    Only the ``<shard>_qa`` indexes of the shards each question was routed to are
+    searched (all of them without ``shard_lists``).
+    """
+    matches: List[Optional[Dict[str, Any]]] = [None] * len(query_embeddings)
+    if not ENABLE_FAQ_DIRECT or not query_embeddings:
+        return matches
+    by_shard: Dict[str, List[int]] = {}
+    for idx in range(len(query_embeddings)):
+        for name in shard_lists[idx] if shard_lists is not None else faq_collections:
+            if name in faq_collections:
+                by_shard.setdefault(name, []).append(idx)
+    for name, indices in by_shard.items():
+        faq_index = faq_collections[name]
+        try:
+            if faq_index.count() == 0:
+                continue
+            res = faq_index.query(
+                query_embeddings=[query_embeddings[i] for i in indices],
+                n_results=1,
+                include=["documents", "metadatas", "distances"],
+            )
+        except Exception as exc:  # pragma: no cover - index/runtime failures
+            logging.warning("FAQ answer lookup in %s failed: %s", faq_index.name, exc)
+            continue
+
+        for pos, idx in enumerate(indices):
+            best = _query_results(res, pos)[:1]
+            # Cosine distance -> similarity
+            similarity = 1.0 - float(best[0]["distance"]) if best else 0.0
+            if not best or similarity < FAQ_MATCH_THRESHOLD:
+                continue
+            if matches[idx] is None or similarity > matches[idx]["score"]:
+                matches[idx] = {**best[0], "score": similarity}
+    return matches
+
+
+def match_faq_answer(
+    question: str, query_embedding: Optional[List[float]] = None, shards: Optional[List[str]] = None
+) -> Optional[Dict[str, Any]]:
+    """Return the stored FAQ answer whose question is at least FAQ_MATCH_THRESHOLD similar.
+
+    ``shards`` limits the lookup to those shards' FAQ indexes, as routed by ``route_shards``.
+    """
+    if not ENABLE_FAQ_DIRECT or not question.strip():
+        return None
+    if query_embedding is None:
+        query_embedding = embed([question])[0]
+    return match_faq_answers([query_embedding], [shards] if shards is not None else None)[0]
+
+
+def _apply_rerank_scores(results: List[Dict[str, Any]], scores: Any, top_k: int) -> List[Dict[str, Any]]:
+    for r, score in zip(results, scores):
+        r["score"] = float(score)
+    reranked = sorted(results, key=lambda item: item.get("score", 0.0), reverse=True)
+    return reranked[:top_k]
 
 
 def rerank_node(state: RetrievalState) -> RetrievalState:
+    if state.get("reranked_results"):
+        return {}
     results = state.get("retriever_results") or []
     question = state.get("question", "")
     if not results or not question:
         return {"reranked_results": []}
 
+    top_k = state.get("top_k") or TOP_K_DEFAULT
+    remaining = remaining_ms(state.get("deadline"))
+    if remaining is not None:
+        # Leave the LLM its minimum; rerank only as many candidates as fit in the rest
+        affordable = int((remaining - LLM_MIN_MS) / RERANK_MS_PER_PAIR)
+        if affordable < min(top_k, len(results)):
+            return {"reranked_results": results[:top_k], "degradations": ["skip_rerank"]}
+        if affordable < len(results):
+            head = results[:affordable]
+            updates = rerank_node({**state, "retriever_results": head, "deadline": None})
+            return {**updates, "degradations": [f"rerank_candidates:{affordable}"]}
+
     pairs = [(question, r.get("document", "")) for r in results]
     try:
-        scores = reranker.predict(pairs)
+        with _stage(state, "model:rerank"):
+            scores = batching.predict(reranker, pairs)
     except Exception as exc:  # pragma: no cover - model inference failure
         logging.warning("Reranker failed: %s", exc)
         scores = [0.0 for _ in pairs]
 
-    for r, score in zip(results, scores):
-        r["score"] = float(score)
+    return {"reranked_results": _apply_rerank_scores(results, scores, top_k)}
 
-    reranked = sorted(results, key=lambda item: item.get("score", 0.0), reverse=True)
-    top_k = state.get("top_k") or TOP_K_DEFAULT
-    return {"reranked_results": reranked[:top_k]}
+
+def rerank_batch(
+    questions: List[str], candidate_lists: List[List[Dict[str, Any]]], top_k: int = TOP_K_DEFAULT
+) -> List[List[Dict[str, Any]]]:
+    """Rerank the candidates of many questions with a single cross-encoder call."""
+    pairs = [
+        (question, r.get("document", ""))
+        for question, results in zip(questions, candidate_lists)
+        for r in results
+    ]
+    if not pairs:
+        return [[] for _ in candidate_lists]
+    try:
+        scores = batching.predict(reranker, pairs)
+    except Exception as exc:  # pragma: no cover - model inference failure
+        logging.warning("Reranker failed: %s", exc)
+        scores = [0.0 for _ in pairs]
+
+    reranked: List[List[Dict[str, Any]]] = []
+    offset = 0
+    for results in candidate_lists:
+        reranked.append(_apply_rerank_scores(results, scores[offset:offset + len(results)], top_k))
+        offset += len(results)
+    return reranked
 
 
 def normalize_search_results(raw_results: Any) -> List[Dict[str, Any]]:
@@ -259,6 +764,11 @@ def normalize_search_results(raw_results: Any) -> List[Dict[str, Any]]:
     return normalized[:WEB_SEARCH_K]
 
 
+_web_search_executor = ThreadPoolExecutor(max_workers=max(1, WEB_SEARCH_CONCURRENCY), thread_name_prefix="web-search")
+# Held until a search really finishes, so abandoned searches can't queue up behind each other
+_web_search_slots = threading.BoundedSemaphore(max(1, WEB_SEARCH_CONCURRENCY))
+
+
 def web_search_node(state: RetrievalState) -> RetrievalState:
     should_search = state.get("use_web_search")
     if should_search is None:
@@ -271,8 +781,43 @@ def web_search_node(state: RetrievalState) -> RetrievalState:
     if not question:
         return {"web_results": []}
 
+    remaining = remaining_ms(state.get("deadline"))
+    if remaining is not None and remaining - LLM_MIN_MS < WEB_SEARCH_MIN_MS:
+        return {"web_results": [], "degradations": ["skip_web_search"]}
+
+    if remaining is not None and not _web_search_slots.acquire(blocking=False):
+        # Every slot is taken (often by searches earlier requests gave up on); waiting would only eat the budget
+        return {"web_results": [], "degradations": ["web_search_saturated"]}
+    ticket = web_search_breaker.allow()
+    if ticket is None:
+        if remaining is not None:
+            _web_search_slots.release()
+        return {"web_results": [], "degradations": ["web_search_circuit_open"]}
+    start = time.perf_counter()
+
+    def finished(future) -> None:
+        # Runs when the search really ends, so a hang the request gave up on still counts as slow
+        try:
+            web_search_breaker.record(ticket, future.exception() is None, (time.perf_counter() - start) * 1000)
+        finally:
+            _web_search_slots.release()
+
     try:
-        raw_results = duckduckgo_tool.invoke(question)
+        with _stage(state, "upstream:web_search"):
+            if remaining is None:
+                try:
+                    raw_results = duckduckgo_tool.invoke(question)
+                except Exception:
+                    web_search_breaker.record(ticket, False, (time.perf_counter() - start) * 1000)
+                    raise
+                web_search_breaker.record(ticket, True, (time.perf_counter() - start) * 1000)
+            else:
+                # Abandon (not cancel) a search that would eat into the LLM's share
+                future = _web_search_executor.submit(profiling.in_request(duckduckgo_tool.invoke), question)
+                future.add_done_callback(finished)
+                raw_results = future.result(timeout=(remaining - LLM_MIN_MS) / 1000)
+    except FutureTimeoutError:
+        return {"web_results": [], "degradations": ["web_search_timeout"]}
     except Exception as exc:  # pragma: no cover - network/runtime failures
         logging.warning("Web search failed: %s", exc)
         return {"web_results": []}
@@ -316,12 +861,142 @@ def combine_contexts_node(state: RetrievalState) -> RetrievalState:
     return {"combined_contexts": contexts}
 
 
-def build_retrieval_graph() -> Any:
+def warm_up() -> None:
+    """Embed, query every shard and FAQ index and rerank once so the first job starts warm."""
+    try:
+        query = embed(["warm up"])
+        scatter_query(query, 1, [list(shard_collections)])
+        match_faq_answers(query)
+        batching.predict(reranker, [("warm up", "warm up")], name="warm_up")
+    except Exception as exc:  # pragma: no cover - index/runtime failures
+        logging.warning("Warm-up failed: %s", exc)
+
+
+# -------- Index snapshots --------
+_index_gate = threading.Condition()
+_active_jobs = 0
+_pending_index: Optional[Tuple[str, Tuple[Any, ...]]] = None
+_watching = False
+_reported_at = 0.0
+
+
+def _close_index(index_client: Any) -> None:
+    """Stop a replaced client's system; Chroma caches one per path, which would keep its index in memory."""
+    try:
+        # Defined on SharedSystemClient, whichever module holds it in this chromadb release
+        getattr(type(index_client), "_identifier_to_system", {}).pop(getattr(index_client, "_identifier", None), None)
+        system = getattr(index_client, "_system", None)
+        if system is not None:
+            system.stop()
+    except Exception as exc:  # pragma: no cover - chromadb internals
+        logging.warning("Unable to release the previous index: %s", exc)
+
+
+def _activate_index(version: str, opened: Tuple[Any, ...]) -> None:
+    global INDEX_VERSION, client, shard_collections, collection, faq_collections, faq_collection, codec, _centroids_at
+    # Only called once no job is running, so nothing still reads the old index
+    previous = client
+    client, shard_collections, faq_collections, codec = opened
+    collection = next(iter(shard_collections.values()))
+    faq_collection = next(iter(faq_collections.values()))
+    INDEX_VERSION = version
+    # Re-sample routing centroids from the new index
+    _centroids_at = 0.0
+    logging.info("Switched to index snapshot %s", version)
+    snapshots.report_version(version)
+    _close_index(previous)
+
+
+@contextmanager
+def index_in_use():
+    """Hold the active index for one job; a newly fetched snapshot is switched in between jobs."""
+    global _active_jobs, _pending_index, _reported_at
+    if not _watching and INDEX_VERSION and time.monotonic() - _reported_at >= snapshots.SNAPSHOT_POLL_INTERVAL:
+        # Forked work horse: report on behalf of the worker process that forked it
+        _reported_at = time.monotonic()
+        snapshots.report_version(INDEX_VERSION, os.getppid())
+        snapshots.mark_in_use(INDEX_VERSION)
+    with _index_gate:
+        # Once a new version is staged, new jobs wait for the running ones to drain
+        while _pending_index is not None and _active_jobs:
+            _index_gate.wait()
+        _active_jobs += 1
+    try:
+        yield
+    finally:
+        with _index_gate:
+            _active_jobs -= 1
+            if not _active_jobs:
+                if _pending_index is not None:
+                    _activate_index(*_pending_index)
+                    _pending_index = None
+                _index_gate.notify_all()
+
+
+def _stage_snapshot(version: str) -> None:
+    """Fetch, verify, open and warm ``version``, then switch to it as soon as no job is running."""
+    global _pending_index
+    opened = _open_index(str(snapshots.fetch_snapshot(version)))
+    _, shards, faqs, new_codec = opened
+    try:
+        query = batching.encode(embedder, ["warm up"], name="warm_up")
+        if new_codec is not None:
+            query = new_codec.transform(query)
+        for index in [*shards.values(), *faqs.values()]:
+            if index.count():
+                index.query(query_embeddings=query.tolist(), n_results=1)
+    except Exception as exc:  # pragma: no cover - index/runtime failures
+        logging.warning("Warm-up of snapshot %s failed: %s", version, exc)
+    with _index_gate:
+        if _pending_index is not None:
+            # Superseded before it was ever used
+            _close_index(_pending_index[1][0])
+            _pending_index = None
+        if _active_jobs:
+            _pending_index = (version, opened)
+        else:
+            _activate_index(version, opened)
+
+
+def watch_snapshots(stop: Optional[threading.Event] = None) -> Optional[threading.Thread]:
+    """Poll SNAPSHOT_DIR in the background and switch to each newly published version."""
+    global _watching
+    if not SNAPSHOT_DIR:
+        return None
+    _watching = True
+    stop = stop or threading.Event()
+
+    def poll() -> None:
+        snapshots.report_version(INDEX_VERSION)
+        while not stop.wait(snapshots.SNAPSHOT_POLL_INTERVAL):
+            try:
+                version = snapshots.current_version()
+                staged = _pending_index[0] if _pending_index is not None else None
+                if version and version not in (INDEX_VERSION, staged):
+                    _stage_snapshot(version)
+                snapshots.report_version(INDEX_VERSION)
+                snapshots.mark_in_use(INDEX_VERSION)
+            except Exception as exc:  # pragma: no cover - shared storage failures
+                logging.warning("Index snapshot update failed: %s", exc)
+
+    thread = threading.Thread(target=poll, name="snapshot-watch", daemon=True)
+    thread.start()
+    return thread
+
+
+def build_retrieval_graph(node_wrapper: Optional[Callable[[str, Callable], Callable]] = None) -> Any:
+    """Compile the retrieval graph; ``node_wrapper(name, fn)`` can decorate every node."""
+    user_wrap = node_wrapper or (lambda _name, fn: fn)
+
+    def wrap(name: str, fn: Callable) -> Callable:
+        # Traced requests carry their span context in state["trace"]; others pass straight through
+        return tracing.traced_node(name, user_wrap(name, fn))
+
     graph = StateGraph(RetrievalState)
-    graph.add_node("retrieve_chroma", chroma_retrieve_node)
-    graph.add_node("rerank", rerank_node)
-    graph.add_node("web_search", web_search_node)
-    graph.add_node("combine", combine_contexts_node)
+    graph.add_node("retrieve_chroma", wrap("retrieve_chroma", chroma_retrieve_node))
+    graph.add_node("rerank", wrap("rerank", rerank_node))
+    graph.add_node("web_search", wrap("web_search", web_search_node))
+    graph.add_node("combine", wrap("combine", combine_contexts_node))
 
     graph.set_entry_point("retrieve_chroma")
     graph.add_edge("retrieve_chroma", "rerank")
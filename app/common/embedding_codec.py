@@ -0,0 +1,158 @@
+"""
+Reduced-dimension, reduced-precision embedding storage.
+
+An :class:`EmbeddingCodec` maps model embeddings to the vectors that are stored
+and queried: truncate or PCA-project to ``dim`` dimensions, re-normalize for
+cosine search, then round to ``float16`` or to ``int8`` with a per-dimension
+scale. Ingest fits the codec (PCA basis, int8 scales) on the corpus and saves it
+next to the index; the query side loads the same file, so both sides always
+apply identical transforms.
+
+Chroma's HNSW index keeps float32 internally, so only the dimension shrinks the
+index there. The float16/int8 modes round vectors exactly as a native store would
+but save nothing inside Chroma, so ingest rejects them; ``app/eval_compression.py``
+uses them to measure what a native store would gain.
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+METHODS = ("truncate", "pca")
+DTYPES = ("float32", "float16", "int8")
+BYTES_PER_VALUE = {"float32": 4, "float16": 2, "int8": 1}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class EmbeddingCodec:
+    """Dimension reduction plus scalar quantization for embedding vectors."""
+
+    def __init__(
+        self,
+        dim: int = 0,
+        method: str = "truncate",
+        dtype: str = "float32",
+        mean: Optional[np.ndarray] = None,
+        components: Optional[np.ndarray] = None,
+        scale: Optional[np.ndarray] = None,
+    ):
+        if method not in METHODS:
+            raise ValueError(f"Unknown reduction method {method!r}; expected one of {METHODS}")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown embedding dtype {dtype!r}; expected one of {DTYPES}")
+        self.dim = dim
+        self.method = method
+        self.dtype = dtype
+        self.mean = mean
+        self.components = components
+        self.scale = scale
+
+    @property
+    def is_identity(self) -> bool:
+        return not self.dim and self.dtype == "float32"
+
+    @property
+    def needs_fit(self) -> bool:
+        return (self.method == "pca" and self.dim and self.components is None) or (
+            self.dtype == "int8" and self.scale is None
+        )
+
+    @property
+    def config(self):
+        """Settings that decide the stored vectors (the method only matters when reducing)."""
+        return (self.dim, self.method if self.dim else None, self.dtype)
+
+    def bytes_per_vector(self, source_dim: int) -> int:
+        return (self.dim or source_dim) * BYTES_PER_VALUE[self.dtype]
+
+    def fit(self, vectors: np.ndarray) -> "EmbeddingCodec":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.method == "pca" and self.dim:
+            if len(vectors) < self.dim:
+                raise ValueError(f"PCA to {self.dim} dims needs at least {self.dim} vectors, got {len(vectors)}")
+            self.mean = vectors.mean(axis=0)
+            # Rows of vt are the principal axes, strongest first
+            _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+            self.components = vt[: self.dim].astype(np.float32)
+        if self.dtype == "int8":
+            reduced = self.reduce(vectors)
+            self.scale = np.maximum(np.abs(reduced).max(axis=0), 1e-6).astype(np.float32) / 127
+        return self
+
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not self.dim or self.dim >= vectors.shape[1]:
+            return vectors
+        if self.method == "pca":
+            reduced = (vectors - self.mean) @ self.components.T
+        else:
+            reduced = vectors[:, : self.dim]
+        return _normalize(reduced)
+
+    def quantize(self, vectors: np.ndarray) -> np.ndarray:
+        """Reduced vectors in their compact storage dtype."""
+        reduced = self.reduce(vectors)
+        if self.dtype == "float16":
+            return reduced.astype(np.float16)
+        if self.dtype == "int8":
+            return np.clip(np.rint(reduced / self.scale), -127, 127).astype(np.int8)
+        return reduced
+
+    def dequantize(self, stored: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return stored.astype(np.float32) * self.scale
+        return stored.astype(np.float32)
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """What gets indexed and queried: reduced, then rounded through the storage dtype."""
+        if self.is_identity:
+            return np.asarray(vectors, dtype=np.float32)
+        return self.dequantize(self.quantize(vectors))
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            name: value
+            for name, value in (("mean", self.mean), ("components", self.components), ("scale", self.scale))
+            if value is not None
+        }
+        with open(path, "wb") as fh:
+            np.savez(fh, dim=self.dim, method=self.method, dtype=self.dtype, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "EmbeddingCodec":
+        with np.load(path) as data:
+            return cls(
+                dim=int(data["dim"]),
+                method=str(data["method"]),
+                dtype=str(data["dtype"]),
+                mean=data["mean"] if "mean" in data else None,
+                components=data["components"] if "components" in data else None,
+                scale=data["scale"] if "scale" in data else None,
+            )
+
+    def describe(self) -> str:
+        dims = f"{self.method} to {self.dim} dims" if self.dim else "full dims"
+        return f"{dims}, {self.dtype}"
+
+
+def codec_path(db_dir: str) -> Path:
+    """Where ingest saves the codec for the index in ``db_dir`` (``EMBED_CODEC_PATH`` overrides)."""
+    return Path(os.getenv("EMBED_CODEC_PATH", os.path.join(db_dir, "embedding_codec.npz")))
+
+
+def load_codec(path: Path) -> Optional[EmbeddingCodec]:
+    """The codec saved by ingest, or None when vectors are stored as produced by the model."""
+    if not path.exists():
+        return None
+    try:
+        return EmbeddingCodec.load(path)
+    except Exception as exc:  # pragma: no cover - corrupt codec file
+        logging.warning("Ignoring unreadable embedding codec %s: %s", path, exc)
+        return None
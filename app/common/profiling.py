@@ -0,0 +1,200 @@
+"""
+Opt-in per-request profiling for chat jobs.
+
+A profiled job runs under a background sampling thread that records the Python
+stacks of the job's own thread and of pool threads while they run work the job
+submitted (graph nodes, shard queries, web searches), plus wall-clock timings for
+each retrieval-graph node and model call. Other jobs sharing the process (threaded
+workers) don't show up in the profile. The result is stored in Redis under the task
+id (and optionally on disk) as a compact JSON summary and collapsed stacks that
+flamegraph.pl, speedscope or inferno can render directly.
+
+Nothing here runs unless a request asks for it: unprofiled jobs use the plain
+retrieval graph and never start a sampler.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.common.task_manager import redis_conn
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Whether clients may ask for a profile with "profile": true (off: only PROFILE_SAMPLE_RATE applies)
+PROFILE_ALLOW_REQUESTS = os.getenv("PROFILE_ALLOW_REQUESTS", "false").lower() == "true"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_TTL = int(os.getenv("PROFILE_TTL", "86400"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_TOP_N = 25
+
+_active: ContextVar[Optional["RequestProfiler"]] = ContextVar("request_profiler", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    """Sampling profiler plus named wall-clock timers for a single task."""
+
+    def __init__(self, task_id: str, interval: float = PROFILE_INTERVAL):
+        self.task_id = task_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.timings: List[Dict[str, Any]] = []
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Threads currently working for this request, with how many of its tasks each runs
+        self._idents: Counter = Counter()
+        self._idents_lock = threading.Lock()
+        self._token = None
+        self._started = 0.0
+        self._elapsed = 0.0
+
+    def start(self) -> "RequestProfiler":
+        self.attach()
+        self._token = _active.set(self)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name=f"profiler-{self.task_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._elapsed = time.perf_counter() - self._started
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._token is not None:
+            _active.reset(self._token)
+            self._token = None
+        self.detach()
+
+    def attach(self) -> None:
+        """Sample the calling thread until the matching :meth:`detach`."""
+        with self._idents_lock:
+            self._idents[threading.get_ident()] += 1
+
+    def detach(self) -> None:
+        ident = threading.get_ident()
+        with self._idents_lock:
+            self._idents[ident] -= 1
+            if self._idents[ident] <= 0:
+                del self._idents[ident]
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._idents_lock:
+                idents = set(self._idents)
+            for ident, frame in sys._current_frames().items():
+                if ident not in idents:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def record(self, name: str, seconds: float) -> None:
+        self.timings.append({"name": name, "seconds": round(seconds, 6)})
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def collapsed(self) -> str:
+        """Stacks in the ``frame;frame;frame count`` format used by flamegraph tools."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        # Scale by achieved samples: the GIL stretches the effective interval under load
+        per_sample = self._elapsed / self.samples if self.samples else 0.0
+        self_time: Counter = Counter()
+        for stack, count in self.stacks.items():
+            self_time[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "task_id": self.task_id,
+            "wall_seconds": round(self._elapsed, 6),
+            "interval": self.interval,
+            "samples": self.samples,
+            "timings": self.timings,
+            "top_functions": [
+                {"function": name, "samples": count, "seconds": round(count * per_sample, 4)}
+                for name, count in self_time.most_common(PROFILE_TOP_N)
+            ],
+        }
+
+    def save(self) -> None:
+        summary = self.summary()
+        collapsed = self.collapsed()
+        pipe = redis_conn.pipeline()
+        pipe.setex(f"profile:{self.task_id}", PROFILE_TTL, json.dumps(summary))
+        pipe.setex(f"profile:{self.task_id}:collapsed", PROFILE_TTL, collapsed)
+        pipe.execute()
+        if PROFILE_DIR:
+            out_dir = Path(PROFILE_DIR)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            (out_dir / f"{self.task_id}.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+            (out_dir / f"{self.task_id}.collapsed").write_text(collapsed, encoding="utf-8")
+
+
+def current() -> Optional[RequestProfiler]:
+    """The profiler of the request running in this context, if it is profiled."""
+    return _active.get()
+
+
+def in_request(fn: Callable) -> Callable:
+    """Wrap ``fn`` before handing it to a thread pool so that thread is sampled for the calling request."""
+    profiler = _active.get()
+    if profiler is None:
+        return fn
+
+    def run(*args, **kwargs):
+        profiler.attach()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.detach()
+
+    return run
+
+
+def timed_node(name: str, fn: Callable) -> Callable:
+    """Wrap a retrieval-graph node so it reports its wall time to ``state["profiler"]``."""
+
+    def wrapper(state):
+        profiler = state.get("profiler")
+        if profiler is None:
+            return fn(state)
+        # LangGraph may run the node on one of its executor threads
+        profiler.attach()
+        start = time.perf_counter()
+        try:
+            return fn(state)
+        finally:
+            profiler.record(f"node:{name}", time.perf_counter() - start)
+            profiler.detach()
+
+    return wrapper
+
+
+def get_profile(task_id: str) -> Optional[Dict[str, Any]]:
+    raw = redis_conn.get(f"profile:{task_id}")
+    return json.loads(raw) if raw else None
+
+
+def get_profile_collapsed(task_id: str) -> Optional[str]:
+    raw = redis_conn.get(f"profile:{task_id}:collapsed")
+    return raw.decode("utf-8") if raw is not None else None
@@ -0,0 +1,237 @@
+"""
+Versioned, immutable index snapshots.
+
+Ingest builds the index in its own directory and then publishes it to a shared
+location (``SNAPSHOT_DIR``, e.g. an NFS/EFS mount or a volume shared between
+hosts) as ``<SNAPSHOT_DIR>/<version>/``. That directory holds a consistent copy of the
+Chroma database (SQLite plus HNSW segment files), the embedding codec and a
+``manifest.json`` that lists every file with its size and SHA-256, plus a checksum
+over all of them. A version is only made visible once it is complete, by
+atomically replacing the ``CURRENT`` pointer file. Published versions are never
+modified; old ones are pruned after ``SNAPSHOT_KEEP`` newer ones exist.
+
+Workers copy the current version into a node-local cache, verify it against its
+manifest and open it from there (see ``watch_snapshots`` in ``app/common/core.py``),
+so live queries never read files that ingest is writing. Processes touch a marker
+next to each cached version while they use it; a version is only pruned from the
+cache once nobody has touched it for ``SNAPSHOT_CACHE_GRACE`` seconds.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.common.embedding_codec import codec_path
+from app.common.task_manager import redis_conn
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")  # empty = serve DB_DIR in place
+SNAPSHOT_CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", "./snapshot_cache")
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("SNAPSHOT_POLL_INTERVAL", "30"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+# Newest cached versions always kept; older ones only once unused for SNAPSHOT_CACHE_GRACE seconds
+SNAPSHOT_CACHE_KEEP = 2
+SNAPSHOT_CACHE_GRACE = float(os.getenv("SNAPSHOT_CACHE_GRACE", str(max(900.0, SNAPSHOT_POLL_INTERVAL * 3))))
+
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+SQLITE_FILE = "chroma.sqlite3"
+CODEC_FILE = "embedding_codec.npz"
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy_index(db_dir: Path, target: Path) -> None:
+    """Copy the SQLite database (via the backup API, so it is consistent) and the segment directories."""
+    if not (db_dir / SQLITE_FILE).exists():
+        raise FileNotFoundError(f"No Chroma database in {db_dir}")
+    target.mkdir(parents=True)
+    # Read-only, so a wrong path can't create an empty database
+    source_db = sqlite3.connect(f"file:{db_dir / SQLITE_FILE}?mode=ro", uri=True)
+    dest_db = sqlite3.connect(str(target / SQLITE_FILE))
+    try:
+        source_db.backup(dest_db)
+    finally:
+        dest_db.close()
+        source_db.close()
+    for entry in db_dir.iterdir():
+        if entry.is_dir():
+            shutil.copytree(entry, target / entry.name)
+    # Wherever ingest saved it (EMBED_CODEC_PATH may point outside db_dir); workers read it from the snapshot
+    codec_file = codec_path(str(db_dir))
+    if codec_file.exists():
+        shutil.copy2(codec_file, target / CODEC_FILE)
+
+
+def _file_entries(root: Path) -> Dict[str, Dict[str, Any]]:
+    return {
+        path.relative_to(root).as_posix(): {"bytes": path.stat().st_size, "sha256": _sha256(path)}
+        for path in sorted(root.rglob("*"))
+        if path.is_file() and path.name != MANIFEST
+    }
+
+
+def _checksum(files: Dict[str, Dict[str, Any]]) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(f"{name}:{files[name]['sha256']}\n".encode())
+    return digest.hexdigest()
+
+
+def _versions(root: Path) -> List[Path]:
+    """Complete snapshot directories, oldest first (version names sort by creation time)."""
+    return sorted(path for path in root.iterdir() if path.is_dir() and (path / MANIFEST).exists())
+
+
+def current_version(snapshot_dir: str = SNAPSHOT_DIR) -> Optional[str]:
+    """The version ``CURRENT`` points at, or None before anything was published."""
+    try:
+        version = (Path(snapshot_dir) / CURRENT).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def read_manifest(snapshot_path: Path) -> Dict[str, Any]:
+    return json.loads((snapshot_path / MANIFEST).read_text(encoding="utf-8"))
+
+
+def verify_snapshot(snapshot_path: Path, manifest: Dict[str, Any]) -> List[str]:
+    """Files that are missing or differ from the manifest (empty when the snapshot is intact)."""
+    files = _file_entries(snapshot_path)
+    problems = [name for name, entry in manifest["files"].items() if files.get(name) != entry]
+    if not problems and _checksum(files) != manifest["checksum"]:
+        problems.append(MANIFEST)
+    return problems
+
+
+def publish_snapshot(
+    db_dir: str,
+    snapshot_dir: str = SNAPSHOT_DIR,
+    collections: Optional[Dict[str, int]] = None,
+    embed_model: str = "",
+    keep: int = SNAPSHOT_KEEP,
+) -> Dict[str, Any]:
+    """Copy ``db_dir`` into a new immutable version under ``snapshot_dir`` and make it current."""
+    root = Path(snapshot_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    created = datetime.now(timezone.utc)
+    staging = root / f".staging-{uuid.uuid4().hex}"
+    try:
+        _copy_index(Path(db_dir), staging)
+        files = _file_entries(staging)
+        checksum = _checksum(files)
+        version = f"{created:%Y%m%dT%H%M%SZ}-{checksum[:8]}"
+        manifest = {
+            "version": version,
+            "created_at": created.isoformat(),
+            "checksum": checksum,
+            "embed_model": embed_model,
+            "collections": collections or {},
+            "bytes": sum(entry["bytes"] for entry in files.values()),
+            "files": files,
+        }
+        (staging / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.rename(staging, root / version)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    pointer = root / f".{CURRENT}.{uuid.uuid4().hex}"
+    pointer.write_text(version, encoding="utf-8")
+    os.replace(pointer, root / CURRENT)
+
+    for old in _versions(root)[:-keep] if keep > 0 else []:
+        if old.name != version:
+            shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def _use_marker(cache: Path, version: str) -> Path:
+    # Outside the version directory, which must keep matching its manifest
+    return cache / f".{version}.in-use"
+
+
+def mark_in_use(version: Optional[str], cache_dir: str = SNAPSHOT_CACHE_DIR) -> None:
+    """Record that this process still serves the cached ``version``, so no other process prunes it."""
+    if not version:
+        return
+    try:
+        _use_marker(Path(cache_dir), version).touch()
+    except OSError as exc:  # pragma: no cover - cache directory removed or read-only
+        logging.warning("Unable to mark index snapshot %s in use: %s", version, exc)
+
+
+def fetch_snapshot(version: str, snapshot_dir: str = SNAPSHOT_DIR, cache_dir: str = SNAPSHOT_CACHE_DIR) -> Path:
+    """Local, verified copy of ``version``; copied from ``snapshot_dir`` unless already cached."""
+    cache = Path(cache_dir)
+    target = cache / version
+    if (target / MANIFEST).exists():
+        mark_in_use(version, cache_dir)
+        return target
+    cache.mkdir(parents=True, exist_ok=True)
+    staging = cache / f".fetch-{version}-{uuid.uuid4().hex}"
+    try:
+        shutil.copytree(Path(snapshot_dir) / version, staging)
+        problems = verify_snapshot(staging, read_manifest(staging))
+        if problems:
+            raise ValueError(f"Snapshot {version} failed verification: {', '.join(problems[:5])}")
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another process on this node fetched it first
+            if not (target / MANIFEST).exists():
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    mark_in_use(version, cache_dir)
+
+    # Other processes on this node may still have older versions open
+    now = time.time()
+    for old in _versions(cache)[:-SNAPSHOT_CACHE_KEEP]:
+        marker = _use_marker(cache, old.name)
+        try:
+            idle = now - marker.stat().st_mtime
+        except FileNotFoundError:
+            idle = now - old.stat().st_mtime
+        if old.name != version and idle > SNAPSHOT_CACHE_GRACE:
+            shutil.rmtree(old, ignore_errors=True)
+            marker.unlink(missing_ok=True)
+    return target
+
+
+def report_version(version: Optional[str], pid: Optional[int] = None) -> None:
+    """Advertise the active index version of worker process ``pid`` (default: this one) on ``/health``."""
+    if not version:
+        return
+    try:
+        ttl = int(max(60, SNAPSHOT_POLL_INTERVAL * 3))
+        redis_conn.setex(f"index_version:{socket.gethostname()}.{pid or os.getpid()}", ttl, version)
+    except Exception as exc:  # pragma: no cover - redis outages
+        logging.warning("Unable to report index version: %s", exc)
+
+
+def fleet_versions() -> Dict[str, int]:
+    """Number of worker processes serving each index version."""
+    counts: Dict[str, int] = {}
+    try:
+        keys = list(redis_conn.scan_iter(match="index_version:*", count=500))
+        for version in redis_conn.mget(keys) if keys else []:
+            if version:
+                counts[version.decode()] = counts.get(version.decode(), 0) + 1
+    except Exception as exc:  # pragma: no cover - redis outages
+        logging.warning("Unable to read index versions: %s", exc)
+    return counts
@@ -4,10 +4,15 @@ Task management system using Redis Queue (RQ) for handling chat requests.
 import redis
 import rq
 import json
+import logging
 import os
-from typing import Dict, Any, Optional
+import time
+import zlib
+from typing import Dict, Any, List, Optional, Sequence
 from uuid import uuid4
 
+from app.common import tracing
+
 # Redis connection
 REDIS_HOST = os.getenv("REDIS_HOST", "10.160.13.16")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
@@ -15,6 +20,26 @@ REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 
 redis_conn = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
 task_queue = rq.Queue('chat_tasks', connection=redis_conn)
+# Speculative retrieval for questions still being typed; workers drain chat_tasks first
+prefetch_queue = rq.Queue('prefetch_tasks', connection=redis_conn)
+
+# Result store for finished chat jobs
+TASK_RESULT_TTL = int(os.getenv("TASK_RESULT_TTL", "3600"))
+# Once a client has read a result it only needs to survive a few more polls
+TASK_RESULT_FETCHED_TTL = int(os.getenv("TASK_RESULT_FETCHED_TTL", "300"))
+# Cap on the encoded size of all stored results; those closest to expiry are evicted first (0 = no cap)
+TASK_RESULT_MAX_BYTES = int(os.getenv("TASK_RESULT_MAX_BYTES", str(256 * 2**20)))
+# Smaller payloads are stored uncompressed, where zlib's overhead outweighs the saving
+TASK_RESULT_COMPRESS_MIN = int(os.getenv("TASK_RESULT_COMPRESS_MIN", "256"))
+TASK_RESULT_EVICT_BATCH = 100
+
+RESULT_INDEX_KEY = "task_results:index"  # sorted set: task_id -> expiry time
+RESULT_SIZES_KEY = "task_results:sizes"  # hash: task_id -> encoded bytes
+RESULT_STATS_KEY = "task_results:stats"  # hash: counters reported by result_store_stats()
+
+# Flag bits in the first byte of an encoded result
+_COMPRESSED = 0x01
+_CITATIONS_ARE_SOURCES = 0x02
 
 
 class TaskStatus:
@@ -24,7 +49,15 @@ class TaskStatus:
     FAILED = "failed"
 
 
-def queue_chat_request(question: str, session_id: str, top_k: int = 5, use_web_search: bool = True) -> str:
+def queue_chat_request(
+    question: str,
+    session_id: str,
+    top_k: int = 5,
+    use_web_search: bool = True,
+    profile: bool = False,
+    latency_budget_ms: Optional[int] = None,
+    shards: Optional[List[str]] = None,
+) -> str:
     """
     Queue a chat request for processing by a worker.
 
@@ -33,6 +66,9 @@ def queue_chat_request(question: str, session_id: str, top_k: int = 5, use_web_s
         session_id: Session identifier
         top_k: Number of results to return
         use_web_search: Whether to use web search
+        profile: Whether the worker should capture a profile for this request
+        latency_budget_ms: End-to-end budget, counted from now, that the worker degrades to meet
+        shards: Restrict retrieval to these shards (collections) instead of routing
 
     Returns:
         Task ID for tracking the request
@@ -47,13 +83,30 @@ def queue_chat_request(question: str, session_id: str, top_k: int = 5, use_web_s
         "use_web_search": use_web_search,
         "status": TaskStatus.QUEUED
     }
+    if profile:
+        task_data["profile"] = True
+    if latency_budget_ms:
+        task_data["latency_budget_ms"] = latency_budget_ms
+        task_data["deadline"] = time.time() + latency_budget_ms / 1000
+    if shards:
+        task_data["shards"] = shards
 
     # Queue the task
-    task_queue.enqueue(
-        "app.worker.chat_worker.process_chat_request",
-        task_data,
-        job_id=task_id
-    )
+    with tracing.span("enqueue chat_tasks", kind="producer", **{
+        "messaging.system": "rq", "messaging.destination.name": "chat_tasks", "task.id": task_id,
+    }):
+        traceparent = tracing.inject()
+        if traceparent:
+            # The worker continues the trace and records the time spent queued
+            task_data["traceparent"] = traceparent
+            task_data["trace_enqueued_ns"] = time.time_ns()
+        # The answer itself goes to the result store; the job record only needs to outlive it
+        task_queue.enqueue(
+            "app.worker.chat_worker.process_chat_request",
+            task_data,
+            job_id=task_id,
+            result_ttl=TASK_RESULT_TTL,
+        )
 
     return task_id
 
@@ -83,7 +136,9 @@ def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
         }
 
         if job.is_finished:
-            result["result"] = job.result
+            stored = get_task_result(task_id)
+            # Jobs whose result could not be stored kept it on the RQ job instead
+            result["result"] = stored if stored is not None else job.result
             result["status"] = TaskStatus.COMPLETED
         elif job.is_failed:
             result["error"] = str(job.exc_info)
@@ -96,28 +151,383 @@ def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+def _encode_result(result: Dict[str, Any]) -> bytes:
+    payload = dict(result)
+    flags = 0
+    # Chat results carry the same list as both sources and citations; keep one copy
+    if "citations" in payload and payload.get("citations") == payload.get("sources"):
+        del payload["citations"]
+        flags |= _CITATIONS_ARE_SOURCES
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(body) >= TASK_RESULT_COMPRESS_MIN:
+        body = zlib.compress(body, 6)
+        flags |= _COMPRESSED
+    return bytes([flags]) + body
+
+
+def _decode_result(blob: bytes) -> Dict[str, Any]:
+    flags, body = blob[0], blob[1:]
+    if flags & _COMPRESSED:
+        body = zlib.decompress(body)
+    result = json.loads(body)
+    if flags & _CITATIONS_ARE_SOURCES:
+        result["citations"] = result.get("sources")
+    return result
+
+
 def store_task_result(task_id: str, result: Dict[str, Any]) -> None:
     """
-    Store the result of a completed task.
+    Store the result of a completed task, compressed, for TASK_RESULT_TTL seconds.
 
     Args:
         task_id: The task identifier
         result: The task result data
     """
-    redis_conn.setex(f"task_result:{task_id}", 3600, json.dumps(result))  # Expire in 1 hour
+    blob = _encode_result(result)
+    now = time.time()
+    pipe = redis_conn.pipeline()
+    pipe.hget(RESULT_SIZES_KEY, task_id)
+    pipe.setex(f"task_result:{task_id}", TASK_RESULT_TTL, blob)
+    pipe.zadd(RESULT_INDEX_KEY, {task_id: now + TASK_RESULT_TTL})
+    pipe.hset(RESULT_SIZES_KEY, task_id, len(blob))
+    pipe.hincrby(RESULT_STATS_KEY, "stored", 1)
+    pipe.hincrby(RESULT_STATS_KEY, "stored_bytes", len(blob))
+    pipe.hincrby(RESULT_STATS_KEY, "raw_bytes", len(json.dumps(result)))
+    previous_size = pipe.execute()[0]
+    # A retried job replaces its earlier result
+    redis_conn.hincrby(RESULT_STATS_KEY, "bytes", len(blob) - int(previous_size or 0))
+    _enforce_result_budget(now)
+
+
+def _forget_results(task_ids: Sequence[str], evict: bool) -> int:
+    """Drop results from the size accounting (and from Redis when evicting); returns bytes freed."""
+    if not task_ids:
+        return 0
+    sizes = redis_conn.hmget(RESULT_SIZES_KEY, task_ids)
+    pipe = redis_conn.pipeline()
+    for task_id in task_ids:
+        pipe.zrem(RESULT_INDEX_KEY, task_id)
+    # Only the caller that removed an entry from the index accounts for it
+    removed = [
+        (task_id, int(size or 0))
+        for task_id, size, was_removed in zip(task_ids, sizes, pipe.execute())
+        if was_removed
+    ]
+    if not removed:
+        return 0
+    freed = sum(size for _, size in removed)
+    pipe = redis_conn.pipeline()
+    pipe.hdel(RESULT_SIZES_KEY, *[task_id for task_id, _ in removed])
+    pipe.hincrby(RESULT_STATS_KEY, "bytes", -freed)
+    if evict:
+        for task_id, _ in removed:
+            pipe.delete(f"task_result:{task_id}")
+            # Without its result the job record would report a completed task with nothing in it
+            pipe.delete(rq.job.Job.key_for(task_id))
+    replies = pipe.execute()
+    if evict:
+        # Counted only where the result itself was still there, not just its job record
+        live = [size for (_, size), deleted in zip(removed, replies[2::2]) if deleted]
+        if live:
+            pipe = redis_conn.pipeline()
+            pipe.hincrby(RESULT_STATS_KEY, "evicted", len(live))
+            pipe.hincrby(RESULT_STATS_KEY, "evicted_bytes", sum(live))
+            pipe.execute()
+            logging.info("Evicted %d task results (%d bytes) to stay under TASK_RESULT_MAX_BYTES",
+                         len(live), sum(live))
+    return freed
+
+
+def _forget_expired(now: float) -> None:
+    """Drop results whose TTL has run out from the size accounting."""
+    expired = redis_conn.zrangebyscore(RESULT_INDEX_KEY, "-inf", now)
+    _forget_results([task_id.decode() for task_id in expired], evict=False)
+
+
+def _enforce_result_budget(now: float) -> None:
+    try:
+        _forget_expired(now)
+        if not TASK_RESULT_MAX_BYTES:
+            return
+        over = int(redis_conn.hget(RESULT_STATS_KEY, "bytes") or 0) - TASK_RESULT_MAX_BYTES
+        while over > 0:
+            soonest = [task_id.decode() for task_id in redis_conn.zrange(RESULT_INDEX_KEY, 0, TASK_RESULT_EVICT_BATCH - 1)]
+            if not soonest:
+                break
+            victims, needed = [], over
+            for task_id, size in zip(soonest, redis_conn.hmget(RESULT_SIZES_KEY, soonest)):
+                victims.append(task_id)
+                needed -= int(size or 0)
+                if needed <= 0:
+                    break
+            over -= _forget_results(victims, evict=True)
+    except Exception as exc:  # pragma: no cover - redis outages
+        logging.warning("Task result eviction failed: %s", exc)
 
 
 def get_task_result(task_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieve the result of a completed task.
 
+    The first read shortens the result's (and its job's) remaining lifetime to
+    TASK_RESULT_FETCHED_TTL seconds.
+
     Args:
         task_id: The task identifier
 
     Returns:
         The task result data or None if not found
     """
-    result = redis_conn.get(f"task_result:{task_id}")
-    if result:
-        return json.loads(result)
-    return None
\ No newline at end of file
+    key = f"task_result:{task_id}"
+    pipe = redis_conn.pipeline()
+    pipe.get(key)
+    pipe.ttl(key)
+    blob, ttl = pipe.execute()
+    if blob is None:
+        return None
+    if ttl > TASK_RESULT_FETCHED_TTL:
+        pipe = redis_conn.pipeline()
+        pipe.expire(key, TASK_RESULT_FETCHED_TTL)
+        pipe.expire(rq.job.Job.key_for(task_id), TASK_RESULT_FETCHED_TTL)
+        # Keep the accounting in step with the shorter lifetime (XX: never re-adds a forgotten entry)
+        pipe.zadd(RESULT_INDEX_KEY, {task_id: time.time() + TASK_RESULT_FETCHED_TTL}, xx=True)
+        pipe.hincrby(RESULT_STATS_KEY, "fetched", 1)
+        pipe.execute()
+    return _decode_result(blob)
+
+
+def result_store_stats() -> Dict[str, Any]:
+    """
+    Report the size of the task result store and its eviction counters.
+
+    Returns:
+        Dictionary with entry and byte counts, configured cap and cumulative counters
+    """
+    try:
+        _forget_expired(time.time())
+        pipe = redis_conn.pipeline()
+        pipe.zcard(RESULT_INDEX_KEY)
+        pipe.hgetall(RESULT_STATS_KEY)
+        entries, counters = pipe.execute()
+    except Exception as exc:  # pragma: no cover - redis outages
+        logging.warning("Unable to read task result store stats: %s", exc)
+        return {}
+    counters = {name.decode(): int(value) for name, value in counters.items()}
+    stored_bytes = counters.get("stored_bytes", 0)
+    return {
+        "entries": entries,
+        "bytes": counters.get("bytes", 0),
+        "max_bytes": TASK_RESULT_MAX_BYTES,
+        "stored": counters.get("stored", 0),
+        "fetched": counters.get("fetched", 0),
+        "evicted": counters.get("evicted", 0),
+        "evicted_bytes": counters.get("evicted_bytes", 0),
+        "compression_ratio": round(counters.get("raw_bytes", 0) / stored_bytes, 2) if stored_bytes else None,
+    }
+
+# -------- Batch requests --------
+BATCH_JOB_TIMEOUT = int(os.getenv("BATCH_JOB_TIMEOUT", "14400"))
+BATCH_RESULT_TTL = int(os.getenv("BATCH_RESULT_TTL", "86400"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "10000"))
+
+
+def queue_batch_request(questions: list, top_k: int = 5, use_web_search: bool = False) -> str:
+    """
+    Queue a list of questions as a single batch job.
+
+    Args:
+        questions: The questions to answer, in order
+        top_k: Number of results to use per question
+        use_web_search: Whether to use web search for each question
+
+    Returns:
+        Batch ID for tracking progress and streaming results
+    """
+    batch_id = str(uuid4())
+
+    batch_data = {
+        "batch_id": batch_id,
+        "questions": questions,
+        "top_k": top_k,
+        "use_web_search": use_web_search,
+    }
+
+    pipe = redis_conn.pipeline()
+    pipe.hset(f"batch:{batch_id}", mapping={"total": len(questions), "completed": 0, "failed": 0})
+    pipe.expire(f"batch:{batch_id}", BATCH_RESULT_TTL)
+    pipe.execute()
+
+    task_queue.enqueue(
+        "app.worker.batch_worker.process_batch_request",
+        batch_data,
+        job_id=batch_id,
+        job_timeout=BATCH_JOB_TIMEOUT,
+        result_ttl=BATCH_RESULT_TTL,
+    )
+
+    return batch_id
+
+
+def append_batch_results(batch_id: str, results: list) -> None:
+    """
+    Append finished results (in question order) to a batch and advance its progress.
+
+    Args:
+        batch_id: The batch identifier
+        results: Result payloads, each carrying its question ``index``
+    """
+    if not results:
+        return
+    failed = sum(1 for result in results if result.get("error"))
+    pipe = redis_conn.pipeline()
+    pipe.rpush(f"batch:{batch_id}:results", *[json.dumps(result) for result in results])
+    pipe.expire(f"batch:{batch_id}:results", BATCH_RESULT_TTL)
+    pipe.hincrby(f"batch:{batch_id}", "completed", len(results))
+    pipe.hincrby(f"batch:{batch_id}", "failed", failed)
+    pipe.execute()
+
+
+def get_batch_status(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the progress of a batch.
+
+    Args:
+        batch_id: The batch identifier
+
+    Returns:
+        Dictionary with status, total, completed and failed counts
+    """
+    progress = redis_conn.hgetall(f"batch:{batch_id}")
+    if not progress:
+        return None
+
+    status = TaskStatus.QUEUED
+    job = task_queue.fetch_job(batch_id)
+    if job is not None:
+        if job.is_finished:
+            status = TaskStatus.COMPLETED
+        elif job.is_failed:
+            status = TaskStatus.FAILED
+        elif job.is_started:
+            status = TaskStatus.PROCESSING
+    elif int(progress.get(b"completed", 0)) >= int(progress.get(b"total", 0)):
+        # The job record expired before the results did
+        status = TaskStatus.COMPLETED
+
+    return {
+        "batch_id": batch_id,
+        "status": status,
+        "total": int(progress.get(b"total", 0)),
+        "completed": int(progress.get(b"completed", 0)),
+        "failed": int(progress.get(b"failed", 0)),
+    }
+
+
+def get_batch_results(batch_id: str, start: int = 0) -> list:
+    """
+    Fetch finished batch results from position ``start`` onwards.
+
+    Args:
+        batch_id: The batch identifier
+        start: Index of the first result to return
+
+    Returns:
+        List of result payloads
+    """
+    return [json.loads(item) for item in redis_conn.lrange(f"batch:{batch_id}:results", start, -1)]
+
+
+# -------- Typeahead prefetch --------
+PREFETCH_TTL = int(os.getenv("PREFETCH_TTL", "60"))
+# Prefetches that add work (rather than replace a queued one) allowed per session per minute
+PREFETCH_MAX_PER_MINUTE = int(os.getenv("PREFETCH_MAX_PER_MINUTE", "30"))
+
+
+def queue_prefetch_request(
+    question: str,
+    session_id: str,
+    top_k: int = 5,
+    shards: Optional[List[str]] = None,
+) -> Optional[str]:
+    """
+    Queue retrieval for a partially typed question, replacing the session's previous prefetch.
+
+    A prefetch that is still queued is replaced by the newer question rather than
+    counted again, so the newest text is never the one turned away.
+
+    Args:
+        question: The question as typed so far
+        session_id: Session identifier the candidates are cached under
+        top_k: Number of reranked candidates to keep
+        shards: Restrict retrieval to these shards (collections) instead of routing
+
+    Returns:
+        Prefetch ID, or None when the session is over its prefetch rate limit
+    """
+    latest_key = f"prefetch:{session_id}:latest"
+    previous = redis_conn.get(latest_key)
+    # Still-queued prefetches are dropped without a worker ever seeing them
+    replaced = bool(previous) and prefetch_queue.remove(previous.decode()) > 0
+    if not replaced:
+        minute_key = f"prefetch:{session_id}:minute:{int(time.time() // 60)}"
+        pipe = redis_conn.pipeline()
+        pipe.incr(minute_key)
+        pipe.expire(minute_key, 60)
+        count, _ = pipe.execute()
+        if count > PREFETCH_MAX_PER_MINUTE:
+            return None
+
+    prefetch_id = str(uuid4())
+    # Workers check this before each stage, so a superseded running prefetch stops early
+    redis_conn.set(latest_key, prefetch_id, ex=PREFETCH_TTL)
+
+    task_data = {
+        "prefetch_id": prefetch_id,
+        "question": question,
+        "session_id": session_id,
+        "top_k": top_k,
+    }
+    if shards:
+        task_data["shards"] = shards
+    prefetch_queue.enqueue(
+        "app.worker.chat_worker.prefetch_candidates",
+        task_data,
+        job_id=prefetch_id,
+        ttl=PREFETCH_TTL,
+        result_ttl=0,
+        failure_ttl=PREFETCH_TTL,
+    )
+    return prefetch_id
+
+
+def is_current_prefetch(session_id: str, prefetch_id: str) -> bool:
+    """Whether ``prefetch_id`` is still the session's newest prefetch."""
+    latest = redis_conn.get(f"prefetch:{session_id}:latest")
+    return latest is not None and latest.decode() == prefetch_id
+
+
+def store_prefetched_candidates(session_id: str, candidates: Dict[str, Any]) -> None:
+    """
+    Cache a session's prefetched candidates for PREFETCH_TTL seconds.
+
+    Args:
+        session_id: Session identifier
+        candidates: Question, query embedding, shards and reranked results
+    """
+    redis_conn.setex(f"prefetch:{session_id}", PREFETCH_TTL, json.dumps(candidates))
+
+
+def get_prefetched_candidates(session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve the session's prefetched candidates.
+
+    Args:
+        session_id: Session identifier
+
+    Returns:
+        The cached candidates or None if there are none
+    """
+    cached = redis_conn.get(f"prefetch:{session_id}")
+    if cached:
+        return json.loads(cached)
+    return None
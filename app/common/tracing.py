@@ -0,0 +1,357 @@
+"""
+Lightweight distributed tracing for chat requests.
+
+Spans follow the OpenTelemetry data model (trace and span ids, parent ids, kinds,
+attributes, status) and propagate as a W3C ``traceparent`` string, which travels
+from ``/ask`` to the worker inside ``task_data``. The API and worker each record
+their own spans: the ``/ask`` handler and enqueue, then queue wait, the job, each
+retrieval-graph node, model inference, Chroma queries, web search and the LLM call.
+
+Traces are sampled once at the root (``TRACE_SAMPLE_RATE``, or the sampled flag of
+an incoming ``traceparent``); inside an unsampled request every ``span()`` is a
+no-op. Finished spans are queued and exported in batches by a background thread to
+the exporter named by ``TRACE_EXPORTER``: ``console``, ``file`` (JSON lines),
+``otlp`` (OTLP/HTTP JSON, e.g. to an OpenTelemetry Collector) or anything added
+with :func:`register_exporter`.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "chroma-faq-bot")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2"))
+TRACE_EXPORT_BATCH = 512
+# Spans beyond this many waiting for export are dropped rather than slowing requests
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "4096"))
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+    sampled: bool = True
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def _random_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+def extract(traceparent: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C ``traceparent`` header; None if it is missing or malformed."""
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 0x01)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return SpanContext(parts[1], parts[2], sampled)
+
+
+class Span:
+    """One timed operation; created by :func:`span`, exported when it ends."""
+
+    __slots__ = ("name", "context", "parent_id", "kind", "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, name: str, context: SpanContext, parent_id: Optional[str], kind: str,
+                 attributes: Dict[str, Any], start_ns: Optional[int] = None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = "OK"
+        self.error = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "ERROR"
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            _processor.submit(self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": TRACE_SERVICE_NAME,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.error} if self.error else {"code": self.status},
+        }
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_trace_span", default=None)
+
+
+def enabled() -> bool:
+    return _processor.exporter is not None
+
+
+def current() -> Optional[SpanContext]:
+    """Context of the span running in this thread, or None outside a sampled trace."""
+    active = _current.get()
+    return active.context if active is not None else None
+
+
+def inject() -> Optional[str]:
+    """``traceparent`` for the current span, to carry across the queue (None when not traced)."""
+    active = _current.get()
+    return active.context.traceparent if active is not None else None
+
+
+def new_root(traceparent: Optional[str] = None) -> Optional[SpanContext]:
+    """Decide sampling for a new request, honouring an incoming ``traceparent``."""
+    if not enabled():
+        return None
+    incoming = extract(traceparent)
+    if incoming is not None:
+        return incoming if incoming.sampled else None
+    if random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    # The root span's own id replaces this placeholder parent
+    return SpanContext(_random_id(16), "", True)
+
+
+def start_span(name: str, parent: Optional[SpanContext] = None, kind: str = "internal",
+               start_ns: Optional[int] = None, **attributes) -> Optional[Span]:
+    """Start a span under ``parent`` (default: the current span); None when not traced."""
+    if parent is None:
+        parent = current()
+    if parent is None or not parent.sampled or not enabled():
+        return None
+    context = SpanContext(parent.trace_id, _random_id(8), True)
+    return Span(name, context, parent.span_id or None, kind, attributes, start_ns)
+
+
+@contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, kind: str = "internal", **attributes):
+    """Time the block as a span and make it current; yields None when the request isn't traced."""
+    active = start_span(name, parent, kind, **attributes)
+    if active is None:
+        yield None
+        return
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as exc:
+        active.record_exception(exc)
+        raise
+    finally:
+        _current.reset(token)
+        active.end()
+
+
+def record_span(name: str, parent: Optional[SpanContext], start_ns: int, end_ns: int,
+                kind: str = "internal", **attributes) -> None:
+    """Record an interval measured elsewhere, such as time spent waiting in the queue."""
+    finished = start_span(name, parent, kind, start_ns, **attributes)
+    if finished is not None:
+        finished.end(end_ns)
+
+
+def traced_node(name: str, fn: Callable) -> Callable:
+    """Wrap a retrieval-graph node in a span parented on ``state["trace"]``."""
+
+    def wrapper(state):
+        parent = state.get("trace")
+        if parent is None:
+            return fn(state)
+        # Nodes may run on LangGraph's executor threads, so set the parent explicitly
+        with span(f"node:{name}", parent=parent):
+            return fn(state)
+
+    return wrapper
+
+
+# -------- Export --------
+class ConsoleExporter:
+    """Writes one JSON object per span to stderr."""
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        for item in spans:
+            sys.stderr.write(json.dumps(item) + "\n")
+        sys.stderr.flush()
+
+
+class FileExporter:
+    """Appends one JSON object per span to ``TRACE_FILE``."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for item in spans:
+                fh.write(json.dumps(item) + "\n")
+
+
+_OTLP_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpExporter:
+    """Posts spans as OTLP/HTTP JSON to ``TRACE_OTLP_ENDPOINT``."""
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT):
+        import httpx
+
+        self.endpoint = endpoint
+        self.client = httpx.Client(timeout=5)
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        otlp_spans = []
+        for item in spans:
+            otlp = {
+                "traceId": item["trace_id"],
+                "spanId": item["span_id"],
+                "name": item["name"],
+                "kind": _OTLP_KINDS.get(item["kind"], 1),
+                "startTimeUnixNano": str(item["start_time_unix_nano"]),
+                "endTimeUnixNano": str(item["end_time_unix_nano"]),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in item["attributes"].items()],
+                "status": {"code": 2 if item["status"]["code"] == "ERROR" else 1,
+                           "message": item["status"].get("message", "")},
+            }
+            if item["parent_span_id"]:
+                otlp["parentSpanId"] = item["parent_span_id"]
+            otlp_spans.append(otlp)
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": _otlp_value(TRACE_SERVICE_NAME)}]},
+                "scopeSpans": [{"scope": {"name": "app.common.tracing"}, "spans": otlp_spans}],
+            }]
+        }
+        self.client.post(self.endpoint, json=body).raise_for_status()
+
+
+_exporter_factories: Dict[str, Callable[[], Any]] = {
+    "console": ConsoleExporter,
+    "file": FileExporter,
+    "otlp": OtlpHttpExporter,
+}
+
+
+def register_exporter(name: str, factory: Callable[[], Any]) -> None:
+    """Make ``TRACE_EXPORTER=name`` use ``factory()``, an object with ``export(spans)``."""
+    _exporter_factories[name] = factory
+    if name == TRACE_EXPORTER and _processor.exporter is None:
+        set_exporter(factory())
+
+
+class _BatchProcessor:
+    """Queues finished spans and exports them in batches off the request path."""
+
+    def __init__(self):
+        self.exporter: Any = None
+        self.queue: "queue.Queue[Span]" = queue.Queue(maxsize=TRACE_MAX_QUEUE)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def submit(self, finished: Span) -> None:
+        if self.exporter is None:
+            return
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self) -> None:
+        # RQ forks a work horse per job; threads don't survive the fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="trace-export", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(TRACE_EXPORT_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        """Export everything queued so far (call before a process exits)."""
+        while True:
+            batch: List[Dict[str, Any]] = []
+            while len(batch) < TRACE_EXPORT_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait().as_dict())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                with self._export_lock:
+                    self.exporter.export(batch)
+            except Exception as exc:  # pragma: no cover - exporter/network failures
+                logging.warning("Dropped %d spans: export failed: %s", len(batch), exc)
+
+
+_processor = _BatchProcessor()
+
+
+def set_exporter(exporter: Any) -> None:
+    """Send spans to ``exporter`` (None turns tracing off)."""
+    _processor.exporter = exporter
+
+
+def flush() -> None:
+    if _processor.exporter is not None:
+        _processor.flush()
+
+
+if TRACE_EXPORTER not in ("", "none"):
+    if TRACE_EXPORTER in _exporter_factories:
+        try:
+            set_exporter(_exporter_factories[TRACE_EXPORTER]())
+        except Exception as exc:  # pragma: no cover - exporter misconfiguration
+            logging.warning("Tracing disabled: unable to create %s exporter: %s", TRACE_EXPORTER, exc)
+    else:
+        logging.warning("Tracing disabled: unknown TRACE_EXPORTER %r", TRACE_EXPORTER)
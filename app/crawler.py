@@ -0,0 +1,211 @@
+"""
+Concurrent documentation crawler with conditional-GET caching.
+
+Pages are fetched through one pooled ``httpx.AsyncClient`` with a bounded number
+of in-flight requests per host. ETag/Last-Modified validators and a content hash
+are kept on disk so unchanged pages come back as ``not_modified`` and can skip
+parsing and embedding on the next ingest; pages answering 404/410 come back as
+``gone`` so their chunks can be removed.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import httpx
+from bs4 import BeautifulSoup
+
+DEFAULT_MAX_PAGES = 500
+DEFAULT_PER_HOST_CONCURRENCY = 4
+USER_AGENT = "chroma-faq-bot-crawler/1.0"
+
+
+@dataclass
+class CrawledPage:
+    url: str
+    html: Optional[str]
+    links: List[str] = field(default_factory=list)
+    not_modified: bool = False
+    gone: bool = False
+
+
+class CrawlCache:
+    """On-disk map of URL -> validators, content hash and outgoing links."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as exc:
+                logging.warning("Ignoring unreadable crawl cache %s: %s", self.path, exc)
+                self.entries = {}
+
+    def get(self, url: str) -> Optional[Dict]:
+        return self.entries.get(url)
+
+    def update(self, url: str, **fields) -> None:
+        entry = self.entries.setdefault(url, {})
+        entry.update({k: v for k, v in fields.items() if v is not None})
+        entry["checked_at"] = time.time()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(self.entries, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+def normalize_url(url: str) -> str:
+    """Drop fragments so ``page#a`` and ``page#b`` are crawled once."""
+    return urldefrag(url.strip())[0]
+
+
+def default_prefix(seed_url: str) -> str:
+    """Allow everything under the seed URL's directory."""
+    seed = normalize_url(seed_url)
+    return seed.rsplit("/", 1)[0] + "/" if urlparse(seed).path.count("/") > 1 else seed
+
+
+def extract_links(html: str, base_url: str) -> List[str]:
+    soup = BeautifulSoup(html, "html.parser")
+    links: List[str] = []
+    for anchor in soup.find_all("a", href=True):
+        href = anchor["href"].strip()
+        if not href or href.startswith(("mailto:", "javascript:", "tel:")):
+            continue
+        links.append(normalize_url(urljoin(base_url, href)))
+    return sorted(set(links))
+
+
+def _content_hash(html: str) -> str:
+    return hashlib.sha1(html.encode("utf-8")).hexdigest()
+
+
+async def _fetch_page(
+    client: httpx.AsyncClient,
+    url: str,
+    semaphore: asyncio.Semaphore,
+    cache: Optional[CrawlCache],
+    revalidate: bool,
+) -> Optional[CrawledPage]:
+    entry = cache.get(url) if cache else None
+    headers: Dict[str, str] = {}
+    if entry and revalidate:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+        if response.status_code == 304 and entry:
+            cache.update(url)
+            return CrawledPage(url=url, html=None, links=entry.get("links", []), not_modified=True)
+        if response.status_code in (404, 410):
+            return CrawledPage(url=url, html=None, gone=True)
+        response.raise_for_status()
+    except Exception as exc:  # pragma: no cover - network may fail in some environments
+        logging.warning("Failed to fetch %s: %s", url, exc)
+        return None
+
+    html = response.text
+    digest = _content_hash(html)
+    links = extract_links(html, str(response.url))
+    unchanged = bool(revalidate and entry and entry.get("content_hash") == digest)
+    if cache:
+        cache.update(
+            url,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            content_hash=digest,
+            links=links,
+        )
+    return CrawledPage(url=url, html=None if unchanged else html, links=links, not_modified=unchanged)
+
+
+async def crawl(
+    seed_urls: Iterable[str],
+    allowed_prefixes: Optional[Iterable[str]] = None,
+    cache: Optional[CrawlCache] = None,
+    revalidate: bool = True,
+    max_pages: int = DEFAULT_MAX_PAGES,
+    per_host_concurrency: int = DEFAULT_PER_HOST_CONCURRENCY,
+    timeout: float = 30.0,
+    verify: bool = False,
+) -> List[CrawledPage]:
+    """Breadth-first crawl from ``seed_urls``, following links within ``allowed_prefixes``.
+
+    ``revalidate=False`` sends unconditional requests (use it after a collection reset,
+    when every page must be embedded again); the cache is still refreshed.
+    """
+    seeds = [normalize_url(url) for url in seed_urls if url]
+    prefixes = list(allowed_prefixes or []) or [default_prefix(url) for url in seeds]
+    hosts = {urlparse(url).netloc for url in seeds + prefixes}
+    semaphores: Dict[str, asyncio.Semaphore] = defaultdict(
+        lambda: asyncio.Semaphore(per_host_concurrency)
+    )
+
+    seen: set = set()
+    pages: List[CrawledPage] = []
+    queue: "asyncio.Queue[str]" = asyncio.Queue()
+
+    def enqueue(url: str) -> None:
+        if url in seen or len(seen) >= max_pages:
+            return
+        if not any(url.startswith(prefix) for prefix in prefixes):
+            return
+        seen.add(url)
+        queue.put_nowait(url)
+
+    limits = httpx.Limits(
+        max_connections=per_host_concurrency * max(1, len(hosts)),
+        max_keepalive_connections=per_host_concurrency * max(1, len(hosts)),
+    )
+    async with httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=timeout,
+        verify=verify,
+        limits=limits,
+        headers={"User-Agent": USER_AGENT},
+    ) as client:
+
+        async def worker() -> None:
+            while True:
+                url = await queue.get()
+                try:
+                    semaphore = semaphores[urlparse(url).netloc]
+                    page = await _fetch_page(client, url, semaphore, cache, revalidate)
+                    if page is not None:
+                        pages.append(page)
+                        for link in page.links:
+                            enqueue(link)
+                finally:
+                    queue.task_done()
+
+        for url in seeds:
+            enqueue(url)
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(per_host_concurrency * max(1, len(hosts)))
+        ]
+        await queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    return pages
+
+
+def crawl_sync(seed_urls: Iterable[str], **kwargs) -> List[CrawledPage]:
+    """Blocking wrapper around :func:`crawl` for the ingest CLI."""
+    return asyncio.run(crawl(seed_urls, **kwargs))
@@ -0,0 +1,166 @@
+"""
+Exact and near-duplicate chunk elimination for ingestion.
+
+Chunks are first grouped by a hash of their whitespace/case-normalised text, then
+by MinHash signatures bucketed with LSH banding. Every duplicate group collapses
+into its first chunk (the canonical one), whose metadata records the other sources
+in ``alternate_sources`` (a JSON list, since Chroma metadata values must be scalars)
+and, for FAQ chunks, the other questions in ``alternate_questions``.
+
+Only the chunks of one ingest run are compared. Chunks already in the collection
+(for example pages the crawler skipped as unchanged) are not checked against new ones.
+The whole run is held in memory (texts, metadata and one 64-value signature per
+unique chunk), which is fine for documentation-sized corpora.
+"""
+import hashlib
+import json
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.85  # estimated Jaccard similarity for near duplicates
+NUM_PERM = 64
+BANDS = 16                # 16 bands x 4 rows: ~50% chance of pairing at J=0.7, ~99% at J=0.9
+SHINGLE_WORDS = 5
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _shingle_hashes(normalized: str) -> np.ndarray:
+    words = re.findall(r"\w+", normalized)
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {
+            " ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)
+        }
+    return np.array(
+        [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+            for s in shingles
+        ],
+        dtype=np.uint64,
+    ) & _MERSENNE_PRIME
+
+
+def minhash_signature(normalized: str) -> np.ndarray:
+    hashes = _shingle_hashes(normalized)
+    # (a * x + b) mod p with x, a < 2**31 stays within uint64
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return permuted.min(axis=0)
+
+
+def _find(parent: List[int], idx: int) -> int:
+    while parent[idx] != idx:
+        parent[idx] = parent[parent[idx]]
+        idx = parent[idx]
+    return idx
+
+
+def dedupe_chunks(
+    docs: Iterable[Tuple[str, Dict]],
+    threshold: float = DEFAULT_THRESHOLD,
+    chunk_id: Optional[Callable[[Dict], str]] = None,
+) -> Tuple[List[Tuple[str, Dict]], List[str], Dict[str, int]]:
+    """Collapse exact and near-duplicate chunks, keeping the first of each group.
+
+    Returns the surviving ``(text, metadata)`` pairs in their original order, the
+    ``chunk_id`` of every dropped chunk (an earlier run may have stored it; empty
+    without ``chunk_id``) and a stats dict with ``input``, ``kept``,
+    ``exact_duplicates`` and ``near_duplicates``. Reads all of ``docs`` up front.
+    """
+    items = list(docs)
+    parent = list(range(len(items)))
+    exact_duplicates = 0
+    near_duplicates = 0
+
+    # Pass 1: exact duplicates
+    first_by_hash: Dict[str, int] = {}
+    normalized_texts: List[str] = []
+    for idx, (text, _meta) in enumerate(items):
+        normalized = normalize_text(text)
+        normalized_texts.append(normalized)
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        if digest in first_by_hash:
+            parent[idx] = first_by_hash[digest]
+            exact_duplicates += 1
+        else:
+            first_by_hash[digest] = idx
+
+    # Pass 2: MinHash/LSH over the remaining unique chunks
+    if threshold < 1.0:
+        rows = NUM_PERM // BANDS
+        signatures: Dict[int, np.ndarray] = {}
+        buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        for idx in first_by_hash.values():
+            signature = minhash_signature(normalized_texts[idx])
+            signatures[idx] = signature
+            for band in range(BANDS):
+                key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+                buckets.setdefault(key, []).append(idx)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            for other in members[1:]:
+                root, other_root = _find(parent, members[0]), _find(parent, other)
+                if root == other_root:
+                    continue
+                similarity = float(np.mean(signatures[members[0]] == signatures[other]))
+                if similarity >= threshold:
+                    # The earlier chunk stays canonical
+                    keep, drop = sorted((root, other_root))
+                    parent[drop] = keep
+                    near_duplicates += 1
+
+    alternates: Dict[int, List[str]] = {}
+    alternate_questions: Dict[int, List[str]] = {}
+    for idx, (_text, meta) in enumerate(items):
+        root = _find(parent, idx)
+        if root != idx:
+            source = meta.get("url") or meta.get("source")
+            canonical_meta = items[root][1]
+            if source and source != (canonical_meta.get("url") or canonical_meta.get("source")):
+                if source not in alternates.setdefault(root, []):
+                    alternates[root].append(source)
+            question = meta.get("question")
+            if question and question != canonical_meta.get("question"):
+                if question not in alternate_questions.setdefault(root, []):
+                    alternate_questions[root].append(question)
+
+    kept: List[Tuple[str, Dict]] = []
+    for idx, (text, meta) in enumerate(items):
+        if parent[idx] != idx:
+            continue
+        if alternates.get(idx):
+            meta = {
+                **meta,
+                "alternate_sources": json.dumps(alternates[idx]),
+                "duplicate_count": len(alternates[idx]),
+            }
+        if alternate_questions.get(idx):
+            meta = {**meta, "alternate_questions": json.dumps(alternate_questions[idx])}
+        kept.append((text, meta))
+
+    dropped_ids: List[str] = []
+    if chunk_id is not None:
+        kept_ids = {chunk_id(meta) for _text, meta in kept}
+        dropped_ids = sorted(
+            {chunk_id(meta) for idx, (_text, meta) in enumerate(items) if parent[idx] != idx} - kept_ids
+        )
+
+    stats = {
+        "input": len(items),
+        "kept": len(kept),
+        "exact_duplicates": exact_duplicates,
+        "near_duplicates": near_duplicates,
+    }
+    return kept, dropped_ids, stats
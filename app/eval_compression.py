@@ -0,0 +1,123 @@
+"""
+Memory vs recall of reduced-dimension / reduced-precision embedding storage.
+
+Re-embeds the collection's documents at full precision, takes exact cosine top-k
+as ground truth, and for every combination of reduction method, dimension and
+dtype reports recall@k of exact search over the transformed vectors together
+with the vector memory it needs. Chroma's index is float32 whatever the dtype, so
+``saving`` is the reduction inside Chroma; ``native_vector_mb`` is what a store
+keeping the reduced dtype natively would need.
+
+Queries are real questions (``--questions``, one per line) or a sample of the
+stored chunks, which are then left out of their own results.
+
+Example:
+    python -m app.eval_compression --dims 384 192 128 64 --dtype float32 float16 int8 \\
+        --method truncate pca --questions eval/questions.txt
+"""
+import argparse
+import itertools
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.common.embedding_codec import DTYPES, METHODS, EmbeddingCodec
+
+FIT_SAMPLES = 5000
+
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int, exclude: Optional[np.ndarray] = None) -> np.ndarray:
+    scores = queries @ corpus.T
+    if exclude is not None:
+        scores[np.arange(len(queries)), exclude] = -np.inf
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size if truth.size else 0.0
+
+
+def evaluate(
+    corpus: np.ndarray, queries: np.ndarray, k: int, codec: EmbeddingCodec, exclude: Optional[np.ndarray] = None
+) -> Dict[str, Any]:
+    rng = np.random.default_rng(0)
+    fit_rows = rng.choice(len(corpus), size=min(FIT_SAMPLES, len(corpus)), replace=False)
+    codec.fit(corpus[fit_rows])
+    truth = top_k(queries, corpus, k, exclude)
+    found = top_k(codec.transform(queries), codec.transform(corpus), k, exclude)
+    source_dim = corpus.shape[1]
+    dim = codec.dim or source_dim
+    native = len(corpus) * codec.bytes_per_vector(source_dim)
+    chroma = len(corpus) * dim * 4
+    full = len(corpus) * source_dim * 4
+    return {
+        "method": codec.method if codec.dim else "-",
+        "dim": dim,
+        "dtype": codec.dtype,
+        f"recall@{k}": round(recall(found, truth), 4),
+        "chroma_vector_mb": round(chroma / 2**20, 3),
+        "saving": f"{full / chroma:.1f}x",
+        "native_vector_mb": round(native / 2**20, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory saved and recall lost by embedding compression.")
+    parser.add_argument("--db_dir", type=str, default=os.getenv("DB_DIR", "./chroma_db"), help="Persisted Chroma directory")
+    parser.add_argument("--collection", type=str, default=os.getenv("COLLECTION", "faq"), help="Collection name")
+    parser.add_argument("--model", type=str, default=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+                        help="Embedding model")
+    parser.add_argument("--dims", type=int, nargs="+", default=[0, 256, 192, 128, 96, 64], help="Dimensions (0 = full)")
+    parser.add_argument("--method", choices=METHODS, nargs="+", default=list(METHODS), help="Reduction methods")
+    parser.add_argument("--dtype", choices=DTYPES, nargs="+", default=list(DTYPES), help="Storage precisions")
+    parser.add_argument("--k", type=int, default=5, help="Neighbours per query")
+    parser.add_argument("--questions", type=str, default=None, help="Text file of questions, one per line")
+    parser.add_argument("--queries", type=int, default=500, help="Chunks sampled as queries without --questions")
+    parser.add_argument("--output", type=str, default=None, help="Write all rows as JSON to this path")
+    args = parser.parse_args()
+
+    import chromadb
+    from sentence_transformers import SentenceTransformer
+    from app.common import batching
+
+    collection = chromadb.PersistentClient(path=args.db_dir).get_collection(args.collection)
+    documents: List[str] = collection.get(include=["documents"])["documents"]
+    if not documents:
+        raise SystemExit(f"Collection {args.collection} is empty")
+    embedder = SentenceTransformer(args.model)
+    # Stored vectors may already be compressed, so start again from the model's output
+    corpus = batching.encode(embedder, documents)
+
+    exclude = None
+    if args.questions:
+        questions = [q.strip() for q in Path(args.questions).read_text(encoding="utf-8").splitlines() if q.strip()]
+        queries = batching.encode(embedder, questions)
+    else:
+        exclude = np.random.default_rng(1).choice(len(corpus), size=min(args.queries, len(corpus)), replace=False)
+        queries = corpus[exclude]
+    print(f"{len(corpus)} chunks x {corpus.shape[1]} dims, {len(queries)} queries")
+
+    rows: List[Dict[str, Any]] = []
+    seen = set()
+    for method, dim, dtype in itertools.product(args.method, args.dims, args.dtype):
+        codec = EmbeddingCodec(dim=0 if dim >= corpus.shape[1] else dim, method=method, dtype=dtype)
+        if codec.config in seen:
+            continue
+        if method == "pca" and codec.dim and codec.dim > len(corpus):
+            print(f"Skipping PCA to {codec.dim} dims: the corpus has only {len(corpus)} chunks")
+            continue
+        seen.add(codec.config)
+        rows.append(evaluate(corpus, queries, args.k, codec, exclude))
+        print(json.dumps(rows[-1]))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        print(f"Wrote {len(rows)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
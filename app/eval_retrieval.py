@@ -0,0 +1,248 @@
+"""
+Retrieval quality-vs-latency sweep.
+
+Runs ``chroma_retrieve_node`` and ``rerank_node`` for a labeled question set across
+a grid of top_k, candidate_k, embedding model and reranker model, and reports
+recall@k, MRR and nDCG@k next to per-stage latency and model memory. Configurations
+on the Pareto frontier (no other configuration is both better and faster) are marked.
+
+Everything runs locally against the persisted collection: no LLM and no web search.
+Embedding models other than the one the collection was built with are evaluated on
+an in-memory copy of the collection re-embedded with that model.
+
+Labeled set format (JSONL):
+    {"question": "How do I reset MFA?", "expected_sources": ["https://.../faqs#reset-mfa"]}
+
+Example:
+    python -m app.eval_retrieval --labels eval/labels.jsonl --top_k 3 5 --candidate_k 10 20 40 \\
+        --rerank_model cross-encoder/ms-marco-MiniLM-L-6-v2 cross-encoder/ms-marco-MiniLM-L-12-v2 none
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import resource
+import statistics
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def load_labels(path: Path) -> List[Dict[str, Any]]:
+    labels: List[Dict[str, Any]] = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        expected = item.get("expected_sources") or []
+        if isinstance(expected, str):
+            expected = [expected]
+        if item.get("question") and expected:
+            labels.append({"question": item["question"], "expected_sources": expected})
+    if not labels:
+        raise SystemExit(f"No labeled questions found in {path}")
+    return labels
+
+
+def _matches(metadata: Dict[str, Any], expected: str) -> bool:
+    for value in (metadata.get("url"), metadata.get("source"), metadata.get("filename")):
+        if value and (value == expected or value.startswith(expected)):
+            return True
+    return False
+
+
+def score_ranking(results: List[Dict[str, Any]], expected: List[str], k: int) -> Dict[str, float]:
+    """Binary-relevance recall@k, MRR and nDCG@k; each expected source counts once."""
+    found: set = set()
+    gains: List[float] = []
+    first_hit: Optional[int] = None
+    for rank, result in enumerate(results[:k], 1):
+        metadata = result.get("metadata") or {}
+        hit = next((e for e in expected if e not in found and _matches(metadata, e)), None)
+        if hit is not None:
+            found.add(hit)
+            first_hit = first_hit or rank
+        gains.append(1.0 if hit is not None else 0.0)
+    dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gains))
+    idcg = sum(1.0 / math.log2(i + 2) for i in range(min(len(expected), k)))
+    return {
+        "recall": len(found) / len(expected),
+        "mrr": 1.0 / first_hit if first_hit else 0.0,
+        "ndcg": dcg / idcg if idcg else 0.0,
+    }
+
+
+def _module_bytes(model: Any) -> int:
+    module = getattr(model, "model", model)
+    try:
+        return sum(p.numel() * p.element_size() for p in module.parameters())
+    except AttributeError:
+        return 0
+
+
+@contextmanager
+def _override(module: Any, **attrs) -> Iterator[None]:
+    saved = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def reembedded_collection(core: Any, embedder: Any, name: str, batch_size: int = 128):
+    """Copy the persisted collection into memory, re-embedded with ``embedder``."""
+    import chromadb
+
+    source = core.collection.get(include=["documents", "metadatas"])
+    target = chromadb.EphemeralClient().get_or_create_collection(
+        name=name, metadata={"hnsw:space": "cosine"}
+    )
+    ids, documents, metadatas = source["ids"], source["documents"], source["metadatas"]
+    for start in range(0, len(ids), batch_size):
+        batch_docs = documents[start:start + batch_size]
+        target.add(
+            ids=ids[start:start + batch_size],
+            documents=batch_docs,
+            metadatas=metadatas[start:start + batch_size],
+            embeddings=embedder.encode(
+                batch_docs, show_progress_bar=False, normalize_embeddings=True
+            ).tolist(),
+        )
+    return target
+
+
+def evaluate_config(core: Any, labels: List[Dict[str, Any]], top_k: int, candidate_k: int, rerank: bool) -> Dict[str, Any]:
+    metrics: Dict[str, List[float]] = {"recall": [], "mrr": [], "ndcg": []}
+    retrieve_times: List[float] = []
+    rerank_times: List[float] = []
+    for label in labels:
+        state = {"question": label["question"], "top_k": top_k, "candidate_k": candidate_k}
+        start = time.perf_counter()
+        state.update(core.chroma_retrieve_node(state))
+        retrieve_times.append(time.perf_counter() - start)
+        if rerank:
+            start = time.perf_counter()
+            ranked = core.rerank_node(state).get("reranked_results") or []
+            rerank_times.append(time.perf_counter() - start)
+        else:
+            ranked = (state.get("retriever_results") or [])[:top_k]
+            rerank_times.append(0.0)
+        for name, value in score_ranking(ranked, label["expected_sources"], top_k).items():
+            metrics[name].append(value)
+
+    def p95(values: List[float]) -> float:
+        ordered = sorted(values)
+        return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
+    totals = [a + b for a, b in zip(retrieve_times, rerank_times)]
+    return {
+        **{f"{name}@k" if name != "mrr" else name: round(statistics.mean(values), 4) for name, values in metrics.items()},
+        "retrieve_ms": round(statistics.mean(retrieve_times) * 1000, 2),
+        "rerank_ms": round(statistics.mean(rerank_times) * 1000, 2),
+        "total_ms": round(statistics.mean(totals) * 1000, 2),
+        "total_p95_ms": round(p95(totals) * 1000, 2),
+    }
+
+
+def pareto_frontier(rows: List[Dict[str, Any]], quality: str, cost: str = "total_ms") -> None:
+    """Mark rows that no other row beats on quality without also being at least as fast."""
+    for row in rows:
+        row["pareto"] = not any(
+            other is not row
+            and other[quality] >= row[quality]
+            and other[cost] <= row[cost]
+            and (other[quality] > row[quality] or other[cost] < row[cost])
+            for other in rows
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retrieval configurations for quality vs latency.")
+    parser.add_argument("--labels", type=str, required=True, help="JSONL with question and expected_sources")
+    parser.add_argument("--db_dir", type=str, default=os.getenv("DB_DIR", "./chroma_db"), help="Persisted Chroma directory")
+    parser.add_argument("--collection", type=str, default=os.getenv("COLLECTION", "faq"), help="Collection name")
+    parser.add_argument("--top_k", type=int, nargs="+", default=[5], help="top_k values to try")
+    parser.add_argument("--candidate_k", type=int, nargs="+", default=[20], help="Candidate pool sizes to try")
+    parser.add_argument("--embed_model", type=str, nargs="+", default=None, help="Embedding models (default: EMBED_MODEL)")
+    parser.add_argument(
+        "--rerank_model", type=str, nargs="+", default=None,
+        help="Cross-encoders to try; 'none' ranks by vector distance only (default: RERANK_MODEL)",
+    )
+    parser.add_argument("--objective", choices=["ndcg@k", "recall@k", "mrr"], default="ndcg@k", help="Quality metric for the frontier")
+    parser.add_argument("--output", type=str, default=None, help="Write all rows as JSON to this path")
+    args = parser.parse_args()
+
+    # core reads its configuration at import time
+    os.environ["DB_DIR"] = args.db_dir
+    os.environ["COLLECTION"] = args.collection
+    os.environ["SHARDS"] = args.collection
+    os.environ["ENABLE_WEB_SEARCH"] = "false"
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+    from app.common import core
+
+    labels = load_labels(Path(args.labels))
+    embed_models = args.embed_model or [core.EMBED_MODEL]
+    rerank_models = args.rerank_model or [core.RERANK_MODEL]
+    print(f"{len(labels)} labeled questions, collection {args.collection} ({core.collection.count()} chunks)")
+
+    rows: List[Dict[str, Any]] = []
+    for embed_model in embed_models:
+        embedder = core.embedder if embed_model == core.EMBED_MODEL else SentenceTransformer(embed_model)
+        collection = (
+            core.collection
+            if embed_model == core.EMBED_MODEL
+            else reembedded_collection(core, embedder, f"eval_{len(rows)}")
+        )
+        for rerank_model in rerank_models:
+            rerank = rerank_model.lower() != "none"
+            reranker = None
+            if rerank:
+                reranker = core.reranker if rerank_model == core.RERANK_MODEL else CrossEncoder(rerank_model)
+            # Re-embedded copies hold raw model vectors, so queries skip the stored codec
+            codec = core.codec if embed_model == core.EMBED_MODEL else None
+            with _override(
+                core,
+                embedder=embedder,
+                collection=collection,
+                shard_collections={args.collection: collection},
+                reranker=reranker or core.reranker,
+                codec=codec,
+            ):
+                # One untimed pass so lazy initialisation doesn't land in the first row
+                evaluate_config(core, labels[:1], 1, 1, rerank)
+                for top_k, candidate_k in itertools.product(args.top_k, args.candidate_k):
+                    row = {
+                        "embed_model": embed_model,
+                        "rerank_model": rerank_model,
+                        "top_k": top_k,
+                        "candidate_k": max(candidate_k, top_k),
+                        **evaluate_config(core, labels, top_k, candidate_k, rerank),
+                        "model_mb": round((_module_bytes(embedder) + (_module_bytes(reranker) if reranker else 0)) / 2**20, 1),
+                        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                    }
+                    rows.append(row)
+                    print(
+                        f"  {embed_model} | {rerank_model} | k={top_k} cand={row['candidate_k']}: "
+                        f"{args.objective}={row[args.objective]} total={row['total_ms']}ms"
+                    )
+
+    pareto_frontier(rows, args.objective)
+    rows.sort(key=lambda row: row["total_ms"])
+    columns = ["pareto", "embed_model", "rerank_model", "top_k", "candidate_k", "recall@k", "mrr", "ndcg@k",
+               "retrieve_ms", "rerank_ms", "total_ms", "total_p95_ms", "model_mb", "max_rss_mb"]
+    print("\n" + "\t".join(columns))
+    for row in rows:
+        print("\t".join("*" if c == "pareto" and row[c] else ("" if c == "pareto" else str(row[c])) for c in columns))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        print(f"Wrote {len(rows)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Maintenance for the persisted Chroma HNSW index.
+
+Subcommands:
+    stats    index parameters, on-disk size and fragmentation (tombstoned or
+             preallocated slots that no live chunk uses)
+    rebuild  copy the collection into a fresh index with the given HNSW parameters
+             and swap it in; this also compacts away deleted and replaced entries.
+             The swap briefly leaves no collection under the name, so stop the
+             workers first, or rebuild a build directory and --publish_snapshot it
+    recall   recall@k of the HNSW index against exact (brute-force) search, for one
+             or more search_ef values
+    warm     read the index files so the OS page cache holds them
+
+Workers call :func:`warm_index_files` before accepting jobs so the first queries
+after a start don't pay for paging the index in.
+
+Examples:
+    python -m app.index_maintenance stats
+    python -m app.index_maintenance rebuild --m 32 --construction_ef 200 --search_ef 64
+    python -m app.index_maintenance --db_dir ./build_db rebuild --m 32 --publish_snapshot
+    python -m app.index_maintenance recall --k 5 --search_ef 10 32 64 128 --queries 200
+"""
+import argparse
+import json
+import os
+import sqlite3
+import struct
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DB_DIR = os.getenv("DB_DIR", "./chroma_db")
+COLLECTION = os.getenv("COLLECTION", "faq")
+PAGE_SIZE = 1000
+CHROMA_DEFAULT_SEARCH_EF = 10
+READ_CHUNK = 1 << 20
+
+# hnswlib header as persisted by Chroma: int32 format version, then the hnswlib fields
+_HEADER = struct.Struct("<iQQQQQQiIQQQdQ")
+_HEADER_FIELDS = (
+    "version", "offset_level0", "max_elements", "cur_element_count", "size_data_per_element",
+    "label_offset", "offset_data", "max_level", "enterpoint_node", "max_m", "max_m0", "m", "mult",
+    "ef_construction",
+)
+
+
+def segment_dirs(db_dir: str, collection_name: Optional[str] = None) -> List[Path]:
+    """HNSW segment directories for ``collection_name`` (or every collection)."""
+    root = Path(db_dir)
+    sqlite_path = root / "chroma.sqlite3"
+    if sqlite_path.exists():
+        try:
+            with sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True) as conn:
+                query = "SELECT s.id FROM segments s JOIN collections c ON s.collection = c.id WHERE s.scope = 'VECTOR'"
+                params: tuple = ()
+                if collection_name:
+                    query += " AND c.name = ?"
+                    params = (collection_name,)
+                dirs = [root / row[0] for row in conn.execute(query, params)]
+            return [d for d in dirs if d.is_dir()]
+        except sqlite3.Error:
+            pass
+    # Unknown schema: every directory that looks like an HNSW segment
+    return [d for d in root.iterdir() if (d / "header.bin").exists()] if root.exists() else []
+
+
+def read_header(segment_dir: Path) -> Optional[Dict[str, Any]]:
+    path = segment_dir / "header.bin"
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    return dict(zip(_HEADER_FIELDS, _HEADER.unpack_from(data)))
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def serving_collections() -> List[str]:
+    """Collections the workers query: every shard and its direct-answer index (see ``_open_index`` in core)."""
+    shards = [name.strip() for name in os.getenv("SHARDS", COLLECTION).split(",") if name.strip()]
+    if len(shards) == 1:
+        return shards + [os.getenv("FAQ_COLLECTION", f"{COLLECTION}_qa")]
+    return shards + [f"{shard}_qa" for shard in shards]
+
+
+def warm_index_files(db_dir: str = DB_DIR, collection_names: Optional[List[str]] = None) -> int:
+    """Read the HNSW segment files (and the SQLite store) into the page cache; returns bytes read.
+
+    Without ``collection_names`` every collection's segments are read.
+    """
+    files: List[Path] = []
+    for name in collection_names or [None]:
+        for segment in segment_dirs(db_dir, name):
+            files.extend(p for p in segment.iterdir() if p.is_file())
+    sqlite_path = Path(db_dir) / "chroma.sqlite3"
+    if sqlite_path.exists():
+        files.append(sqlite_path)
+
+    total = 0
+    for path in files:
+        try:
+            with open(path, "rb") as fh:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                while chunk := fh.read(READ_CHUNK):
+                    total += len(chunk)
+        except OSError:
+            continue
+    return total
+
+
+def index_stats(client: Any, db_dir: str, collection_name: str) -> Dict[str, Any]:
+    collection = client.get_collection(collection_name)
+    live = collection.count()
+    stats: Dict[str, Any] = {
+        "collection": collection_name,
+        "live_vectors": live,
+        "metadata": collection.metadata or {},
+        "segments": [],
+    }
+    for segment in segment_dirs(db_dir, collection_name):
+        header = read_header(segment) or {}
+        stored = header.get("cur_element_count")
+        capacity = header.get("max_elements")
+        stats["segments"].append(
+            {
+                "path": str(segment),
+                "bytes": _dir_bytes(segment),
+                "m": header.get("m"),
+                "ef_construction": header.get("ef_construction"),
+                "stored_elements": stored,
+                "capacity": capacity,
+                # Deleted/replaced vectors stay in the graph as tombstones until a rebuild
+                "tombstone_ratio": round(1 - live / stored, 4) if stored else None,
+                "unused_capacity_ratio": round(1 - live / capacity, 4) if capacity else None,
+            }
+        )
+    sqlite_path = Path(db_dir) / "chroma.sqlite3"
+    if sqlite_path.exists():
+        stats["sqlite_bytes"] = sqlite_path.stat().st_size
+    return stats
+
+
+def _iter_pages(collection: Any, include: List[str]):
+    offset = 0
+    while True:
+        page = collection.get(include=include, limit=PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
+def load_embeddings(collection: Any) -> Tuple[List[str], np.ndarray]:
+    ids: List[str] = []
+    vectors: List[np.ndarray] = []
+    for page in _iter_pages(collection, ["embeddings"]):
+        ids.extend(page["ids"])
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ids, matrix
+
+
+def rebuild(client: Any, collection_name: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy ``collection_name`` into a new index built with ``metadata`` and swap it in.
+
+    Between deleting the old collection and renaming the new one there is no
+    collection under the name; workers holding a handle to it fail until restarted.
+    """
+    source = client.get_collection(collection_name)
+    new_metadata = {"hnsw:space": "cosine", **(source.metadata or {}), **metadata}
+    temp_name = f"{collection_name}__rebuild"
+    try:
+        client.delete_collection(temp_name)
+    except Exception:
+        pass
+    target = client.create_collection(name=temp_name, metadata=new_metadata)
+
+    start = time.perf_counter()
+    copied = 0
+    for page in _iter_pages(source, ["embeddings", "documents", "metadatas"]):
+        target.add(
+            ids=page["ids"],
+            embeddings=page["embeddings"],
+            documents=page["documents"],
+            metadatas=page["metadatas"],
+        )
+        copied += len(page["ids"])
+    if copied != source.count():
+        client.delete_collection(temp_name)
+        raise SystemExit(f"Rebuild aborted: copied {copied} of {source.count()} vectors")
+
+    client.delete_collection(collection_name)
+    target.modify(name=collection_name)
+    return {"copied": copied, "seconds": round(time.perf_counter() - start, 2), "metadata": new_metadata}
+
+
+def measure_recall(
+    open_collection: Callable[[], Any],
+    k: int,
+    search_efs: List[int],
+    num_queries: int,
+    queries: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    """recall@k of ``collection.query`` against exact cosine search over the stored vectors.
+
+    ``open_collection`` must return a freshly loaded collection: a loaded HNSW
+    segment keeps the search_ef it was opened with.
+    """
+    collection = open_collection()
+    original = dict(collection.metadata or {})
+    ids, matrix = load_embeddings(collection)
+    if not ids:
+        raise SystemExit("Collection is empty")
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+
+    rng = np.random.default_rng(0)
+    exclude_self = queries is None
+    if queries is None:
+        # Stored vectors as queries; the vector itself is dropped from both result lists
+        picks = rng.choice(len(ids), size=min(num_queries, len(ids)), replace=False)
+        queries = matrix[picks]
+        self_ids = [ids[i] for i in picks]
+    else:
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        self_ids = [None] * len(queries)
+
+    fetch = min(k + int(exclude_self), len(ids))
+    exact_order = np.argsort(-(queries @ matrix.T), axis=1)[:, :fetch]
+    exact = [[ids[j] for j in row if ids[j] != self_id][:k] for row, self_id in zip(exact_order, self_ids)]
+
+    # The distance function can't be re-specified once the collection exists
+    settable = {key: value for key, value in original.items() if key != "hnsw:space"}
+    rows: List[Dict[str, Any]] = []
+    for search_ef in search_efs or [0]:
+        if search_ef:
+            collection.modify(metadata={**settable, "hnsw:search_ef": search_ef})
+            collection = open_collection()
+        hits = 0
+        expected = 0
+        start = time.perf_counter()
+        res = collection.query(query_embeddings=queries.tolist(), n_results=fetch, include=[])
+        elapsed = time.perf_counter() - start
+        for found, truth, self_id in zip(res["ids"], exact, self_ids):
+            found = [i for i in found if i != self_id][:k]
+            hits += len(set(found) & set(truth))
+            expected += len(truth)
+        rows.append(
+            {
+                # As the reopened index reports it, so a setting that didn't apply shows up
+                "search_ef": (collection.metadata or {}).get("hnsw:search_ef", "default"),
+                f"recall@{k}": round(hits / expected, 4) if expected else 0.0,
+                "query_ms": round(elapsed * 1000 / len(queries), 3),
+            }
+        )
+    if any(search_efs):
+        # The sweep must not leave the served index on the last value tried
+        collection.modify(metadata={**settable, "hnsw:search_ef": original.get("hnsw:search_ef", CHROMA_DEFAULT_SEARCH_EF)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, rebuild and warm the Chroma HNSW index.")
+    parser.add_argument("--db_dir", type=str, default=DB_DIR, help="Directory for Chroma persistence")
+    parser.add_argument("--collection", type=str, default=COLLECTION, help="Collection name")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="Index parameters, size and fragmentation")
+
+    rebuild_parser = commands.add_parser("rebuild", help="Rebuild (and compact) with new HNSW parameters")
+    rebuild_parser.add_argument("--m", type=int, default=0, help="hnsw:M (graph degree)")
+    rebuild_parser.add_argument("--construction_ef", type=int, default=0, help="hnsw:construction_ef")
+    rebuild_parser.add_argument("--search_ef", type=int, default=0, help="hnsw:search_ef")
+    rebuild_parser.add_argument(
+        "--publish_snapshot",
+        action="store_true",
+        help="Publish the rebuilt db_dir as a new index version under SNAPSHOT_DIR (workers switch without a restart)",
+    )
+
+    recall_parser = commands.add_parser("recall", help="recall@k against exact search")
+    recall_parser.add_argument("--k", type=int, default=5, help="Neighbours per query")
+    recall_parser.add_argument("--search_ef", type=int, nargs="*", default=[], help="search_ef values to try")
+    recall_parser.add_argument("--queries", type=int, default=200, help="Stored vectors sampled as queries")
+    recall_parser.add_argument("--questions", type=str, default=None, help="Text file of real questions (one per line)")
+    recall_parser.add_argument("--model", type=str, default=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+                               help="Embedding model for --questions")
+
+    commands.add_parser("warm", help="Read the index files into the page cache")
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        start = time.perf_counter()
+        read = warm_index_files(args.db_dir, [args.collection])
+        print(f"Warmed {read / 2**20:.1f} MiB in {time.perf_counter() - start:.2f}s")
+        return
+
+    import chromadb
+
+    client = chromadb.PersistentClient(path=args.db_dir)
+
+    def open_collection() -> Any:
+        nonlocal client
+        # A new client for the same path would reuse the loaded segments otherwise
+        client.clear_system_cache()
+        client = chromadb.PersistentClient(path=args.db_dir)
+        return client.get_collection(args.collection)
+
+    if args.command == "stats":
+        print(json.dumps(index_stats(client, args.db_dir, args.collection), indent=2))
+    elif args.command == "rebuild":
+        before = index_stats(client, args.db_dir, args.collection)
+        overrides = {
+            key: value
+            for key, value in (
+                ("hnsw:M", args.m), ("hnsw:construction_ef", args.construction_ef), ("hnsw:search_ef", args.search_ef)
+            )
+            if value
+        }
+        result = rebuild(client, args.collection, overrides)
+        after = index_stats(client, args.db_dir, args.collection)
+        size_before = sum(s["bytes"] for s in before["segments"])
+        size_after = sum(s["bytes"] for s in after["segments"])
+        print(f"Rebuilt {result['copied']} vectors in {result['seconds']}s with {result['metadata']}")
+        print(f"Index size: {size_before} -> {size_after} bytes")
+        if args.publish_snapshot:
+            from app.common import snapshots
+
+            if not snapshots.SNAPSHOT_DIR:
+                raise SystemExit("--publish_snapshot needs SNAPSHOT_DIR")
+            # Older Chroma releases return Collection objects, newer ones names
+            names = [getattr(item, "name", item) for item in client.list_collections()]
+            counts = {name: client.get_collection(name).count() for name in names}
+            manifest = snapshots.publish_snapshot(args.db_dir, collections=counts)
+            print(f"Published index snapshot {manifest['version']}; workers switch to it between jobs.")
+        else:
+            print("Restart workers so they open the rebuilt collection.")
+    elif args.command == "recall":
+        queries = None
+        if args.questions:
+            from sentence_transformers import SentenceTransformer
+            from app.common import batching
+            from app.common.embedding_codec import codec_path, load_codec
+
+            questions = [q.strip() for q in Path(args.questions).read_text(encoding="utf-8").splitlines() if q.strip()]
+            queries = batching.encode(SentenceTransformer(args.model), questions)
+            # Query in the stored space, as the workers do (the index may hold reduced vectors)
+            codec = load_codec(codec_path(args.db_dir))
+            if codec is not None:
+                queries = codec.transform(queries)
+        for row in measure_recall(open_collection, args.k, args.search_ef, args.queries, queries):
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import argparse
 import hashlib
+import json
 import os
 import re
 import time
-from itertools import chain
+from itertools import chain, islice
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import chromadb
 from sentence_transformers import SentenceTransformer
@@ -13,9 +14,30 @@ from bs4 import BeautifulSoup, NavigableString, Tag
 import httpx
 from pypdf import PdfReader
 
+from app import crawler, dedupe
+from app.common import batching, snapshots
+from app.common.embedding_codec import DTYPES, METHODS, EmbeddingCodec, codec_path, load_codec
+
 # -------- Config --------
 CHUNK_CHARS = 1000     # ~characters per chunk
 CHUNK_OVERLAP = 150    # overlap between chunks
+# HNSW parameters applied when a collection is created (0 = Chroma default)
+HNSW_M = int(os.getenv("HNSW_M", "0"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "0"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "0"))
+# Stored embedding size: 0 = model dimension; see app/common/embedding_codec.py
+EMBED_DIM = int(os.getenv("EMBED_DIM", "0"))
+EMBED_REDUCTION = os.getenv("EMBED_REDUCTION", "truncate")
+EMBED_DTYPE = os.getenv("EMBED_DTYPE", "float32")
+CODEC_FIT_SAMPLES = 5000
+
+
+def hnsw_metadata(m: int = HNSW_M, construction_ef: int = HNSW_CONSTRUCTION_EF, search_ef: int = HNSW_SEARCH_EF) -> Dict:
+    metadata = {"hnsw:space": "cosine"}
+    for key, value in (("hnsw:M", m), ("hnsw:construction_ef", construction_ef), ("hnsw:search_ef", search_ef)):
+        if value:
+            metadata[key] = value
+    return metadata
 
 
 def read_text_file(path: Path) -> str:
@@ -135,14 +157,12 @@ def _collect_answer_text(question_tag: Tag) -> str:
     return "\n\n".join(parts).strip()
 
 
-def iter_fortinet_faq(url: str) -> Iterator[Tuple[str, Dict]]:
-    """Yield chunks derived from the Fortinet FAQ page."""
-    try:
-        html = fetch_html(url)
-    except Exception as exc:  # pragma: no cover - network may fail in some environments
-        print(f"Failed to fetch Fortinet FAQ page ({url}): {exc}")
-        return
+def iter_faq_html(html: str, url: str, qa_pairs: Optional[List[Dict]] = None) -> Iterator[Tuple[str, Dict]]:
+    """Yield FAQ chunks from question headings (ending in "?") in an HTML page.
 
+    When ``qa_pairs`` is given, each whole question/answer pair is also appended to
+    it for the direct-answer index.
+    """
     soup = BeautifulSoup(html, "html.parser")
     headings = soup.find_all(["h1", "h2", "h3", "h4", "h5", "h6"])
     last_modified = time.time()
@@ -157,6 +177,16 @@ def iter_fortinet_faq(url: str) -> Iterator[Tuple[str, Dict]]:
 
         anchor = heading.get("id")
         source_url = f"{url}#{anchor}" if anchor else url
+        if qa_pairs is not None:
+            qa_pairs.append(
+                {
+                    "question": question,
+                    "answer": answer,
+                    "url": source_url,
+                    "title": "FortiIdentity Cloud FAQs",
+                    "source_type": "fortinet_faq",
+                }
+            )
         full_text = f"{question}\n\n{answer}"
         chunks = chunk_text(full_text)
         total_chunks = len(chunks)
@@ -179,10 +209,146 @@ def iter_fortinet_faq(url: str) -> Iterator[Tuple[str, Dict]]:
             yield chunk, meta
 
 
+def iter_fortinet_faq(url: str, qa_pairs: Optional[List[Dict]] = None) -> Iterator[Tuple[str, Dict]]:
+    """Yield chunks derived from the Fortinet FAQ page."""
+    try:
+        html = fetch_html(url)
+    except Exception as exc:  # pragma: no cover - network may fail in some environments
+        print(f"Failed to fetch Fortinet FAQ page ({url}): {exc}")
+        return
+
+    yield from iter_faq_html(html, url, qa_pairs)
+
+
+def iter_doc_page_html(html: str, url: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield body-text chunks for a documentation page without FAQ headings."""
+    soup = BeautifulSoup(html, "html.parser")
+    heading = soup.find("h1")
+    title = (
+        heading.get_text(strip=True) if heading else ""
+    ) or (soup.title.get_text(strip=True) if soup.title else "") or url
+    for tag in soup(["script", "style", "noscript", "nav", "header", "footer"]):
+        tag.decompose()
+    text = re.sub(r"\n{3,}", "\n\n", soup.get_text("\n")).strip()
+    chunks = chunk_text(text)
+    last_modified = time.time()
+    for idx, chunk in enumerate(chunks):
+        meta = {
+            "source": url,
+            "chunk": idx,
+            "total_chunks": len(chunks),
+            "filename": "fortinet_docs",
+            "last_modified": last_modified,
+            "section_label": f"{title} (Part {idx + 1} of {len(chunks)})" if len(chunks) > 1 else title,
+            "url": url,
+            "title": title,
+            "source_type": "fortinet_docs",
+        }
+        yield chunk, meta
+
+
+def iter_crawled_docs(
+    seed_urls: List[str],
+    allowed_prefixes: Optional[List[str]] = None,
+    cache: Optional[crawler.CrawlCache] = None,
+    revalidate: bool = True,
+    max_pages: int = crawler.DEFAULT_MAX_PAGES,
+    per_host_concurrency: int = crawler.DEFAULT_PER_HOST_CONCURRENCY,
+    qa_pairs: Optional[List[Dict]] = None,
+    stale_ids: Optional[List[str]] = None,
+    stale_qa_ids: Optional[List[str]] = None,
+) -> Iterator[Tuple[str, Dict]]:
+    """Crawl documentation pages and yield chunks for pages that changed since the last run.
+
+    Pages with FAQ-style question headings are chunked per question; other pages are
+    chunked as body text. ``cache`` is updated in memory only; the caller saves it
+    once the chunks are stored, so an interrupted ingest re-embeds those pages next time.
+
+    The cache also remembers each page's chunk IDs. When ``stale_ids`` is given, IDs
+    a changed page no longer produces (it shrank) and all IDs of pages that now
+    answer 404/410 are appended to it for the caller to delete. ``stale_qa_ids`` does
+    the same for the page's direct-answer pairs (removed or reworded questions).
+    """
+    pages = crawler.crawl_sync(
+        seed_urls,
+        allowed_prefixes=allowed_prefixes,
+        cache=cache,
+        revalidate=revalidate,
+        max_pages=max_pages,
+        per_host_concurrency=per_host_concurrency,
+    )
+    changed = [page for page in pages if page.html]
+    gone = [page for page in pages if page.gone]
+    print(
+        f"Crawled {len(pages)} pages ({len(pages) - len(changed) - len(gone)} unchanged, "
+        f"{len(changed)} to embed, {len(gone)} gone)"
+    )
+    if cache is not None:
+        reached = {page.url for page in pages}
+        unreached = sorted(url for url in cache.entries if url not in reached)
+        if unreached:
+            # Not fetched (unlinked, outside the prefixes or past --crawl_max_pages), so not provably gone
+            print(f"Warning: {len(unreached)} previously crawled pages were not reached; their chunks stay indexed")
+        for page in gone:
+            entry = cache.entries.pop(page.url, None)
+            if entry and stale_ids is not None:
+                stale_ids.extend(entry.get("chunk_ids", []))
+            if entry and stale_qa_ids is not None:
+                stale_qa_ids.extend(entry.get("qa_ids", []))
+
+    for page in changed:
+        first_pair = len(qa_pairs) if qa_pairs is not None else 0
+        chunks = list(iter_faq_html(page.html, page.url, qa_pairs)) or list(iter_doc_page_html(page.html, page.url))
+        if cache is not None:
+            entry = cache.get(page.url) or {}
+            ids = [chunk_id(meta) for _, meta in chunks]
+            if stale_ids is not None:
+                stale_ids.extend(sorted(set(entry.get("chunk_ids", [])) - set(ids)))
+            fields = {"chunk_ids": ids}
+            if qa_pairs is not None:
+                fields["qa_ids"] = [qa_id(pair) for pair in qa_pairs[first_pair:]]
+                if stale_qa_ids is not None:
+                    stale_qa_ids.extend(sorted(set(entry.get("qa_ids", [])) - set(fields["qa_ids"])))
+            cache.update(page.url, **fields)
+        yield from chunks
+
+
+def load_qa_file(path: Path) -> List[Dict]:
+    """Read curated Q&A pairs from JSONL (``question``, ``answer`` and optional ``url``/``title``)."""
+    pairs: List[Dict] = []
+    for line_no, line in enumerate(path.read_text(encoding="utf-8").splitlines(), 1):
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        question, answer = (item.get("question") or "").strip(), (item.get("answer") or "").strip()
+        if not question or not answer:
+            print(f"Skipping {path}:{line_no}: question and answer are required")
+            continue
+        pairs.append(
+            {
+                "question": question,
+                "answer": answer,
+                "url": item.get("url") or f"{path.resolve()}#{line_no}",
+                "title": item.get("title") or path.stem,
+                "source_type": "curated_qa",
+            }
+        )
+    return pairs
+
+
 def sha1(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
 
 
+def chunk_id(meta: Dict) -> str:
+    # Deterministic ID by source + chunk index ensures updates overwrite
+    return sha1(meta["source"] + "::" + str(meta["chunk"]))
+
+
+def qa_id(pair: Dict) -> str:
+    return sha1(pair["question"].lower() + "::" + pair["url"])
+
+
 def upsert_chunks(
     client: chromadb.ClientAPI,
     collection_name: str,
@@ -190,14 +356,22 @@ def upsert_chunks(
     model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
     batch_size: int = 128,
     reset: bool = False,
+    codec: Optional[EmbeddingCodec] = None,
 ):
     if reset:
         try:
             client.delete_collection(name=collection_name)
         except Exception:
             pass
-    collection = client.get_or_create_collection(name=collection_name, metadata={"hnsw:space": "cosine"})
+    collection = client.get_or_create_collection(name=collection_name, metadata=hnsw_metadata())
     embedder = SentenceTransformer(model_name)
+    if codec is not None and codec.needs_fit:
+        # Fit the PCA basis on the head of the corpus, then embed it as usual
+        docs = iter(docs)
+        head = list(islice(docs, CODEC_FIT_SAMPLES))
+        if head:
+            fit_codec(codec, batching.encode(embedder, [text for text, _ in head], name="ingest_embed"))
+        docs = chain(head, docs)
 
     batch_texts, batch_metas, batch_ids = [], [], []
 
@@ -205,21 +379,21 @@ def upsert_chunks(
         nonlocal batch_texts, batch_metas, batch_ids
         if not batch_texts:
             return
-        embeddings = embedder.encode(batch_texts, show_progress_bar=False, normalize_embeddings=True).tolist()
+        embeddings = batching.encode(embedder, batch_texts, name="ingest_embed")
+        if codec is not None:
+            embeddings = codec.transform(embeddings)
         collection.upsert(
             ids=batch_ids,
-            embeddings=embeddings,
+            embeddings=embeddings.tolist(),
             documents=batch_texts,
             metadatas=batch_metas,
         )
         batch_texts, batch_metas, batch_ids = [], [], []
 
     for text, meta in docs:
-        # Deterministic ID by source + chunk index ensures updates overwrite
-        content_id = sha1(meta["source"] + "::" + str(meta["chunk"]))
         batch_texts.append(text)
         batch_metas.append(meta)
-        batch_ids.append(content_id)
+        batch_ids.append(chunk_id(meta))
         if len(batch_texts) >= batch_size:
             flush()
 
@@ -227,6 +401,97 @@ def upsert_chunks(
     return collection
 
 
+def upsert_qa_pairs(
+    client: chromadb.ClientAPI,
+    collection_name: str,
+    pairs: List[Dict],
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    reset: bool = False,
+    codec: Optional[EmbeddingCodec] = None,
+):
+    """Index questions (embedded) -> stored answers for the FAQ direct-answer path."""
+    if reset:
+        try:
+            client.delete_collection(name=collection_name)
+        except Exception:
+            pass
+    collection = client.get_or_create_collection(name=collection_name, metadata={"hnsw:space": "cosine"})
+    if not pairs:
+        return collection
+
+    # Later duplicates (e.g. a curated override of a scraped FAQ) win
+    by_id = {qa_id(pair): pair for pair in pairs}
+    ids = list(by_id)
+    questions = [by_id[i]["question"] for i in ids]
+    embedder = SentenceTransformer(model_name)
+    embeddings = batching.encode(embedder, questions, name="ingest_embed")
+    if codec is not None:
+        if codec.needs_fit:
+            fit_codec(codec, embeddings)
+        embeddings = codec.transform(embeddings)
+    collection.upsert(
+        ids=ids,
+        embeddings=embeddings.tolist(),
+        documents=[by_id[i]["answer"] for i in ids],
+        metadatas=[
+            {
+                "question": by_id[i]["question"],
+                "source": by_id[i]["url"],
+                "url": by_id[i]["url"],
+                "title": by_id[i]["title"],
+                "section_label": by_id[i]["question"],
+                "source_type": by_id[i]["source_type"],
+            }
+            for i in ids
+        ],
+    )
+    return collection
+
+
+def fit_codec(codec: EmbeddingCodec, embeddings) -> None:
+    try:
+        codec.fit(embeddings)
+    except ValueError as exc:
+        raise SystemExit(f"Cannot fit {codec.describe()}: {exc}. Use a smaller --embed_dim or --embed_reduction truncate")
+
+
+def prepare_codec(client: chromadb.ClientAPI, args: argparse.Namespace) -> Optional[EmbeddingCodec]:
+    """The codec this run stores vectors with; it must match what the collection already holds."""
+    path = codec_path(args.db_dir)
+    wanted = EmbeddingCodec(dim=args.embed_dim, method=args.embed_reduction, dtype=args.embed_dtype)
+    if wanted.dtype != "float32":
+        # Chroma stores float32 regardless, so rounding would cost recall without saving memory
+        raise SystemExit(
+            f"--embed_dtype {wanted.dtype} is not supported for ingest: Chroma keeps float32 vectors, "
+            "so only --embed_dim reduces the index. Compare modes with app.eval_compression instead"
+        )
+    # Shards share one embedding space, so other populated collections pin the codec too
+    replaced = {args.collection, args.qa_collection or f"{args.collection}_qa"} if args.reset else set()
+    populated = False
+    for item in client.list_collections():
+        name = getattr(item, "name", item)
+        if name in replaced:
+            continue
+        try:
+            populated = populated or client.get_collection(name).count() > 0
+        except Exception:
+            continue
+    if populated:
+        existing = load_codec(path)
+        current = existing or EmbeddingCodec()
+        if current.config != wanted.config:
+            raise SystemExit(
+                f"Collections in {args.db_dir} store {current.describe()}; re-ingest every shard "
+                f"with --reset to store {wanted.describe()}"
+            )
+        return existing
+
+    # Fresh collection: the codec (re)fitted during this run replaces any old one
+    if path.exists():
+        path.unlink()
+    return None if wanted.is_identity else wanted
+
+
 def main():
     parser = argparse.ArgumentParser(description="Ingest docs into a Chroma collection.")
     parser.add_argument("--data_dir", type=str, default="./data", help="Directory containing your documents")
@@ -245,27 +510,160 @@ def main():
         action="store_true",
         help="Skip fetching the Fortinet FAQ page during ingestion.",
     )
+    parser.add_argument(
+        "--crawl_url",
+        action="append",
+        default=[],
+        help="Seed URL to crawl; links are followed within --crawl_prefix. Repeatable.",
+    )
+    parser.add_argument(
+        "--crawl_prefix",
+        action="append",
+        default=[],
+        help="URL prefix the crawler may follow links into (defaults to each seed's directory). Repeatable.",
+    )
+    parser.add_argument("--crawl_max_pages", type=int, default=crawler.DEFAULT_MAX_PAGES, help="Maximum pages to crawl")
+    parser.add_argument(
+        "--crawl_concurrency",
+        type=int,
+        default=crawler.DEFAULT_PER_HOST_CONCURRENCY,
+        help="Maximum concurrent requests per host",
+    )
+    parser.add_argument(
+        "--crawl_cache",
+        type=str,
+        default=None,
+        help="ETag/Last-Modified cache file (default: <db_dir>/crawl_cache.json)",
+    )
+    parser.add_argument(
+        "--dedupe_threshold",
+        type=float,
+        default=dedupe.DEFAULT_THRESHOLD,
+        help="MinHash similarity above which chunks are merged as near duplicates (1.0 = exact only)",
+    )
+    parser.add_argument(
+        "--qa_file",
+        action="append",
+        default=[],
+        help="JSONL of curated question/answer pairs for the direct-answer index. Repeatable.",
+    )
+    parser.add_argument(
+        "--qa_collection",
+        type=str,
+        default=None,
+        help="Collection for the FAQ direct-answer index (default: <collection>_qa)",
+    )
+    parser.add_argument("--no_dedupe", action="store_true", help="Embed every chunk, including duplicates")
+    parser.add_argument("--embed_dim", type=int, default=EMBED_DIM, help="Stored embedding dimension (0 = model dimension)")
+    parser.add_argument("--embed_reduction", choices=METHODS, default=EMBED_REDUCTION, help="How to reduce dimensions")
+    parser.add_argument("--embed_dtype", choices=DTYPES, default=EMBED_DTYPE, help="Stored embedding precision")
+    parser.add_argument(
+        "--publish_snapshot",
+        action="store_true",
+        help="After ingesting, publish db_dir as a new immutable index version under --snapshot_dir",
+    )
+    parser.add_argument(
+        "--snapshot_dir", type=str, default=snapshots.SNAPSHOT_DIR, help="Shared snapshot location (default: SNAPSHOT_DIR)"
+    )
+    parser.add_argument(
+        "--snapshot_keep", type=int, default=snapshots.SNAPSHOT_KEEP, help="Published versions to keep"
+    )
     args = parser.parse_args()
+    if args.publish_snapshot and not args.snapshot_dir:
+        raise SystemExit("--publish_snapshot needs --snapshot_dir or SNAPSHOT_DIR")
 
     data_dir = Path(args.data_dir)
     if not data_dir.exists():
         print(f"Warning: Data directory not found: {data_dir}")
 
     client = chromadb.PersistentClient(path=args.db_dir)
+    codec = prepare_codec(client, args)
     doc_iters: List[Iterable[Tuple[str, Dict]]] = []
+    qa_pairs: List[Dict] = []
+    stale_ids: List[str] = []
+    stale_qa_ids: List[str] = []
+    crawl_cache: Optional[crawler.CrawlCache] = None
     if data_dir.exists():
         doc_iters.append(iter_docs(data_dir))
     if not args.skip_fortinet_faq and args.fortinet_faq_url:
-        doc_iters.append(iter_fortinet_faq(args.fortinet_faq_url))
+        doc_iters.append(iter_fortinet_faq(args.fortinet_faq_url, qa_pairs))
+    if args.crawl_url:
+        cache_path = Path(args.crawl_cache) if args.crawl_cache else Path(args.db_dir) / "crawl_cache.json"
+        crawl_cache = crawler.CrawlCache(cache_path)
+        doc_iters.append(
+            iter_crawled_docs(
+                args.crawl_url,
+                allowed_prefixes=args.crawl_prefix or None,
+                cache=crawl_cache,
+                # After a reset nothing is embedded any more, so every page must be re-fetched
+                revalidate=not args.reset,
+                max_pages=args.crawl_max_pages,
+                per_host_concurrency=args.crawl_concurrency,
+                qa_pairs=qa_pairs,
+                stale_ids=stale_ids,
+                stale_qa_ids=stale_qa_ids,
+            )
+        )
 
     if not doc_iters:
         raise SystemExit("No documents available for ingestion.")
 
     docs = chain.from_iterable(doc_iters)
+    duplicate_ids: List[str] = []
+    if not args.no_dedupe:
+        docs, duplicate_ids, stats = dedupe.dedupe_chunks(docs, threshold=args.dedupe_threshold, chunk_id=chunk_id)
+        removed = stats["input"] - stats["kept"]
+        share = (removed / stats["input"] * 100) if stats["input"] else 0.0
+        print(
+            f"Dedupe: {stats['input']} chunks in, {stats['kept']} kept, removed {removed} ({share:.1f}%): "
+            f"{stats['exact_duplicates']} exact, {stats['near_duplicates']} near duplicates"
+        )
 
-    upsert_chunks(client, args.collection, docs, model_name=args.model, reset=args.reset)
+    collection = upsert_chunks(client, args.collection, docs, model_name=args.model, reset=args.reset, codec=codec)
+    # Filled while the crawl iterator is consumed by upsert_chunks
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+        print(f"Removed {len(stale_ids)} chunks of crawled pages that shrank or disappeared")
+    if duplicate_ids and not args.reset:
+        # Earlier runs may have stored chunks that are now duplicates
+        collection.delete(ids=duplicate_ids)
+    # FAQ pairs are collected while the chunk iterators above are consumed
+    for qa_file in args.qa_file:
+        qa_pairs.extend(load_qa_file(Path(qa_file)))
+    qa_collection = args.qa_collection or f"{args.collection}_qa"
+    qa_index = upsert_qa_pairs(client, qa_collection, qa_pairs, model_name=args.model, reset=args.reset, codec=codec)
+    # Keep IDs still produced this run, e.g. a curated pair with the same question and URL
+    stale_qa_ids = sorted(set(stale_qa_ids) - {qa_id(pair) for pair in qa_pairs})
+    if stale_qa_ids:
+        qa_index.delete(ids=stale_qa_ids)
+        print(f"Removed {len(stale_qa_ids)} FAQ pairs of crawled pages that changed or disappeared")
+    if crawl_cache is not None:
+        # Only now are the changed pages stored; saving earlier would skip them after a failure
+        crawl_cache.save()
+    if codec is not None:
+        codec.save(codec_path(args.db_dir))
+        print(f"Stored embeddings as {codec.describe()}")
+    print(f"Indexed {len(qa_pairs)} FAQ question/answer pairs into {qa_collection}")
+    stats = batching.inference_stats().get("ingest_embed")
+    if stats:
+        print(
+            f"Embedded {stats['items']} texts in {stats['batches']} batches: "
+            f"{stats['tokens_per_second']} tokens/s, {stats['padding_waste']:.1%} padding"
+        )
     print(f"Ingest complete. DB path: {args.db_dir}, collection: {args.collection}")
 
+    if args.publish_snapshot:
+        # Older Chroma releases return Collection objects, newer ones names
+        names = [getattr(item, "name", item) for item in client.list_collections()]
+        counts = {name: client.get_collection(name).count() for name in names}
+        manifest = snapshots.publish_snapshot(
+            args.db_dir, args.snapshot_dir, counts, embed_model=args.model, keep=args.snapshot_keep
+        )
+        print(
+            f"Published index snapshot {manifest['version']} ({manifest['bytes'] / 2**20:.1f} MiB, "
+            f"{len(manifest['files'])} files) to {args.snapshot_dir}"
+        )
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,233 @@
+"""
+HTTP load generator for the /ask -> /tasks/{task_id} flow.
+
+Each virtual request posts a question to /ask and then polls /tasks/{task_id}
+the same way ``chat.js`` does (every second, up to five minutes) until the task is
+completed or failed. Two modes are supported:
+
+- ``closed``: N virtual users, each sending its next question as soon as the
+  previous one finishes.
+- ``open``: new requests arrive at a fixed rate regardless of how many are
+  still in flight, which is what reveals the saturation point.
+
+Example:
+    python -m app.loadtest --base_url http://localhost:8080 --mode open --rate 5 --duration 60
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+DEFAULT_QUESTIONS = Path(__file__).resolve().parent.parent / "loadtest" / "questions.jsonl"
+POLL_INTERVAL = 1.0    # matches chat.js
+TASK_TIMEOUT = 300.0   # matches chat.js
+
+
+def load_questions(path: Path) -> List[str]:
+    """Read questions from a JSONL file (``question`` or ``title`` keys, or bare strings)."""
+    questions: List[str] = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            item = line
+        if isinstance(item, dict):
+            item = item.get("question") or item.get("title") or ""
+        if isinstance(item, str) and item.strip():
+            questions.append(item.strip())
+    if not questions:
+        raise SystemExit(f"No questions found in {path}")
+    return questions
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+async def run_request(
+    client: httpx.AsyncClient, question: str, top_k: Optional[int], use_web_search: Optional[bool]
+) -> Dict[str, Any]:
+    """Submit one question and follow its task to completion."""
+    started = time.perf_counter()
+    body: Dict[str, Any] = {"question": question}
+    if top_k is not None:
+        body["top_k"] = top_k
+    if use_web_search is not None:
+        body["use_web_search"] = use_web_search
+
+    record: Dict[str, Any] = {"outcome": "error", "status_code": None}
+    try:
+        response = await client.post("/ask", json=body)
+        record["status_code"] = response.status_code
+        if response.status_code == 429:
+            record["outcome"] = "throttled"
+            return record
+        response.raise_for_status()
+        task_id = response.json()["task_id"]
+
+        deadline = started + TASK_TIMEOUT
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            poll = await client.get(f"/tasks/{task_id}")
+            if poll.status_code == 429:
+                continue
+            if poll.status_code != 200:
+                record["status_code"] = poll.status_code
+                return record
+            task = poll.json()
+            if task.get("status") not in ("completed", "failed"):
+                continue
+            record["latency"] = time.perf_counter() - started
+            enqueued, began = _parse_ts(task.get("enqueued_at")), _parse_ts(task.get("started_at"))
+            if enqueued and began:
+                record["queue_wait"] = (began - enqueued).total_seconds()
+            result = task.get("result") or {}
+            if task["status"] == "completed" and not result.get("error"):
+                record["outcome"] = "ok"
+                # Passages-only or FAQ answers never reach the LLM, so they don't load it
+                record["llm"] = result.get("served_by") == "llm" and bool(result.get("llm_usage"))
+            return record
+        record["outcome"] = "timeout"
+    except Exception as exc:
+        record["error"] = str(exc)
+    return record
+
+
+async def closed_loop(args, client: httpx.AsyncClient, questions: List[str]) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    stop_at = time.perf_counter() + args.duration
+    cycle = itertools.cycle(questions)
+
+    async def user() -> None:
+        while time.perf_counter() < stop_at:
+            records.append(await run_request(client, next(cycle), args.top_k, args.use_web_search))
+
+    await asyncio.gather(*(user() for _ in range(args.users)))
+    return records
+
+
+async def open_loop(args, client: httpx.AsyncClient, questions: List[str]) -> List[Dict[str, Any]]:
+    tasks: List[asyncio.Task] = []
+    cycle = itertools.cycle(questions)
+    started = time.perf_counter()
+    next_arrival = started
+    while next_arrival < started + args.duration:
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        tasks.append(
+            asyncio.create_task(run_request(client, next(cycle), args.top_k, args.use_web_search))
+        )
+        # Poisson arrivals at the configured mean rate
+        next_arrival += random.expovariate(args.rate)
+    return list(await asyncio.gather(*tasks))
+
+
+def summarize(records: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    total = len(records)
+    ok = [r for r in records if r["outcome"] == "ok"]
+    latencies = [r["latency"] for r in ok]
+    waits = [r["queue_wait"] for r in records if "queue_wait" in r]
+    summary: Dict[str, Any] = {
+        "requests": total,
+        "completed": len(ok),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(sum(r["outcome"] in ("error", "timeout") for r in records) / total, 4) if total else 0.0,
+        "throttled_rate": round(sum(r["outcome"] == "throttled" for r in records) / total, 4) if total else 0.0,
+        "llm_answered": sum(bool(r.get("llm")) for r in ok),
+    }
+    for name, values in (("latency_s", latencies), ("queue_wait_s", waits)):
+        summary[name] = {
+            f"p{pct}": round(percentile(values, pct), 3) for pct in (50, 90, 95, 99)
+        }
+        summary[name]["max"] = round(max(values), 3) if values else float("nan")
+    return summary
+
+
+async def run(args) -> Dict[str, Any]:
+    questions = load_questions(Path(args.questions))
+    concurrency = args.users if args.mode == "closed" else max(10, int(args.rate * TASK_TIMEOUT))
+    limits = httpx.Limits(max_connections=min(concurrency, args.max_connections))
+    async with httpx.AsyncClient(
+        base_url=args.base_url.rstrip("/"), timeout=args.timeout, limits=limits, verify=False
+    ) as client:
+        started = time.perf_counter()
+        if args.mode == "closed":
+            records = await closed_loop(args, client, questions)
+        else:
+            records = await open_loop(args, client, questions)
+        elapsed = time.perf_counter() - started
+    return summarize(records, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /ask -> /tasks flow of a running deployment.")
+    parser.add_argument("--base_url", type=str, default="http://localhost:8080", help="API base URL")
+    parser.add_argument("--questions", type=str, default=str(DEFAULT_QUESTIONS), help="JSONL file of questions")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="Closed loop (users) or open loop (rate)")
+    parser.add_argument("--users", type=int, default=4, help="Virtual users in closed-loop mode")
+    parser.add_argument("--rate", type=float, default=1.0, help="Mean arrivals per second in open-loop mode")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to keep generating load")
+    parser.add_argument("--top_k", type=int, default=None, help="top_k sent with each question")
+    parser.add_argument(
+        "--no_web_search", dest="use_web_search", action="store_const", const=False, default=None,
+        help="Send use_web_search=false with each question",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-HTTP-call timeout (seconds)")
+    parser.add_argument("--max_connections", type=int, default=200, help="HTTP connection pool size")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    parser.add_argument(
+        "--max_error_rate", type=float, default=None,
+        help="Exit non-zero if the error rate exceeds this fraction (for CI)",
+    )
+    parser.add_argument(
+        "--require_llm", action="store_true",
+        help="Exit non-zero unless every completed answer was served by the LLM with llm_usage (for CI)",
+    )
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"Mode: {args.mode}  requests: {summary['requests']}  completed: {summary['completed']}")
+        print(f"Throughput: {summary['throughput_rps']} req/s over {summary['elapsed_s']}s")
+        print(f"Errors: {summary['error_rate']:.2%}  429s: {summary['throttled_rate']:.2%}")
+        print(f"LLM answers: {summary['llm_answered']} of {summary['completed']}")
+        for name in ("latency_s", "queue_wait_s"):
+            stats = "  ".join(f"{k}={v}" for k, v in summary[name].items())
+            print(f"{name}: {stats}")
+
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        raise SystemExit(1)
+    if args.require_llm and (not summary["completed"] or summary["llm_answered"] < summary["completed"]):
+        # Without this a broken LLM client silently turns the run into a passages-only benchmark
+        print("Not every completed answer came from the LLM; check OPENAI_* and the stub LLM")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
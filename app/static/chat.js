@@ -2,6 +2,10 @@ const globalConfig = window.ChromaFaqBotConfig || {};
 const configuredBaseUrl = (globalConfig.baseUrl || '').replace(/\/$/, '');
 const ASK_ENDPOINT = configuredBaseUrl ? `${configuredBaseUrl}/ask` : '/ask';
 const END_SESSION_ENDPOINT = configuredBaseUrl ? `${configuredBaseUrl}/end` : '/end';
+const PREFETCH_ENDPOINT = configuredBaseUrl ? `${configuredBaseUrl}/prefetch` : '/prefetch';
+const PREFETCH_ENABLED = globalConfig.prefetch !== false;
+const PREFETCH_DEBOUNCE_MS = globalConfig.prefetchDebounceMs || 400;
+const PREFETCH_MIN_CHARS = globalConfig.prefetchMinChars || 12;
 const baseFetchOptions = globalConfig.fetchOptions || {};
 const baseHeaders = {
     'Content-Type': 'application/json',
@@ -276,6 +280,69 @@ function renderHistory(history = []) {
     });
 }
 
+// Typeahead prefetch: retrieval starts while the question is still being typed
+let prefetchTimer = null;
+let prefetchController = null;
+let lastPrefetchedQuestion = '';
+// Set once the API reports ENABLE_PREFETCH is off, so typing stops costing requests
+let prefetchDisabledByServer = false;
+
+function cancelScheduledPrefetch() {
+    if (prefetchTimer) {
+        clearTimeout(prefetchTimer);
+        prefetchTimer = null;
+    }
+}
+
+async function prefetchCandidates(question) {
+    if (question === lastPrefetchedQuestion) {
+        return;
+    }
+    // Only the newest partial question matters
+    if (prefetchController) {
+        prefetchController.abort();
+    }
+    prefetchController = new AbortController();
+    lastPrefetchedQuestion = question;
+
+    try {
+        const response = await fetch(PREFETCH_ENDPOINT, {
+            ...sharedFetchOptions,
+            method: 'POST',
+            headers: baseHeaders,
+            body: JSON.stringify({ question, session_id: sessionId }),
+            signal: prefetchController.signal
+        });
+        if (response.ok) {
+            const data = await response.json();
+            if (data.status === 'disabled') {
+                prefetchDisabledByServer = true;
+                cancelScheduledPrefetch();
+            }
+        }
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            // Prefetch is best effort; the submitted question is answered either way
+            console.debug('Prefetch failed:', error);
+        }
+    }
+}
+
+function schedulePrefetch() {
+    if (!PREFETCH_ENABLED || prefetchDisabledByServer || !chatInput) {
+        return;
+    }
+    cancelScheduledPrefetch();
+    const question = chatInput.value.trim();
+    if (question.length < PREFETCH_MIN_CHARS) {
+        return;
+    }
+    prefetchTimer = setTimeout(() => {
+        prefetchTimer = null;
+        prefetchCandidates(question);
+    }, PREFETCH_DEBOUNCE_MS);
+}
+
 // Store references to active polls to prevent duplicates
 const activePolls = new Map();
 
@@ -430,11 +497,15 @@ if (chatForm && chatInput) {
             return;
         }
 
+        cancelScheduledPrefetch();
+        lastPrefetchedQuestion = '';
         appendMessage(question, 'user');
         chatInput.value = '';
         askQuestion(question);
     });
 
+    chatInput.addEventListener('input', schedulePrefetch);
+
     // Allow sending message with Enter key (without Shift for new lines)
     chatInput.addEventListener('keydown', event => {
         if (event.key === 'Enter' && !event.shiftKey) {
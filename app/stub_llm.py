@@ -0,0 +1,41 @@
+"""
+Minimal OpenAI-compatible chat completions stub for load tests and CI.
+
+Answers every request with a canned response after STUB_LLM_DELAY seconds so the
+worker's LLM step has a realistic, deterministic cost without an external endpoint.
+"""
+import asyncio
+import os
+import time
+import uuid
+
+from fastapi import FastAPI
+
+STUB_LLM_DELAY = float(os.getenv("STUB_LLM_DELAY", "0.5"))
+
+app = FastAPI(title="Stub LLM", version="1.0.0")
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: dict):
+    await asyncio.sleep(STUB_LLM_DELAY)
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+    content = "1. This is a stubbed answer for load testing [1]."
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_chars // 4 + len(content) // 4,
+        },
+    }
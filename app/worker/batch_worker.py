@@ -0,0 +1,142 @@
+"""
+Worker module for processing bulk question batches from the queue.
+
+A batch is answered in chunks: each chunk is embedded in one call, matched against
+the FAQ direct-answer index and the document collection with one multi-query
+``collection.query`` each, reranked with one cross-encoder call, and then sent to
+the LLM (and optionally web search) with bounded concurrency. Results are appended
+to the batch in question order as soon as each chunk finishes.
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from app.common.core import (
+    embed, build_prompt, call_llm, assign_citations, retrieve_batch, rerank_batch,
+    match_faq_answers, web_search_node, combine_contexts_node, fallback_note, TOP_K_DEFAULT, index_in_use,
+    route_shards,
+)
+from app.common.task_manager import append_batch_results
+
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "32"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+
+def _answer_question(
+    index: int,
+    question: str,
+    reranked: List[Dict[str, Any]],
+    use_web_search: bool,
+) -> Dict[str, Any]:
+    """Finish one question once its reranked passages are known: web search, prompt, LLM."""
+    try:
+        web_results = web_search_node(
+            {"question": question, "use_web_search": use_web_search}
+        ).get("web_results", [])
+        contexts = combine_contexts_node(
+            {"reranked_results": reranked, "web_results": web_results}
+        ).get("combined_contexts", [])
+        prepared_contexts, citations = assign_citations(contexts)
+
+        degradations: List[str] = []
+        answer = call_llm(build_prompt(question, prepared_contexts), degradations=degradations) if prepared_contexts else ""
+        result = {
+            "index": index,
+            "question": question,
+            "answer": answer,
+            "citations": citations,
+            "note": "" if answer else fallback_note(degradations),
+            "served_by": "llm" if answer else "passages",
+        }
+        if degradations:
+            result["degradations"] = degradations
+        return result
+    except Exception as exc:
+        logging.error("Error answering batch question %s: %s", index, exc)
+        return {"index": index, "question": question, "error": str(exc)}
+
+
+def process_chunk(
+    offset: int,
+    questions: List[str],
+    top_k: int,
+    use_web_search: bool,
+    pool: ThreadPoolExecutor,
+) -> List[Dict[str, Any]]:
+    """Answer one chunk of a batch; results are returned in question order."""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    live = [i for i, question in enumerate(questions) if question.strip()]
+    for i, question in enumerate(questions):
+        if not question.strip():
+            results[i] = {"index": offset + i, "question": question, "error": "Empty question"}
+
+    embeddings = embed([questions[i] for i in live]) if live else []
+    shard_lists = [route_shards(questions[i], embedding) for i, embedding in zip(live, embeddings)]
+    faq_hits = match_faq_answers(embeddings, shard_lists)
+
+    pending: List[int] = []
+    pending_embeddings: List[List[float]] = []
+    pending_shards: List[List[str]] = []
+    for i, embedding, shards, hit in zip(live, embeddings, shard_lists, faq_hits):
+        if hit:
+            _, citations = assign_citations([hit])
+            results[i] = {
+                "index": offset + i,
+                "question": questions[i],
+                "answer": hit["document"],
+                "citations": citations,
+                "note": "",
+                "served_by": "faq_direct",
+                "faq_similarity": round(hit["score"], 4),
+            }
+        else:
+            pending.append(i)
+            pending_embeddings.append(embedding)
+            pending_shards.append(shards)
+
+    candidates = retrieve_batch(pending_embeddings, top_k=top_k, shard_lists=pending_shards)
+    reranked = rerank_batch([questions[i] for i in pending], candidates, top_k=top_k)
+
+    futures = {
+        i: pool.submit(_answer_question, offset + i, questions[i], passages, use_web_search)
+        for i, passages in zip(pending, reranked)
+    }
+    for i, future in futures.items():
+        results[i] = future.result()
+    return results
+
+
+def process_batch_request(batch_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Process a batch of questions from the queue.
+
+    Args:
+        batch_data: Dictionary containing the batch id, questions and options
+
+    Returns:
+        Dictionary with the batch id and final counts
+    """
+    batch_id = batch_data["batch_id"]
+    questions = [str(q) for q in batch_data.get("questions") or []]
+    top_k = batch_data.get("top_k") or TOP_K_DEFAULT
+    use_web_search = bool(batch_data.get("use_web_search", False))
+
+    completed = failed = 0
+    with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY) as pool:
+        for offset in range(0, len(questions), BATCH_CHUNK_SIZE):
+            chunk = questions[offset:offset + BATCH_CHUNK_SIZE]
+            try:
+                # Per chunk, so a long batch doesn't hold back a new index snapshot
+                with index_in_use():
+                    results = process_chunk(offset, chunk, top_k, use_web_search, pool)
+            except Exception as exc:
+                logging.error("Batch %s chunk at %s failed: %s", batch_id, offset, exc)
+                results = [
+                    {"index": offset + i, "question": q, "error": str(exc)} for i, q in enumerate(chunk)
+                ]
+            append_batch_results(batch_id, results)
+            completed += len(results)
+            failed += sum(1 for result in results if result.get("error"))
+
+    return {"batch_id": batch_id, "total": len(questions), "completed": completed, "failed": failed}
@@ -3,6 +3,7 @@ Worker module for processing chat requests from the queue.
 """
 import os
 import logging
+import time
 from typing import Dict, Any, List
 from pathlib import Path
 import chromadb
@@ -11,12 +12,21 @@ from langchain_community.tools import DuckDuckGoSearchResults
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Optional
 import uuid
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
 
 # Import shared resources and functions from the common core
 from app.common.core import (
-    embed, build_prompt, call_llm, assign_citations,
+    embed, build_prompt, call_llm_with_usage, assign_citations,
     chroma_retrieve_node, rerank_node, web_search_node, combine_contexts_node,
-    build_retrieval_graph, RetrievalState
+    build_retrieval_graph, RetrievalState, match_faq_answer, ENABLE_FAQ_DIRECT, fallback_note, budget_llm_call,
+    SHARDS, index_in_use, route_shards,
+)
+from app.common import tracing
+from app.common.profiling import RequestProfiler, timed_node
+from app.common.task_manager import (
+    store_task_result, is_current_prefetch, store_prefetched_candidates, get_prefetched_candidates,
 )
 
 # Configuration
@@ -27,6 +37,8 @@ RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-12-v2"
 TOP_K_DEFAULT = int(os.getenv("TOP_K", "5"))
 ENABLE_WEB_SEARCH = os.getenv("ENABLE_WEB_SEARCH", "true").lower() == "true"
 WEB_SEARCH_K = int(os.getenv("WEB_SEARCH_K", "3"))
+# Reuse prefetched candidates when the submitted question embeds at least this close
+PREFETCH_MIN_SIMILARITY = float(os.getenv("PREFETCH_MIN_SIMILARITY", "0.92"))
 
 # Redis configuration
 REDIS_HOST = os.getenv("REDIS_HOST", "10.160.13.16")
@@ -50,11 +62,140 @@ except Exception as exc:
 
 # Build retrieval graph
 retrieval_graph = build_retrieval_graph()
+# Same graph with per-node timers, only used for profiled requests
+profiled_retrieval_graph = build_retrieval_graph(node_wrapper=timed_node)
+
+
+@contextmanager
+def _timer(profiler: Optional[RequestProfiler], name: str):
+    with profiler.timer(name) if profiler is not None else nullcontext(), tracing.span(name):
+        yield
+
+
+def _same_text(a: str, b: str) -> bool:
+    return " ".join(a.casefold().split()) == " ".join(b.casefold().split())
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / denom if denom else 0.0
+
+
+def reuse_prefetched(task_data: Dict[str, Any], graph_input: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Reranked candidates prefetched for this session, if they were retrieved for a close enough question.
+
+    Args:
+        task_data: The chat request
+        graph_input: Retrieval graph input; gains the query embedding if one had to be computed
+
+    Returns:
+        The top reranked candidates, or None to retrieve from scratch
+    """
+    session_id = task_data.get("session_id")
+    if not session_id:
+        return None
+    try:
+        cached = get_prefetched_candidates(session_id)
+    except Exception as exc:  # pragma: no cover - redis outages
+        logging.warning("Unable to read prefetched candidates: %s", exc)
+        return None
+    top_k = graph_input["top_k"]
+    if (
+        not cached
+        or not cached.get("results")
+        or cached.get("top_k", 0) < top_k
+        or (cached.get("shards") or None) != (task_data.get("shards") or None)
+    ):
+        return None
+    if not _same_text(cached["question"], graph_input["question"]):
+        if "query_embedding" not in graph_input:
+            graph_input["query_embedding"] = embed([graph_input["question"]])[0]
+        if _cosine(cached["query_embedding"], graph_input["query_embedding"]) < PREFETCH_MIN_SIMILARITY:
+            return None
+    return cached["results"][:top_k]
+
+
+def prefetch_candidates(task_data: Dict[str, Any]) -> None:
+    """
+    Embed, retrieve and rerank a question that is still being typed and cache the candidates.
+
+    Stops between stages once the session has queued a newer prefetch.
+
+    Args:
+        task_data: Dictionary with prefetch_id, question, session_id, top_k and optional shards
+    """
+    session_id = task_data["session_id"]
+    prefetch_id = task_data["prefetch_id"]
+    question = task_data.get("question", "").strip()
+    shards = task_data.get("shards")
+
+    def superseded() -> bool:
+        return not is_current_prefetch(session_id, prefetch_id)
+
+    if not question or superseded():
+        return None
+    state: Dict[str, Any] = {"question": question, "top_k": task_data.get("top_k", TOP_K_DEFAULT)}
+    if shards:
+        state["shards"] = shards
+    with index_in_use():
+        state["query_embedding"] = embed([question])[0]
+        if superseded():
+            return None
+        state.update(chroma_retrieve_node(state))
+        if superseded():
+            return None
+        state.update(rerank_node(state))
+    if superseded() or not state.get("reranked_results"):
+        return None
+    store_prefetched_candidates(session_id, {
+        "question": question,
+        "query_embedding": state["query_embedding"],
+        "shards": shards,
+        "top_k": state["top_k"],
+        "results": state["reranked_results"],
+    })
+    return None
+
+
+def process_chat_request(task_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Process a chat request from the queue and put the response in the result store.
+
+    Args:
+        task_data: Dictionary containing task information
+
+    Returns:
+        None once the response is stored, otherwise the response itself so RQ keeps it
+    """
+    task_id = task_data.get("task_id")
+    parent = tracing.extract(task_data.get("traceparent"))
+    if parent is not None and task_data.get("trace_enqueued_ns"):
+        tracing.record_span(
+            "queue wait chat_tasks", parent, task_data["trace_enqueued_ns"], time.time_ns(),
+            **{"messaging.destination.name": "chat_tasks"},
+        )
+    try:
+        with tracing.span("process chat_tasks", parent=parent, kind="consumer", **{"task.id": task_id or ""}):
+            with index_in_use():
+                response_payload = answer_chat_request(task_data)
+            if task_id:
+                try:
+                    store_task_result(task_id, response_payload)
+                    return None
+                except Exception as exc:  # pragma: no cover - redis failures
+                    logging.warning("Failed to store result for %s, keeping it on the job: %s", task_id, exc)
+            return response_payload
+    finally:
+        if parent is not None:
+            # A forked work horse exits right after the job, before the export thread would run
+            tracing.flush()
 
 
-def process_chat_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
+def answer_chat_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Process a chat request from the queue.
+    Answer a chat request.
 
     Args:
         task_data: Dictionary containing task information
@@ -62,6 +203,7 @@ def process_chat_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
     Returns:
         Dictionary with the chat response
     """
+    profiler = RequestProfiler(task_data.get("task_id", "unknown")).start() if task_data.get("profile") else None
     try:
         question = task_data.get("question", "").strip()
         session_id = task_data.get("session_id", str(uuid.uuid4()))
@@ -79,27 +221,71 @@ def process_chat_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
                 "history": [],
             }
 
+        # Known FAQ questions are answered straight from the direct-answer index
+        graph_input = {"question": question, "top_k": top_k, "use_web_search": use_web_search}
+        trace = tracing.current()
+        if trace is not None:
+            graph_input["trace"] = trace
+        deadline = task_data.get("deadline")
+        if deadline:
+            graph_input["deadline"] = deadline
+        if task_data.get("shards"):
+            graph_input["shards"] = task_data["shards"]
+        if ENABLE_FAQ_DIRECT:
+            with _timer(profiler, "model:embed"):
+                graph_input["query_embedding"] = embed([question])[0]
+            with _timer(profiler, "faq:lookup"):
+                # Route once: the FAQ lookup and retrieval search the same shards
+                graph_input["shards"] = route_shards(
+                    question, graph_input["query_embedding"], task_data.get("shards")
+                )
+                faq_hit = match_faq_answer(question, graph_input["query_embedding"], graph_input["shards"])
+            if faq_hit:
+                _, citations = assign_citations([faq_hit])
+                response_payload = {
+                    "question": question,
+                    "answer": faq_hit["document"],
+                    "sources": citations,
+                    "citations": citations,
+                    "note": "",
+                    "session_id": session_id,
+                    "served_by": "faq_direct",
+                    "faq_similarity": round(faq_hit["score"], 4),
+                }
+                if profiler is not None:
+                    response_payload["profile_url"] = f"/tasks/{task_data.get('task_id')}/profile"
+                return response_payload
+
+        prefetched = reuse_prefetched(task_data, graph_input)
+        if prefetched:
+            # Straight to web search and the prompt: retrieval and rerank already ran while typing
+            graph_input["reranked_results"] = prefetched
+
         # Execute retrieval graph
-        retrieval_state = retrieval_graph.invoke(
-            {"question": question, "top_k": top_k, "use_web_search": use_web_search}
-        )
+        if profiler is not None:
+            graph_input["profiler"] = profiler
+            retrieval_state = profiled_retrieval_graph.invoke(graph_input)
+        else:
+            retrieval_state = retrieval_graph.invoke(graph_input)
         contexts = retrieval_state.get("combined_contexts") or []
         prepared_contexts, citations = assign_citations(contexts)
 
+        degradations = list(retrieval_state.get("degradations") or [])
+
         answer = ""
+        llm_usage = {}
         if prepared_contexts:
-            prompt = build_prompt(question, prepared_contexts)
-            answer = call_llm(prompt)
-
-        if not answer:
-            note = (
-                "Heads-up: I don't have a language model connected right now, so I'm "
-                "sharing the most relevant passages I could find. If you set OPENAI_API_KEY "
-                "(and optionally OPENAI_BASE_URL, OPENAI_MODEL), I can draft full "
-                "responses for you."
-            )
-        else:
-            note = ""
+            llm_options, llm_degradations = budget_llm_call(deadline)
+            degradations.extend(llm_degradations)
+            if llm_options is not None:
+                with _timer(profiler, "build_prompt"):
+                    prompt = build_prompt(question, prepared_contexts)
+                with _timer(profiler, "model:llm"):
+                    answer, llm_usage = call_llm_with_usage(prompt, degradations=degradations, **llm_options)
+            if deadline and not answer:
+                degradations.append("passages_only")
+
+        note = "" if answer else fallback_note(degradations)
 
         response_payload = {
             "question": question,
@@ -108,7 +294,20 @@ def process_chat_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
             "citations": citations,
             "note": note,
             "session_id": session_id,
+            "served_by": "llm" if answer else "passages",
         }
+        if prefetched:
+            response_payload["prefetched"] = True
+        if llm_usage:
+            response_payload["llm_usage"] = llm_usage
+        if deadline:
+            response_payload["latency_budget_ms"] = task_data.get("latency_budget_ms")
+        if deadline or degradations:
+            response_payload["degradations"] = degradations
+        if len(SHARDS) > 1:
+            response_payload["shard_latency_ms"] = retrieval_state.get("shard_latency_ms") or {}
+        if profiler is not None:
+            response_payload["profile_url"] = f"/tasks/{task_data.get('task_id')}/profile"
 
         return response_payload
 
@@ -118,6 +317,13 @@ def process_chat_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
             "error": str(e),
             "task_id": task_data.get("task_id"),
         }
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            try:
+                profiler.save()
+            except Exception as exc:  # pragma: no cover - redis/disk failures
+                logging.warning("Failed to store profile for %s: %s", task_data.get("task_id"), exc)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,22 @@
 """
-Script to start multiple worker processes for processing chat requests.
+Script to start and supervise worker processes for processing chat requests.
+
+The supervisor keeps between MIN_WORKERS and MAX_WORKERS RQ workers running,
+scaling on ``chat_tasks`` depth and on how long the oldest job has waited,
+restarts workers that crash or get OOM-killed (with exponential backoff), and
+drains gracefully on SIGTERM/SIGINT. The CPU budget is split across worker slots
+so each process's PyTorch/OpenMP pools only use their share of the cores.
 """
+import math
 import os
 import sys
+import signal
+import time
 import logging
 import multiprocessing
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Dict, List, Optional
 from rq import Worker
 
 # Add the project root to the Python path
@@ -19,45 +30,246 @@ parent_of_project_root = project_root.parent
 if str(parent_of_project_root) not in sys.path:
     sys.path.insert(0, str(parent_of_project_root))
 
-from app.common.task_manager import redis_conn
+from app.common import snapshots
+from app.common.task_manager import redis_conn, task_queue
+from app.index_maintenance import serving_collections, warm_index_files
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Supervisor configuration
+CPU_BUDGET = int(os.getenv("CPU_BUDGET", multiprocessing.cpu_count()))
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", os.getenv("NUM_WORKERS", CPU_BUDGET)))
+MIN_WORKERS = min(int(os.getenv("MIN_WORKERS", "1")), MAX_WORKERS)
+# Scale up when more than this many jobs are waiting per running worker ...
+SCALE_UP_QUEUE_PER_WORKER = float(os.getenv("SCALE_UP_QUEUE_PER_WORKER", "2"))
+# ... or when the oldest queued job has waited longer than this (seconds)
+SCALE_UP_MAX_WAIT = float(os.getenv("SCALE_UP_MAX_WAIT", "5"))
+# Retire one worker after the queue has been empty this long (seconds)
+SCALE_DOWN_IDLE = float(os.getenv("SCALE_DOWN_IDLE", "60"))
+SCALE_INTERVAL = float(os.getenv("SCALE_INTERVAL", "5"))
+RESTART_BACKOFF_BASE = float(os.getenv("RESTART_BACKOFF_BASE", "1"))
+RESTART_BACKOFF_MAX = float(os.getenv("RESTART_BACKOFF_MAX", "60"))
+# A worker that lived this long resets its slot's crash counter
+HEALTHY_UPTIME = float(os.getenv("HEALTHY_UPTIME", "60"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "120"))
+WORKER_CPU_AFFINITY = os.getenv("WORKER_CPU_AFFINITY", "false").lower() == "true"
+# "fork": stock RQ worker, one forked work horse per job; "threaded": one long-lived
+# process per slot running JOB_CONCURRENCY jobs on threads (app/worker/threaded_worker.py)
+WORKER_MODE = os.getenv("WORKER_MODE", "fork").lower()
+# Page the Chroma index in before a worker takes its first job
+WARM_INDEX_ON_START = os.getenv("WARM_INDEX_ON_START", "true").lower() == "true"
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "TORCH_NUM_THREADS",
+)
+
+
+def threads_per_worker(cpu_budget: int = CPU_BUDGET, max_workers: int = MAX_WORKERS) -> int:
+    """Split the core budget so MAX_WORKERS processes never oversubscribe it."""
+    return max(1, cpu_budget // max(1, max_workers))
+
+
+def cpus_for_slot(slot: int, threads: int) -> List[int]:
+    """Pick a contiguous block of the CPUs this process may run on for a worker slot."""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if not available:
+        return []
+    start = (slot * threads) % len(available)
+    return [available[(start + i) % len(available)] for i in range(min(threads, len(available)))]
+
 
-def start_worker(worker_id: int):
+def start_worker(worker_id: int, threads: Optional[int] = None, cpus: Optional[List[int]] = None):
     """
     Start a worker process.
 
     Args:
         worker_id: Identifier for the worker process
+        threads: Intra-op thread count for PyTorch/OpenMP/BLAS in this worker
+        cpus: CPU ids to pin this worker to (no pinning when empty)
     """
-    logger.info(f"Starting worker {worker_id}")
+    if threads:
+        # Must be set before torch is imported by the job's work horse
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(threads)
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
 
-    # Create worker
+    logger.info(f"Starting worker {worker_id} (threads={threads}, cpus={cpus or 'any'})")
+
+    if WARM_INDEX_ON_START:
+        start = time.monotonic()
+        db_dir = os.getenv("DB_DIR", "./chroma_db")
+        version = snapshots.current_version() if snapshots.SNAPSHOT_DIR else None
+        if version:
+            try:
+                # Also saves every job's work horse from fetching the snapshot itself
+                db_dir = str(snapshots.fetch_snapshot(version))
+            except Exception as exc:  # pragma: no cover - shared storage failures
+                logger.warning(f"Worker {worker_id} could not fetch index snapshot {version}: {exc}")
+        warmed = warm_index_files(db_dir, serving_collections())
+        logger.info(f"Worker {worker_id} warmed {warmed / 2**20:.1f} MiB of index in {time.monotonic() - start:.2f}s")
+
+    if WORKER_MODE == "threaded":
+        from app.worker.threaded_worker import run_threaded_workers
+
+        sys.exit(run_threaded_workers(worker_id))
+
+    # Prefetches are left to threaded workers: forking a work horse per keystroke pause
+    # would reload the models and hold the process while real questions wait
     worker = Worker(['chat_tasks'], connection=redis_conn)
     worker.work(logging_level='INFO')
 
 
-def main():
-    """Main function to start multiple worker processes."""
-    # Get number of workers from environment variable or default to CPU count
-    num_workers = int(os.getenv('NUM_WORKERS', multiprocessing.cpu_count()))
+def oldest_job_wait() -> float:
+    """Seconds the job at the head of ``chat_tasks`` has been waiting."""
+    job_ids = task_queue.get_job_ids(0, 1)
+    if not job_ids:
+        return 0.0
+    job = task_queue.fetch_job(job_ids[0])
+    if not job or not job.enqueued_at:
+        return 0.0
+    enqueued_at = job.enqueued_at
+    if enqueued_at.tzinfo is None:
+        enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (datetime.now(timezone.utc) - enqueued_at).total_seconds())
+
 
-    logger.info(f"Starting {num_workers} worker processes")
+class WorkerSupervisor:
+    """Keeps a pool of RQ worker processes sized to the queue and alive."""
 
-    # Create and start worker processes
-    processes = []
-    for i in range(num_workers):
-        process = multiprocessing.Process(target=start_worker, args=(i,))
+    def __init__(self):
+        self.threads = threads_per_worker()
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.started_at: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
+        self.restart_at: Dict[int, float] = {}
+        self.retiring: Dict[int, multiprocessing.Process] = {}
+        self.target = MIN_WORKERS
+        self.idle_since: Optional[float] = None
+        self.draining = False
+
+    def spawn(self, slot: int) -> None:
+        cpus = cpus_for_slot(slot, self.threads) if WORKER_CPU_AFFINITY else None
+        process = multiprocessing.Process(
+            target=start_worker, args=(slot, self.threads, cpus), name=f"chat-worker-{slot}"
+        )
         process.start()
-        processes.append(process)
+        self.processes[slot] = process
+        self.started_at[slot] = time.monotonic()
+        self.restart_at.pop(slot, None)
+
+    def retire(self, slot: int) -> None:
+        """Warm-shutdown a worker: RQ finishes the current job on SIGTERM, then exits."""
+        process = self.processes.pop(slot, None)
+        self.restart_at.pop(slot, None)
+        if process is not None and process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+            self.retiring[slot] = process
+
+    def reap(self) -> None:
+        now = time.monotonic()
+        for slot, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            del self.processes[slot]
+            uptime = now - self.started_at.get(slot, now)
+            if uptime >= HEALTHY_UPTIME:
+                self.failures[slot] = 0
+            self.failures[slot] = self.failures.get(slot, 0) + 1
+            delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** (self.failures[slot] - 1))
+            reason = "killed by SIGKILL (likely OOM)" if process.exitcode == -signal.SIGKILL else f"exit code {process.exitcode}"
+            logger.warning(
+                f"Worker {slot} died after {uptime:.0f}s ({reason}); restarting in {delay:.1f}s"
+            )
+            self.restart_at[slot] = now + delay
+        for slot, process in list(self.retiring.items()):
+            if not process.is_alive():
+                process.join()
+                del self.retiring[slot]
+
+    def rescale(self) -> None:
+        try:
+            depth = task_queue.count
+            wait = oldest_job_wait()
+        except Exception as exc:  # pragma: no cover - redis outages
+            logger.warning(f"Unable to read queue metrics: {exc}")
+            return
+
+        now = time.monotonic()
+        running = max(1, len(self.processes))
+        if depth > running * SCALE_UP_QUEUE_PER_WORKER or wait > SCALE_UP_MAX_WAIT:
+            wanted = math.ceil(depth / SCALE_UP_QUEUE_PER_WORKER) if depth else self.target + 1
+            new_target = min(MAX_WORKERS, max(self.target + 1, wanted))
+            if new_target != self.target:
+                logger.info(f"Scaling up to {new_target} workers (depth={depth}, oldest wait={wait:.1f}s)")
+            self.target = new_target
+            self.idle_since = None
+        elif depth == 0:
+            self.idle_since = self.idle_since or now
+            if now - self.idle_since >= SCALE_DOWN_IDLE and self.target > MIN_WORKERS:
+                self.target -= 1
+                self.idle_since = now
+                logger.info(f"Queue idle; scaling down to {self.target} workers")
+        else:
+            self.idle_since = None
+
+    def converge(self) -> None:
+        now = time.monotonic()
+        wanted_slots = set(range(self.target))
+        for slot in sorted(set(self.processes) - wanted_slots, reverse=True):
+            self.retire(slot)
+        for slot in sorted(wanted_slots):
+            if slot in self.processes or slot in self.retiring:
+                continue
+            if self.restart_at.get(slot, 0) <= now:
+                self.spawn(slot)
 
-    # Wait for all processes to complete
-    for process in processes:
-        process.join()
+    def drain(self, *_args) -> None:
+        if self.draining:
+            return
+        logger.info("Draining workers; waiting for in-flight jobs to finish")
+        self.draining = True
+        for slot in list(self.processes):
+            self.retire(slot)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.drain)
+        signal.signal(signal.SIGINT, self.drain)
+        logger.info(
+            f"Supervising {MIN_WORKERS}-{MAX_WORKERS} workers, "
+            f"{self.threads} thread(s) each from a budget of {CPU_BUDGET} CPUs"
+        )
+
+        next_scale = 0.0
+        while not self.draining:
+            self.reap()
+            if time.monotonic() >= next_scale:
+                self.rescale()
+                next_scale = time.monotonic() + SCALE_INTERVAL
+            self.converge()
+            time.sleep(0.5)
+
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while self.retiring and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.5)
+        for process in self.retiring.values():
+            logger.warning(f"Killing {process.name} after drain timeout")
+            process.kill()
+            process.join()
+
+
+def main():
+    """Main function to supervise the worker processes."""
+    WorkerSupervisor().run()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
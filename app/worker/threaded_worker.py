@@ -0,0 +1,100 @@
+"""
+Non-forking executor for ``chat_tasks``.
+
+RQ's default worker forks a work horse for every job, so each chat request pays
+for fork and copy-on-write on a process holding two transformer models, and a
+process runs one job at a time even while that job waits on the LLM or web search.
+
+In this mode one long-lived process loads and warms the models once and runs
+JOB_CONCURRENCY RQ ``SimpleWorker`` loops as threads. Jobs start without a fork and
+I/O-bound jobs overlap, while CPU-bound inference is capped separately by
+INFERENCE_CONCURRENCY (see ``app/common/batching.py``). Every job still goes through
+RQ's own bookkeeping (registries, results, failure handling), with timeouts enforced
+by a timer instead of SIGALRM, so ``get_task_status`` works unchanged.
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+from typing import List
+
+from rq.timeouts import TimerDeathPenalty
+from rq.worker import SimpleWorker
+
+from app.common.task_manager import redis_conn
+
+logger = logging.getLogger(__name__)
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "8"))
+# Idle threads block on the queue for TTL - 15 seconds, so this bounds how long a stop takes
+THREAD_WORKER_TTL = int(os.getenv("THREAD_WORKER_TTL", "35"))
+
+
+class ThreadWorker(SimpleWorker):
+    """SimpleWorker that can run in a non-main thread."""
+
+    death_penalty_class = TimerDeathPenalty
+
+    def _install_signal_handlers(self):
+        # Only the main thread may install handlers; run_threaded_workers handles signals
+        pass
+
+
+def run_threaded_workers(worker_id: int, concurrency: int = JOB_CONCURRENCY) -> int:
+    """
+    Serve ``chat_tasks`` from ``concurrency`` threads of this process until stopped.
+
+    Args:
+        worker_id: Supervisor slot, used in the worker names
+        concurrency: Number of jobs this process runs at once
+
+    Returns:
+        Process exit code: 0 after a requested stop, 1 if a worker thread died
+    """
+    # Load models, index handles and graphs once, before any job arrives
+    from app.common import core
+    import app.worker.batch_worker  # noqa: F401
+    import app.worker.chat_worker  # noqa: F401
+
+    core.warm_up()
+    core.watch_snapshots()
+
+    base_name = f"{socket.gethostname()}.{os.getpid()}.{worker_id}"
+    workers: List[ThreadWorker] = [
+        ThreadWorker(
+            ["chat_tasks", "prefetch_tasks"], connection=redis_conn, name=f"{base_name}.{i}", worker_ttl=THREAD_WORKER_TTL
+        )
+        for i in range(concurrency)
+    ]
+    threads = [
+        threading.Thread(target=worker.work, kwargs={"logging_level": "INFO"}, name=worker.name, daemon=True)
+        for worker in workers
+    ]
+    stopping = threading.Event()
+
+    def request_stop(signum=None, frame=None):
+        if not stopping.is_set():
+            logger.info(f"Worker {worker_id}: finishing in-flight jobs before exiting")
+        stopping.set()
+        for worker in workers:
+            # Checked by RQ's work loop between jobs
+            worker._stop_requested = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    for thread in threads:
+        thread.start()
+    logger.info(f"Worker {worker_id}: serving chat_tasks with {concurrency} threads")
+
+    exit_code = 0
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+            if not thread.is_alive() and not stopping.is_set():
+                # Let the supervisor restart a whole, healthy process
+                logger.error(f"Worker {worker_id}: thread {thread.name} exited unexpectedly")
+                exit_code = 1
+                request_stop()
+    return exit_code
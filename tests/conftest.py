@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    """An in-memory Redis swapped in for the shared connection."""
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.common import circuit_breaker, task_manager
+
+    conn = fakeredis.FakeRedis()
+    monkeypatch.setattr(task_manager, "redis_conn", conn)
+    monkeypatch.setattr(circuit_breaker, "redis_conn", conn)
+    return conn
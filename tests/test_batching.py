@@ -0,0 +1,71 @@
+import pytest
+
+from app.common import batching
+
+
+def padded(bucket, lengths):
+    return len(bucket) * max(lengths[i] for i in bucket)
+
+
+def test_every_input_lands_in_exactly_one_bucket_shortest_first():
+    lengths = [40, 5, 300, 12, 12, 80, 7, 500]
+
+    buckets = batching.plan_buckets(lengths, max_tokens=1000, max_items=8)
+
+    flat = [i for bucket in buckets for i in bucket]
+    assert sorted(flat) == list(range(len(lengths)))
+    assert [lengths[i] for i in flat] == sorted(lengths)
+
+
+@pytest.mark.parametrize("max_tokens,max_items", [(64, 128), (256, 3), (1000, 128)])
+def test_buckets_respect_token_and_item_limits(max_tokens, max_items):
+    lengths = [3, 9, 14, 14, 15, 20, 21, 22, 30, 31, 32, 60, 64]
+
+    for bucket in batching.plan_buckets(lengths, max_tokens=max_tokens, max_items=max_items):
+        assert len(bucket) <= max_items
+        # A single input longer than the budget still gets its own bucket
+        assert len(bucket) == 1 or padded(bucket, lengths) <= max_tokens
+
+
+def test_length_jump_starts_a_new_bucket(monkeypatch):
+    monkeypatch.setattr(batching, "MIN_BATCH_ITEMS", 2)
+    monkeypatch.setattr(batching, "BATCH_LENGTH_RATIO", 1.5)
+    lengths = [10, 10, 11, 40, 41]
+
+    buckets = batching.plan_buckets(lengths, max_tokens=10_000, max_items=100)
+
+    assert buckets == [[0, 1, 2], [3, 4]]
+
+
+def test_small_buckets_are_not_split_on_length(monkeypatch):
+    monkeypatch.setattr(batching, "MIN_BATCH_ITEMS", 4)
+    lengths = [10, 40, 41]
+
+    assert batching.plan_buckets(lengths, max_tokens=10_000, max_items=100) == [[0, 1, 2]]
+
+
+def test_run_bucketed_restores_input_order_and_counts_padding():
+    inputs = ["ccc", "a", "bb", "dddd"]
+    lengths = [3, 1, 2, 4]
+    seen = []
+
+    def infer(batch):
+        seen.append(batch)
+        return [text.upper() for text in batch]
+
+    outputs, stats = batching.run_bucketed("test", inputs, lengths, infer, max_tokens=4, max_items=10)
+
+    assert outputs == ["CCC", "A", "BB", "DDDD"]
+    assert seen == [["a", "bb"], ["ccc"], ["dddd"]]
+    assert stats.batches == 3
+    assert stats.tokens == 10
+    assert stats.padded_tokens == 2 * 2 + 3 + 4
+    assert stats.padding_waste == pytest.approx(1 - 10 / 11)
+    assert batching.inference_stats()["test"]["items"] >= 4
+
+
+def test_estimated_token_lengths_without_a_tokenizer():
+    class Model:
+        max_seq_length = 8
+
+    assert batching.token_lengths(Model(), ["", "x" * 8, "x" * 400]) == [2, 4, 8]
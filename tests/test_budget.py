@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+# core opens the index and loads the models on import
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+from app.common import core  # noqa: E402
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(core, "LLM_MIN_MS", 2000.0)
+    monkeypatch.setattr(core, "LLM_TOKENS_PER_SECOND", 30.0)
+    monkeypatch.setattr(core, "LLM_MAX_TOKENS", 0)
+    monkeypatch.setattr(core.time, "time", lambda: 1000.0)
+
+
+def test_no_deadline_means_no_budget(budget):
+    assert core.remaining_ms(None) is None
+    assert core.remaining_ms(0) is None
+    assert core.budget_llm_call(None) == ({}, [])
+
+
+def test_remaining_ms_counts_down_to_the_deadline(budget):
+    assert core.remaining_ms(1002.5) == pytest.approx(2500.0)
+    assert core.remaining_ms(999.0) == pytest.approx(-1000.0)
+
+
+def test_llm_is_skipped_below_its_minimum(budget):
+    assert core.budget_llm_call(1001.999) == (None, ["skip_llm"])
+    assert core.budget_llm_call(990.0) == (None, ["skip_llm"])
+
+
+def test_short_budget_caps_max_tokens_and_sets_the_timeout(budget):
+    options, degradations = core.budget_llm_call(1010.0)
+
+    assert options == {"timeout": pytest.approx(10.0), "max_tokens": 300}
+    assert degradations == ["llm_max_tokens:300"]
+
+
+def test_long_budget_only_sets_the_timeout(budget):
+    options, degradations = core.budget_llm_call(1000.0 + 60)
+
+    assert options == {"timeout": pytest.approx(60.0)}
+    assert degradations == []
+
+
+def test_configured_max_tokens_is_the_cap_to_beat(budget, monkeypatch):
+    monkeypatch.setattr(core, "LLM_MAX_TOKENS", 256)
+
+    options, _ = core.budget_llm_call(1010.0)
+
+    assert "max_tokens" not in options
+
+
+@pytest.mark.parametrize(
+    "degradations,note",
+    [
+        (["llm_circuit_open", "passages_only"], "LLM_UNAVAILABLE_NOTE"),
+        (["llm_error"], "LLM_UNAVAILABLE_NOTE"),
+        (["skip_llm"], "BUDGET_NOTE"),
+        (["skip_rerank", "passages_only"], "BUDGET_NOTE"),
+        ([], "NO_LLM_NOTE"),
+    ],
+)
+def test_fallback_note_explains_the_real_cause(monkeypatch, degradations, note):
+    monkeypatch.setattr(core, "USE_LLM", True)
+
+    assert core.fallback_note(degradations) == getattr(core, note)
+
+
+def test_fallback_note_without_an_llm(monkeypatch):
+    monkeypatch.setattr(core, "USE_LLM", False)
+
+    assert core.fallback_note(["skip_llm"]) == core.NO_LLM_NOTE
+
+
+def test_deadline_in_the_past_skips_the_llm():
+    assert core.budget_llm_call(time.time() - 1) == (None, ["skip_llm"])
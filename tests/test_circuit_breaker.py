@@ -0,0 +1,107 @@
+import pytest
+
+from app.common import circuit_breaker
+from app.common.circuit_breaker import CircuitBreaker, CircuitState
+
+
+@pytest.fixture
+def breaker(redis_conn, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CB_MIN_CALLS", 4)
+    monkeypatch.setattr(circuit_breaker, "CB_FAILURE_RATE", 0.5)
+    return CircuitBreaker("upstream", slow_call_ms=100)
+
+
+def call(breaker, success=True, elapsed_ms=10.0):
+    ticket = breaker.allow()
+    assert ticket is not None
+    breaker.record(ticket, success, elapsed_ms)
+    return ticket
+
+
+def trip(breaker):
+    for _ in range(circuit_breaker.CB_MIN_CALLS):
+        call(breaker, success=False)
+
+
+def test_opens_once_min_calls_and_failure_rate_are_reached(breaker):
+    for _ in range(circuit_breaker.CB_MIN_CALLS - 1):
+        call(breaker, success=False)
+    assert breaker.status()["state"] == CircuitState.CLOSED
+
+    # Only a failure re-evaluates the rate
+    call(breaker)
+    assert breaker.status()["state"] == CircuitState.CLOSED
+    call(breaker, success=False)
+    assert breaker.status()["state"] == CircuitState.OPEN
+    assert breaker.status()["reason"] == "4/5 calls failed or were slow"
+
+
+def test_successes_keep_it_closed(breaker):
+    for _ in range(3):
+        call(breaker)
+    for _ in range(2):
+        call(breaker, success=False)
+
+    status = breaker.status()
+    assert status["state"] == CircuitState.CLOSED
+    assert status["recent_calls"] == 5
+    assert status["recent_failure_rate"] == 0.4
+
+
+def test_slow_calls_count_as_failures(breaker):
+    for _ in range(circuit_breaker.CB_MIN_CALLS):
+        call(breaker, success=True, elapsed_ms=500)
+
+    assert breaker.status()["state"] == CircuitState.OPEN
+    assert breaker.allow() is None
+
+
+def test_open_breaker_rejects_until_open_seconds_pass(breaker, monkeypatch):
+    trip(breaker)
+    assert breaker.allow() is None
+
+    monkeypatch.setattr(circuit_breaker, "CB_OPEN_SECONDS", 0)
+    assert breaker.allow() == "probe"
+    assert breaker.status()["state"] == CircuitState.HALF_OPEN
+    # Only one probe at a time
+    assert breaker.allow() is None
+
+
+def test_successful_probe_closes_and_clears_the_window(breaker, monkeypatch):
+    trip(breaker)
+    monkeypatch.setattr(circuit_breaker, "CB_OPEN_SECONDS", 0)
+
+    breaker.record(breaker.allow(), True, 10.0)
+
+    status = breaker.status()
+    assert status["state"] == CircuitState.CLOSED
+    assert status["recent_calls"] == 0
+    assert breaker.allow() == CircuitState.CLOSED
+
+
+def test_failed_or_slow_probe_reopens(breaker, monkeypatch):
+    trip(breaker)
+    monkeypatch.setattr(circuit_breaker, "CB_OPEN_SECONDS", 0)
+    breaker.record(breaker.allow(), False, 10.0)
+    assert breaker.status()["state"] == CircuitState.OPEN
+
+    breaker.record(breaker.allow(), True, 500.0)
+    assert breaker.status()["state"] == CircuitState.OPEN
+    assert breaker.status()["reason"] == "probe failed"
+
+
+def test_released_probe_lets_another_caller_probe(breaker, monkeypatch):
+    trip(breaker)
+    monkeypatch.setattr(circuit_breaker, "CB_OPEN_SECONDS", 0)
+    ticket = breaker.allow()
+
+    breaker.release(ticket)
+
+    assert breaker.allow() == "probe"
+
+
+def test_breakers_share_state_through_redis(breaker):
+    trip(breaker)
+
+    assert CircuitBreaker("upstream", slow_call_ms=100).allow() is None
+    assert CircuitBreaker("other", slow_call_ms=100).allow() == CircuitState.CLOSED
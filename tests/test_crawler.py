@@ -0,0 +1,166 @@
+import email.utils
+import hashlib
+import os
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from app import crawler
+
+FIXTURES = Path(__file__).parent / "fixtures" / "site"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serve files under ``server.root`` with the validators selected by ``server.mode``.
+
+    ``mode`` is ``"etag"``, ``"last-modified"`` or ``"none"``; each request is logged
+    to ``server.log`` as ``(path, If-None-Match, If-Modified-Since, status)``.
+    """
+
+    def do_GET(self):
+        server = self.server
+        path = server.root / self.path.lstrip("/")
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if not path.is_file():
+            status, body, headers = 404, b"not found", {}
+        else:
+            body = path.read_bytes()
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            mtime = int(path.stat().st_mtime)
+            headers = {}
+            status = 200
+            if server.mode == "etag":
+                headers["ETag"] = etag
+                if if_none_match == etag:
+                    status = 304
+            elif server.mode == "last-modified":
+                headers["Last-Modified"] = email.utils.formatdate(mtime, usegmt=True)
+                if if_modified_since:
+                    since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+                    if mtime <= since:
+                        status = 304
+        server.log.append((self.path, if_none_match, if_modified_since, status))
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / "site"
+    shutil.copytree(FIXTURES, root)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.root = root
+    server.mode = "etag"
+    server.log = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = "http://127.0.0.1:%d" % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def crawl(site, cache=None, **kwargs):
+    site.log.clear()
+    pages = crawler.crawl_sync([site.base_url + "/docs/index.html"], cache=cache, **kwargs)
+    return {page.url[len(site.base_url):]: page for page in pages}
+
+
+def touch_later(path: Path, text: str) -> None:
+    """Rewrite ``path`` with an mtime well past the cached Last-Modified."""
+    path.write_text(text, encoding="utf-8")
+    later = path.stat().st_mtime + 60
+    os.utime(path, (later, later))
+
+
+def test_follows_links_only_within_seed_directory(site):
+    pages = crawl(site)
+
+    assert set(pages) == {"/docs/index.html", "/docs/a.html", "/docs/b.html"}
+    assert all(page.html and not page.not_modified for page in pages.values())
+    assert "/other/x.html" not in {path for path, *_ in site.log}
+
+
+def test_allowed_prefixes_widen_the_crawl(site):
+    pages = crawl(site, allowed_prefixes=[site.base_url + "/"])
+
+    assert set(pages) == {"/docs/index.html", "/docs/a.html", "/docs/b.html", "/other/x.html"}
+
+
+def test_stops_at_max_pages(site):
+    pages = crawl(site, max_pages=2)
+
+    assert len(pages) == 2
+    assert "/docs/index.html" in pages
+    assert len(site.log) == 2
+
+
+@pytest.mark.parametrize("mode", ["etag", "last-modified"])
+def test_second_run_revalidates_and_skips_unchanged_pages(site, tmp_path, mode):
+    site.mode = mode
+    cache_path = tmp_path / "crawl_cache.json"
+    cache = crawler.CrawlCache(cache_path)
+    crawl(site, cache=cache)
+    cache.save()
+
+    touch_later(site.root / "docs" / "a.html", "<html><body><h1>Users</h1><p>Rewritten.</p></body></html>")
+    pages = crawl(site, cache=crawler.CrawlCache(cache_path))
+
+    assert "Rewritten." in pages["/docs/a.html"].html
+    for path in ("/docs/index.html", "/docs/b.html"):
+        assert pages[path].not_modified and pages[path].html is None
+    # Links of a 304 page come from the cache, so b.html is still reached
+    assert set(pages) == {"/docs/index.html", "/docs/a.html", "/docs/b.html"}
+    header = 1 if mode == "etag" else 2
+    assert all(entry[header] for entry in site.log)
+    assert sorted(status for *_, status in site.log) == [200, 304, 304]
+
+
+def test_unchanged_content_is_skipped_without_validators(site, tmp_path):
+    site.mode = "none"
+    cache = crawler.CrawlCache(tmp_path / "crawl_cache.json")
+    crawl(site, cache=cache)
+
+    touch_later(site.root / "docs" / "b.html", "<html><body><h1>Tokens</h1><p>Changed.</p></body></html>")
+    pages = crawl(site, cache=cache)
+
+    assert [status for *_, status in site.log] == [200, 200, 200]
+    assert pages["/docs/index.html"].not_modified and pages["/docs/a.html"].not_modified
+    assert "Changed." in pages["/docs/b.html"].html
+
+
+def test_revalidate_false_fetches_every_page(site, tmp_path):
+    cache = crawler.CrawlCache(tmp_path / "crawl_cache.json")
+    crawl(site, cache=cache)
+
+    pages = crawl(site, cache=cache, revalidate=False)
+
+    assert all(page.html and not page.not_modified for page in pages.values())
+    assert all(entry[1] is None and entry[2] is None for entry in site.log)
+
+
+def test_removed_page_is_reported_gone(site, tmp_path):
+    cache = crawler.CrawlCache(tmp_path / "crawl_cache.json")
+    crawl(site, cache=cache)
+
+    (site.root / "docs" / "b.html").unlink()
+    pages = crawl(site, cache=cache)
+
+    assert pages["/docs/b.html"].gone and pages["/docs/b.html"].html is None
+    assert not pages["/docs/a.html"].gone
@@ -0,0 +1,76 @@
+import json
+
+from app import dedupe
+
+BODY = (
+    "To reset multi-factor authentication for a user, open the admin portal, select the user, "
+    "choose the token tab and click reset. The user is asked to enrol a new token at the next login "
+    "and the old token stops working immediately."
+)
+
+
+def chunk(text, source, index=0, **meta):
+    return text, {"source": source, "chunk": index, **meta}
+
+
+def chunk_id(meta):
+    return f"{meta['source']}::{meta['chunk']}"
+
+
+def test_exact_duplicates_ignore_case_and_whitespace():
+    docs = [chunk(BODY, "a"), chunk("  " + BODY.upper().replace(" ", "   "), "b"), chunk("Unrelated text.", "c")]
+
+    kept, dropped, stats = dedupe.dedupe_chunks(docs, chunk_id=chunk_id)
+
+    assert [meta["source"] for _, meta in kept] == ["a", "c"]
+    assert json.loads(kept[0][1]["alternate_sources"]) == ["b"]
+    assert kept[0][1]["duplicate_count"] == 1
+    assert dropped == ["b::0"]
+    assert stats == {"input": 3, "kept": 2, "exact_duplicates": 1, "near_duplicates": 0}
+
+
+def test_near_duplicates_collapse_into_the_first_chunk():
+    reworded = BODY.replace("immediately", "right away")
+    docs = [chunk(BODY, "a"), chunk("Something else entirely about directory sync.", "b"), chunk(reworded, "c")]
+
+    kept, dropped, stats = dedupe.dedupe_chunks(docs, threshold=0.7, chunk_id=chunk_id)
+
+    assert [meta["source"] for _, meta in kept] == ["a", "b"]
+    assert dropped == ["c::0"]
+    assert stats["near_duplicates"] == 1
+
+
+def test_threshold_one_only_removes_exact_duplicates():
+    reworded = BODY.replace("immediately", "right away")
+
+    kept, _, stats = dedupe.dedupe_chunks([chunk(BODY, "a"), chunk(reworded, "b")], threshold=1.0)
+
+    assert len(kept) == 2
+    assert stats["near_duplicates"] == 0
+
+
+def test_faq_duplicates_record_the_other_questions():
+    docs = [
+        chunk(BODY, "faq#reset", question="How do I reset MFA?"),
+        chunk(BODY, "faq#lost", question="I lost my token, what now?"),
+    ]
+
+    kept, _, _ = dedupe.dedupe_chunks(docs)
+
+    assert json.loads(kept[0][1]["alternate_questions"]) == ["I lost my token, what now?"]
+
+
+def test_dropped_ids_skip_ids_a_kept_chunk_shares():
+    # FAQ answers without anchors share their page URL as source
+    docs = [chunk(BODY, "faq"), chunk(BODY, "faq"), chunk(BODY, "other", 2)]
+
+    kept, dropped, _ = dedupe.dedupe_chunks(docs, chunk_id=chunk_id)
+
+    assert len(kept) == 1
+    assert dropped == ["other::2"]
+
+
+def test_without_chunk_id_no_ids_are_returned():
+    _, dropped, _ = dedupe.dedupe_chunks([chunk(BODY, "a"), chunk(BODY, "b")])
+
+    assert dropped == []
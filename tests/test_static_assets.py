@@ -0,0 +1,131 @@
+import gzip
+import os
+
+import pytest
+from starlette.requests import Request
+
+from app.api import static_assets
+from app.api.static_assets import StaticAssets
+
+SCRIPT = "function greet(name) { return 'Hello, ' + name; }\n" * 40
+
+
+def request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+@pytest.fixture
+def roots(tmp_path):
+    source, dist = tmp_path / "static", tmp_path / "dist"
+    source.mkdir()
+    dist.mkdir()
+    (source / "chat.js").write_text(SCRIPT, encoding="utf-8")
+    (source / "index.html").write_text("<html></html>", encoding="utf-8")
+    (dist / "chat.0123abcd.js").write_text(SCRIPT, encoding="utf-8")
+    (tmp_path / "secret.txt").write_text("secret", encoding="utf-8")
+    return source, dist
+
+
+@pytest.fixture
+def assets(roots):
+    source, dist = roots
+    return StaticAssets(dist, source)
+
+
+def test_negotiates_gzip_and_keeps_an_etag_per_encoding(assets):
+    plain = assets.response(request(), "chat.js")
+    zipped = assets.response(request(accept_encoding="gzip, deflate"), "chat.js")
+
+    assert plain.body == SCRIPT.encode()
+    assert "content-encoding" not in plain.headers
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(zipped.body) == SCRIPT.encode()
+    assert zipped.headers["etag"] != plain.headers["etag"]
+    assert zipped.headers["vary"] == "Accept-Encoding"
+
+
+def test_prefers_brotli_when_available(assets):
+    if static_assets.brotli is None:
+        pytest.skip("brotli is not installed")
+    response = assets.response(request(accept_encoding="gzip, br"), "chat.js")
+
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_zero_quality_refuses_an_encoding(assets):
+    response = assets.response(request(accept_encoding="gzip;q=0, br;q=0"), "chat.js")
+
+    assert "content-encoding" not in response.headers
+
+
+def test_small_files_are_not_compressed(assets):
+    response = assets.response(request(accept_encoding="gzip"), "index.html")
+
+    assert "content-encoding" not in response.headers
+    assert response.headers["cache-control"] == "no-cache"
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", 'W/{etag}', '"other", {etag}', "*"])
+def test_matching_if_none_match_returns_304(assets, if_none_match):
+    etag = assets.response(request(accept_encoding="gzip"), "chat.js").headers["etag"]
+
+    response = assets.response(request(accept_encoding="gzip", if_none_match=if_none_match.format(etag=etag)), "chat.js")
+
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
+
+
+def test_etag_of_another_encoding_does_not_match(assets):
+    gzip_etag = assets.response(request(accept_encoding="gzip"), "chat.js").headers["etag"]
+
+    response = assets.response(request(if_none_match=gzip_etag), "chat.js")
+
+    assert response.status_code == 200
+
+
+def test_cache_control_by_name(assets):
+    assert "immutable" in assets.response(request(), "chat.0123abcd.js").headers["cache-control"]
+    assert assets.response(request(), "chat.js").headers["cache-control"] == (
+        f"public, max-age={static_assets.STATIC_MAX_AGE}"
+    )
+
+
+def test_build_output_wins_over_sources(roots):
+    source, dist = roots
+    (dist / "chat.js").write_text("minified", encoding="utf-8")
+
+    assert StaticAssets(dist, source).response(request(), "chat.js").body == b"minified"
+
+
+def test_precompressed_sibling_is_served_when_current(roots, assets):
+    source, _ = roots
+    sibling = source / "chat.js.gz"
+    sibling.write_bytes(gzip.compress(b"prebuilt"))
+    later = (source / "chat.js").stat().st_mtime + 10
+    os.utime(sibling, (later, later))
+
+    response = assets.response(request(accept_encoding="gzip"), "chat.js")
+
+    assert gzip.decompress(response.body) == b"prebuilt"
+
+
+def test_edited_file_is_reloaded(roots, assets):
+    source, _ = roots
+    first = assets.response(request(), "chat.js").headers["etag"]
+    path = source / "chat.js"
+    path.write_text(SCRIPT + "// edited\n", encoding="utf-8")
+    later = path.stat().st_mtime + 10
+    os.utime(path, (later, later))
+
+    assert assets.response(request(), "chat.js").headers["etag"] != first
+
+
+@pytest.mark.parametrize("name", ["../secret.txt", "missing.js", ""])
+def test_unknown_or_escaping_paths_are_not_served(assets, name):
+    assert assets.response(request(), name) is None
@@ -0,0 +1,105 @@
+import json
+import time
+import zlib
+
+import pytest
+
+from app.common import task_manager
+
+SOURCES = [{"index": 1, "url": "https://docs.example.com/faq#mfa", "title": "FAQ"}]
+
+
+def make_result(answer: str = "Reset it from the portal.", citations=SOURCES):
+    return {"question": "How do I reset MFA?", "answer": answer, "sources": SOURCES, "citations": citations}
+
+
+def stored_bytes(redis_conn) -> int:
+    return sum(int(size) for size in redis_conn.hvals(task_manager.RESULT_SIZES_KEY))
+
+
+def test_small_result_is_stored_uncompressed_with_citations_folded():
+    blob = task_manager._encode_result(make_result())
+
+    assert blob[0] == task_manager._CITATIONS_ARE_SOURCES
+    assert "citations" not in json.loads(blob[1:])
+    assert task_manager._decode_result(blob) == make_result()
+
+
+def test_large_result_is_compressed():
+    result = make_result(answer="Open the admin portal and reset the token. " * 50)
+    blob = task_manager._encode_result(result)
+
+    assert blob[0] == task_manager._COMPRESSED | task_manager._CITATIONS_ARE_SOURCES
+    assert json.loads(zlib.decompress(blob[1:]))["answer"] == result["answer"]
+    assert len(blob) < len(json.dumps(result))
+    assert task_manager._decode_result(blob) == result
+
+
+def test_distinct_citations_are_kept():
+    result = make_result(citations=[])
+    blob = task_manager._encode_result(result)
+
+    assert blob[0] == 0
+    assert task_manager._decode_result(blob) == result
+
+
+def test_store_and_fetch_keep_the_byte_accounting(redis_conn):
+    task_manager.store_task_result("a", make_result())
+    task_manager.store_task_result("b", make_result(answer="x" * 1000))
+    # A retried job replaces its earlier result
+    task_manager.store_task_result("a", make_result(answer="y" * 600))
+
+    stats = task_manager.result_store_stats()
+    assert stats["entries"] == 2
+    assert stats["stored"] == 3
+    assert stats["bytes"] == stored_bytes(redis_conn)
+    assert task_manager.get_task_result("a")["answer"] == "y" * 600
+    assert task_manager.get_task_result("missing") is None
+
+
+def test_first_read_shortens_ttl_and_expiry_score(redis_conn):
+    task_manager.store_task_result("a", make_result())
+    before = redis_conn.zscore(task_manager.RESULT_INDEX_KEY, "a")
+
+    task_manager.get_task_result("a")
+    task_manager.get_task_result("a")
+
+    assert redis_conn.ttl("task_result:a") <= task_manager.TASK_RESULT_FETCHED_TTL
+    after = redis_conn.zscore(task_manager.RESULT_INDEX_KEY, "a")
+    assert after < before
+    assert after == pytest.approx(time.time() + task_manager.TASK_RESULT_FETCHED_TTL, abs=5)
+    assert task_manager.result_store_stats()["fetched"] == 1
+
+
+def test_eviction_removes_results_closest_to_expiry_first(redis_conn, monkeypatch):
+    monkeypatch.setattr(task_manager, "TASK_RESULT_COMPRESS_MIN", 10**9)
+    for task_id in ("a", "b", "c"):
+        task_manager.store_task_result(task_id, make_result(answer=task_id * 400))
+    one_result = stored_bytes(redis_conn) // 3
+    # Already read, so it expires first
+    task_manager.get_task_result("b")
+    monkeypatch.setattr(task_manager, "TASK_RESULT_MAX_BYTES", one_result * 3)
+
+    task_manager.store_task_result("d", make_result(answer="d" * 400))
+
+    assert redis_conn.get("task_result:b") is None
+    assert all(redis_conn.get(f"task_result:{task_id}") for task_id in ("a", "c", "d"))
+    stats = task_manager.result_store_stats()
+    assert stats["evicted"] == 1
+    assert stats["evicted_bytes"] == one_result
+    assert stats["bytes"] == stored_bytes(redis_conn) <= task_manager.TASK_RESULT_MAX_BYTES
+
+
+def test_expired_results_leave_the_accounting(redis_conn, monkeypatch):
+    task_manager.store_task_result("a", make_result())
+    # Redis expired the key on its own; only the index still remembers it
+    redis_conn.delete("task_result:a")
+    monkeypatch.setattr(
+        task_manager.time, "time", lambda real=time.time: real() + task_manager.TASK_RESULT_TTL + 1
+    )
+
+    stats = task_manager.result_store_stats()
+
+    assert stats["entries"] == 0
+    assert stats["bytes"] == 0
+    assert stats["evicted"] == 0